@@ -0,0 +1,257 @@
+"""
+Bandeja de salida persistente para los efectos secundarios (registro en MySQL y avisos a RRHH).
+En la ruta del mensaje solo se agrega la intención a un archivo SQLite local (WAL);
+un grupo de hilos la entrega después con reintentos, por lotes y sin duplicados: cada
+intención tiene una clave de idempotencia (p. ej. el id del mensaje de WhatsApp, que
+Meta reenvía si el webhook tarda) y una clave repetida se ignora. La clave también
+viaja al destino, que debe descartar las repetidas: si el proceso se cae entre la
+entrega y la marca de entregada, la intención se vuelve a entregar al reiniciar.
+Si MySQL o el correo están caídos, las intenciones esperan en el archivo en vez de perderse.
+
+Uso:
+    python bandeja_salida.py                      -> estado de la bandeja
+    python bandeja_salida.py --reintentar-fallidas
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+import threading
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+RUTA_BANDEJA_SALIDA = os.getenv("RUTA_BANDEJA_SALIDA", os.path.join("db_politicas", "bandeja_salida.sqlite"))
+HILOS_BANDEJA = int(os.getenv("HILOS_BANDEJA", 2))
+TAMANO_LOTE_BANDEJA = int(os.getenv("TAMANO_LOTE_BANDEJA", 50))
+# Reintentos con espera exponencial: 2 s, 4 s, 8 s... hasta 10 minutos entre intentos
+MAX_INTENTOS_BANDEJA = int(os.getenv("MAX_INTENTOS_BANDEJA", 30))
+ESPERA_BASE_REINTENTO = 2.0
+ESPERA_MAX_REINTENTO = 600.0
+# Cada cuánto revisan los hilos si hay intenciones listas cuando nadie los despierta
+INTERVALO_BANDEJA = 1.0
+# Las entregadas se conservan un tiempo para seguir reconociendo sus claves
+RETENCION_ENTREGADAS_HORAS = float(os.getenv("RETENCION_ENTREGADAS_HORAS", 72))
+
+
+class BandejaSalida:
+    """
+    Intenciones por tipo en SQLite. `entregadores` es {tipo: funcion(lista_de_datos, claves)};
+    la función recibe un lote con sus claves de idempotencia y lanza una excepción si no
+    pudo entregarlo. `tamanos_lote` limita el lote por tipo (p. ej. 1 para los correos).
+    Es seguro usarla desde varios hilos.
+    """
+
+    def __init__(self, entregadores=None, ruta=RUTA_BANDEJA_SALIDA, hilos=HILOS_BANDEJA,
+                 tamanos_lote=None, max_intentos=MAX_INTENTOS_BANDEJA):
+        self.entregadores = entregadores or {}
+        self.tamanos_lote = tamanos_lote or {}
+        self.n_hilos = hilos
+        self.max_intentos = max_intentos
+        self.hilos = []
+        self.duplicadas = 0
+        self._lock = threading.Lock()
+        self._aviso = threading.Event()
+        self._detener = threading.Event()
+        self._ultima_purga = 0.0
+
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(ruta, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS intenciones (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                clave TEXT NOT NULL UNIQUE,
+                tipo TEXT NOT NULL,
+                datos TEXT NOT NULL,
+                estado TEXT NOT NULL,
+                intentos INTEGER NOT NULL,
+                proximo_intento REAL NOT NULL,
+                creada REAL NOT NULL,
+                entregada REAL,
+                error TEXT
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_intenciones_pendientes ON intenciones (estado, tipo, proximo_intento)")
+        self._conn.commit()
+
+    # --------------------------------------------------------------------------
+    # Ruta del mensaje
+    # --------------------------------------------------------------------------
+    def registrar(self, tipo, datos, clave=None):
+        """Agrega una intención; devuelve False si la clave ya estaba registrada."""
+        ahora = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO intenciones (clave, tipo, datos, estado, intentos, proximo_intento, creada) "
+                "VALUES (?, ?, ?, 'pendiente', 0, ?, ?)",
+                (clave or uuid.uuid4().hex, tipo, json.dumps(datos, ensure_ascii=False), ahora, ahora)
+            )
+            self._conn.commit()
+            nueva = cursor.rowcount == 1
+            if not nueva:
+                self.duplicadas += 1
+        self._aviso.set()
+        return nueva
+
+    # --------------------------------------------------------------------------
+    # Entrega
+    # --------------------------------------------------------------------------
+    def _reclamar(self, tipo):
+        """Marca como 'en_proceso' y devuelve el próximo lote listo de un tipo."""
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT id, datos, intentos, clave FROM intenciones "
+                "WHERE estado = 'pendiente' AND tipo = ? AND proximo_intento <= ? ORDER BY id LIMIT ?",
+                (tipo, time.time(), self.tamanos_lote.get(tipo, TAMANO_LOTE_BANDEJA))
+            ).fetchall()
+            if filas:
+                self._conn.executemany("UPDATE intenciones SET estado = 'en_proceso' WHERE id = ?", [(f[0],) for f in filas])
+                self._conn.commit()
+        return filas
+
+    def _marcar_entregadas(self, filas):
+        ahora = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE intenciones SET estado = 'entregada', entregada = ?, error = NULL WHERE id = ?",
+                [(ahora, f[0]) for f in filas]
+            )
+            self._conn.commit()
+
+    def _marcar_fallida(self, fila, error):
+        id_intencion, _, intentos, _ = fila
+        intentos += 1
+        estado = "fallida" if intentos >= self.max_intentos else "pendiente"
+        espera = min(ESPERA_BASE_REINTENTO * 2 ** (intentos - 1), ESPERA_MAX_REINTENTO)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE intenciones SET estado = ?, intentos = ?, proximo_intento = ?, error = ? WHERE id = ?",
+                (estado, intentos, time.time() + espera, str(error)[:500], id_intencion)
+            )
+            self._conn.commit()
+        if estado == "fallida":
+            print(f"❌ Intención {id_intencion} descartada tras {intentos} intentos: {error}")
+
+    def _devolver_pendientes(self, filas, espera):
+        """Devuelve a 'pendiente' intenciones que no se llegaron a intentar, sin gastar un intento."""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE intenciones SET estado = 'pendiente', proximo_intento = ? WHERE id = ?",
+                [(time.time() + espera, f[0]) for f in filas]
+            )
+            self._conn.commit()
+
+    def _entregar(self, tipo, filas):
+        entregador = self.entregadores[tipo]
+        try:
+            entregador([json.loads(f[1]) for f in filas], [f[3] for f in filas])
+            self._marcar_entregadas(filas)
+            return
+        except Exception as e:
+            if len(filas) == 1:
+                self._marcar_fallida(filas[0], e)
+                return
+            print(f"⚠️ Falló un lote de {len(filas)} intenciones '{tipo}', se entregan una por una: {e}")
+        # Una sola intención defectuosa no debe bloquear al resto del lote; dos fallas
+        # seguidas indican que el destino está caído y el resto se deja para el reintento
+        fallas_seguidas = 0
+        for i, fila in enumerate(filas):
+            try:
+                entregador([json.loads(fila[1])], [fila[3]])
+                self._marcar_entregadas([fila])
+                fallas_seguidas = 0
+            except Exception as e:
+                self._marcar_fallida(fila, e)
+                fallas_seguidas += 1
+                if fallas_seguidas == 2:
+                    self._devolver_pendientes(filas[i + 1:], ESPERA_BASE_REINTENTO)
+                    return
+
+    def _purgar(self):
+        if time.time() - self._ultima_purga < 3600:
+            return
+        self._ultima_purga = time.time()
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM intenciones WHERE estado = 'entregada' AND entregada < ?",
+                (time.time() - RETENCION_ENTREGADAS_HORAS * 3600,)
+            )
+            self._conn.commit()
+
+    def _trabajar(self):
+        while not self._detener.is_set():
+            hubo_trabajo = False
+            for tipo in self.entregadores:
+                filas = self._reclamar(tipo)
+                if filas:
+                    hubo_trabajo = True
+                    self._entregar(tipo, filas)
+            self._purgar()
+            if not hubo_trabajo:
+                self._aviso.wait(INTERVALO_BANDEJA)
+                self._aviso.clear()
+
+    def iniciar(self):
+        if self.hilos:
+            return
+        # Lo que quedó 'en_proceso' al caerse el proceso anterior vuelve a la cola
+        with self._lock:
+            self._conn.execute("UPDATE intenciones SET estado = 'pendiente' WHERE estado = 'en_proceso'")
+            self._conn.commit()
+        self._detener.clear()
+        for i in range(self.n_hilos):
+            hilo = threading.Thread(target=self._trabajar, name=f"bandeja_salida_{i}", daemon=True)
+            hilo.start()
+            self.hilos.append(hilo)
+
+    def detener(self, espera=10.0):
+        """Detiene los hilos tras el lote en curso; lo pendiente se entrega al volver a iniciar."""
+        self._detener.set()
+        self._aviso.set()
+        for hilo in self.hilos:
+            hilo.join(espera)
+        self.hilos = []
+
+    def reintentar_fallidas(self):
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE intenciones SET estado = 'pendiente', intentos = 0, proximo_intento = ? WHERE estado = 'fallida'",
+                (time.time(),)
+            )
+            self._conn.commit()
+        self._aviso.set()
+        return cursor.rowcount
+
+    def estadisticas(self):
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT tipo, estado, COUNT(*), MIN(creada) FROM intenciones GROUP BY tipo, estado"
+            ).fetchall()
+        por_tipo = {}
+        for tipo, estado, cantidad, mas_antigua in filas:
+            datos = por_tipo.setdefault(tipo, {})
+            datos[estado] = cantidad
+            if estado == "pendiente":
+                datos["segundos_pendiente_mas_antigua"] = round(time.time() - mas_antigua, 1)
+        return {"por_tipo": por_tipo, "claves_duplicadas": self.duplicadas, "hilos": len(self.hilos)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estado de la bandeja de salida.")
+    parser.add_argument("--reintentar-fallidas", action="store_true",
+                        help="vuelve a poner en cola las intenciones que agotaron sus intentos")
+    args = parser.parse_args()
+
+    if not os.path.exists(RUTA_BANDEJA_SALIDA):
+        print(f"No existe la bandeja '{RUTA_BANDEJA_SALIDA}'.")
+        sys.exit(1)
+    bandeja = BandejaSalida()
+    if args.reintentar_fallidas:
+        print(f"{bandeja.reintentar_fallidas()} intenciones vuelven a la cola.")
+    print(json.dumps(bandeja.estadisticas(), indent=2, ensure_ascii=False))
@@ -0,0 +1,124 @@
+"""
+Benchmark de latencia de búsqueda, sin red.
+Carga vectores sintéticos normalizados en una base Chroma temporal, exporta el índice
+NumPy con la misma función que usa la ingesta y compara la latencia por consulta
+(p50/p99) de `coleccion.query` con filtro por política frente a `IndiceNumpy.buscar`.
+
+Uso:
+    python bench_busqueda.py --politicas 5 --chunks 4000
+    python bench_busqueda.py --salida bench_busqueda.json
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import chromadb
+
+import indice_numpy
+
+LOTE_CHROMA = 2000
+
+
+def cargar_vectores_sinteticos(coleccion, n_politicas, chunks_por_politica, dimension, rng):
+    vectores_por_politica = {}
+    for p in range(n_politicas):
+        nombre = f"politica_sintetica_{p:02d}.pdf"
+        vectores = rng.normal(size=(chunks_por_politica, dimension)).astype(np.float32)
+        vectores /= np.linalg.norm(vectores, axis=1, keepdims=True)
+        for inicio in range(0, chunks_por_politica, LOTE_CHROMA):
+            fin = min(inicio + LOTE_CHROMA, chunks_por_politica)
+            coleccion.add(
+                ids=[f"{nombre}_{i}" for i in range(inicio, fin)],
+                embeddings=vectores[inicio:fin].tolist(),
+                documents=[f"chunk {i} de {nombre}" for i in range(inicio, fin)],
+                metadatas=[{"source": nombre} for _ in range(inicio, fin)],
+            )
+        vectores_por_politica[nombre] = vectores
+    return vectores_por_politica
+
+def percentiles_ms(tiempos):
+    tiempos = np.asarray(tiempos) * 1000
+    return {"p50_ms": round(float(np.percentile(tiempos, 50)), 3),
+            "p99_ms": round(float(np.percentile(tiempos, 99)), 3),
+            "media_ms": round(float(tiempos.mean()), 3)}
+
+def medir_consultas(buscar, consultas):
+    tiempos = []
+    resultados = []
+    for nombre, consulta in consultas:
+        inicio = time.perf_counter()
+        resultados.append(buscar(consulta, nombre))
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos, resultados
+
+def correr_benchmark(args):
+    carpeta = tempfile.mkdtemp(prefix="bench_busqueda_")
+    rng = np.random.default_rng(0)
+    try:
+        coleccion = chromadb.PersistentClient(path=os.path.join(carpeta, "db")).get_or_create_collection(
+            name="bench_busqueda", metadata={"hnsw:space": "ip"})
+        vectores = cargar_vectores_sinteticos(coleccion, args.politicas, args.chunks, args.dimension, rng)
+
+        consultas = []
+        for _ in range(args.consultas):
+            nombre = str(rng.choice(list(vectores)))
+            base = vectores[nombre][rng.integers(len(vectores[nombre]))]
+            consultas.append((nombre, (base + rng.normal(0, 0.05, args.dimension)).astype(np.float32)))
+
+        def buscar_chroma(consulta, nombre):
+            resultado = coleccion.query(query_embeddings=[consulta.tolist()], n_results=args.k,
+                                        where={"source": nombre}, include=["documents", "metadatas"])
+            return resultado["documents"][0]
+
+        resultados = {"config": vars(args).copy()}
+        tiempos_chroma, docs_chroma = medir_consultas(buscar_chroma, consultas)
+        resultados["chroma"] = percentiles_ms(tiempos_chroma)
+
+        for tipo in ("float32", "float16"):
+            ruta_indice = os.path.join(carpeta, f"indice_{tipo}")
+            for nombre in vectores:
+                indice_numpy.exportar_politica(coleccion, nombre, ruta_indice, tipo=tipo)
+            indice = indice_numpy.IndiceNumpy(ruta_indice)
+            tiempos, docs = medir_consultas(lambda c, n: indice.buscar(c, n, args.k)[0], consultas)
+            coincidencias = sum(len(set(a) & set(b)) for a, b in zip(docs, docs_chroma))
+            resultados[f"numpy_{tipo}"] = dict(
+                percentiles_ms(tiempos),
+                coincidencia_con_chroma=round(coincidencias / (args.k * len(consultas)), 4),
+                mb_matrices=indice.estadisticas()["mb_matrices"],
+            )
+            del indice
+        return resultados
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+def imprimir_informe(resultados):
+    print("\n" + "=" * 60)
+    print("BENCHMARK DE BÚSQUEDA (por consulta)")
+    print("=" * 60)
+    for motor in ("chroma", "numpy_float32", "numpy_float16"):
+        print(f"\n{motor}:")
+        for clave, valor in resultados[motor].items():
+            print(f"  {clave:<28} {valor}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark offline de la búsqueda Chroma vs. índice NumPy.")
+    parser.add_argument("--politicas", type=int, default=4)
+    parser.add_argument("--chunks", type=int, default=3000, help="chunks por política")
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--consultas", type=int, default=300)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--salida", help="guarda el resultado en JSON en esta ruta")
+    args = parser.parse_args()
+
+    resultados = correr_benchmark(args)
+    imprimir_informe(resultados)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+        print(f"Resultado guardado en '{args.salida}'.")
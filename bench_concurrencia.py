@@ -0,0 +1,230 @@
+"""
+Prueba de concurrencia de las herramientas del agente, sin red.
+Corre muchas ejecuciones del agente en paralelo y, al mismo tiempo, mide la latencia
+de un handler tipo webhook en el mismo event loop. Cada ejecución es enrutamiento +
+búsqueda de contexto + generación de la respuesta.
+
+La variante async llama a las corrutinas reales del servidor: seleccionar_politica
+(clasificar_politica_con_llm) y buscar_contexto, es decir, EmbeddingsConCache.aembed_query
+y MotorBusqueda.abuscar. Son las mismas que envuelven las herramientas
+seleccionar_politica_con_llm y buscar_contexto_relevante. La variante síncrona repite
+el cuerpo que tenían las herramientas antes: cliente OpenAI síncrono, embed_query y
+buscar en el event loop.
+
+Solo se reemplaza lo que sale a la red:
+- el cliente de OpenAI por uno que espera LATENCIA_LLM segundos;
+- el modelo de embeddings por uno local que espera LATENCIA_EMBEDDING, envuelto
+  en la caché real de embeddings;
+- la base por una colección Chroma temporal.
+Importa main_ahora_si, así que necesita sus dependencias; las variables de WhatsApp
+se completan con un valor de relleno si faltan.
+
+Uso:
+    python bench_concurrencia.py --ejecuciones 50 --latencia-llm 0.3
+"""
+
+import os
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+from types import SimpleNamespace
+import numpy as np
+import chromadb
+
+for variable in ("WHATSAPP_ACCESS_TOKEN", "VERIFY_TOKEN", "PHONE_NUMBER_ID"):
+    os.environ.setdefault(variable, "bench")
+
+import main_ahora_si as servidor
+from cache_embeddings import EmbeddingsConCache
+from empaquetado_contexto import empaquetar_contexto
+from proveedores_embeddings import EmbeddingsLocales
+from motor_busqueda import MotorBusqueda
+
+TEXTOS = [
+    "La beca de estudio cubre el arancel de carreras técnicas y universitarias.",
+    "Para postular a la beca se requiere un año de antigüedad y el certificado de notas.",
+    "La terminación por mutuo acuerdo se formaliza con un finiquito firmado ante notario.",
+    "El socio del centro de recreación paga una cuota mensual descontada por planilla.",
+    "Las vacaciones se solicitan con treinta días de anticipación a la jefatura directa.",
+]
+
+
+def crear_coleccion(carpeta, embeddings_model, chunks_por_politica):
+    coleccion = chromadb.PersistentClient(path=os.path.join(carpeta, "db")).get_or_create_collection(
+        name="bench_concurrencia")
+    for p in range(3):
+        nombre = f"politica_{p}.pdf"
+        documentos = [f"{TEXTOS[i % len(TEXTOS)]} ({nombre}, chunk {i})" for i in range(chunks_por_politica)]
+        coleccion.add(ids=[f"{nombre}_{i}" for i in range(len(documentos))], documents=documentos,
+                      embeddings=embeddings_model.embed_documents(documentos),
+                      metadatas=[{"source": nombre} for _ in documentos])
+    return coleccion
+
+
+# ==============================================================================
+# DOBLES DE LOS SERVICIOS EXTERNOS
+# ==============================================================================
+def _respuesta_chat(contenido):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=contenido))])
+
+class ClienteOpenAISimulado:
+    """`chat.completions.create` que espera `latencia` segundos (con asyncio.sleep si es async)."""
+
+    def __init__(self, latencia, contenido, asincrono=True):
+        self.latencia = latencia
+        self.contenido = contenido
+        self.llamadas = 0
+        crear = self._crear_async if asincrono else self._crear
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=crear))
+
+    def _crear(self, **kwargs):
+        self.llamadas += 1
+        time.sleep(self.latencia)
+        return _respuesta_chat(self.contenido)
+
+    async def _crear_async(self, **kwargs):
+        self.llamadas += 1
+        await asyncio.sleep(self.latencia)
+        return _respuesta_chat(self.contenido)
+
+class EmbeddingsRemotosSimulados(EmbeddingsLocales):
+    """Embeddings locales con la latencia de un request a la API."""
+
+    def __init__(self, latencia):
+        super().__init__()
+        self.latencia = latencia
+
+    def embed_query(self, texto):
+        time.sleep(self.latencia)
+        return super().embed_query(texto)
+
+    async def aembed_query(self, texto):
+        await asyncio.sleep(self.latencia)
+        return super().embed_query(texto)
+
+def preparar_servidor(carpeta, args):
+    """Conecta las herramientas del servidor a los dobles y a una colección temporal."""
+    embeddings_model = EmbeddingsConCache(EmbeddingsRemotosSimulados(args.latencia_embedding), "bench-concurrencia",
+                                          ruta=os.path.join(carpeta, "cache_embeddings.sqlite"))
+    coleccion = crear_coleccion(carpeta, EmbeddingsLocales(), args.chunks)
+    servidor.embeddings_model = embeddings_model
+    servidor.motor_busqueda = MotorBusqueda(coleccion, hilos=args.hilos)
+    servidor.cliente_openai_async = ClienteOpenAISimulado(args.latencia_llm, "politica_0.pdf")
+    # Se enruta con el clasificador LLM (la llamada más lenta) y sin especulación
+    servidor.enrutador = None
+    servidor.especulador = None
+    servidor.NOMBRES_POLITICAS = [f"politica_{p}.pdf" for p in range(3)]
+    return SimpleNamespace(embeddings_model=embeddings_model, motor=servidor.motor_busqueda,
+                           cliente_sincrono=ClienteOpenAISimulado(args.latencia_llm, "politica_0.pdf", asincrono=False))
+
+
+# ==============================================================================
+# UNA EJECUCIÓN DEL AGENTE, EN CADA VARIANTE
+# ==============================================================================
+async def ejecucion_sincrona(pregunta, dobles):
+    # Cuerpo de las herramientas antes de hacerlas async: todo bloquea el event loop
+    dobles.cliente_sincrono.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "system", "content": pregunta}])
+    embedding = dobles.embeddings_model.embed_query(pregunta)
+    documentos, metadatos = dobles.motor.buscar(pregunta, embedding, "politica_0.pdf", 5)
+    contexto, _ = empaquetar_contexto(documentos, metadatos)
+    # Respuesta final del orquestador
+    dobles.cliente_sincrono.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": contexto}])
+
+async def ejecucion_async(pregunta, dobles):
+    politica = await servidor.seleccionar_politica(pregunta)
+    contexto = await servidor.buscar_contexto(pregunta, politica, 5)
+    # Respuesta final del orquestador
+    await servidor.cliente_openai_async.chat.completions.create(
+        model="gpt-4o-mini", messages=[{"role": "user", "content": contexto}])
+
+
+# ==============================================================================
+# MEDICIÓN
+# ==============================================================================
+def sondear_webhook(loop, detener, latencias, intervalo=0.02):
+    """
+    Emula requests al webhook que llegan desde afuera (otro hilo), a ritmo constante:
+    cada uno solo parsea el cuerpo y responde 200. La latencia incluye el tiempo que
+    el request esperó a que el event loop quedara libre.
+    """
+    cuerpo = json.dumps({"entry": [{"changes": [{"value": {"statuses": []}}]}]})
+
+    def handler(llegada):
+        json.loads(cuerpo)
+        latencias.append(time.perf_counter() - llegada)
+
+    while not detener.is_set():
+        loop.call_soon_threadsafe(handler, time.perf_counter())
+        time.sleep(intervalo)
+
+async def medir(variante, n_ejecuciones, dobles, latencia_llm):
+    latencias = []
+    detener = threading.Event()
+    sonda = threading.Thread(target=sondear_webhook, args=(asyncio.get_running_loop(), detener, latencias))
+    sonda.start()
+    await asyncio.sleep(0.2)
+    inicio = time.perf_counter()
+    if variante is not None:
+        await asyncio.gather(*(
+            # Preguntas distintas por variante: la caché de embeddings no debe favorecer a la segunda
+            variante(f"¿cómo postulo a la beca? ({variante.__name__} {i})", dobles)
+            for i in range(n_ejecuciones)
+        ))
+    else:
+        await asyncio.sleep(2 * latencia_llm)
+    duracion = time.perf_counter() - inicio
+    detener.set()
+    sonda.join()
+    await asyncio.sleep(0.05)
+    ms = np.asarray(latencias) * 1000
+    return {"webhook_p50_ms": round(float(np.percentile(ms, 50)), 2),
+            "webhook_p99_ms": round(float(np.percentile(ms, 99)), 2),
+            "webhook_max_ms": round(float(ms.max()), 2),
+            "duracion_total_s": round(duracion, 2)}
+
+def correr_benchmark(args):
+    carpeta = tempfile.mkdtemp(prefix="bench_concurrencia_")
+    try:
+        dobles = preparar_servidor(carpeta, args)
+        resultados = {"config": vars(args).copy()}
+        for nombre, variante in (("sin_carga", None), ("herramientas_sincronas", ejecucion_sincrona),
+                                 ("herramientas_async", ejecucion_async)):
+            resultados[nombre] = asyncio.run(medir(variante, args.ejecuciones, dobles, args.latencia_llm))
+        resultados["llamadas_llm"] = {"sincronas": dobles.cliente_sincrono.llamadas,
+                                      "async": servidor.cliente_openai_async.llamadas}
+        return resultados
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+def imprimir_informe(resultados):
+    print("\n" + "=" * 60)
+    print(f"CONCURRENCIA: {resultados['config']['ejecuciones']} ejecuciones del agente en paralelo")
+    print("=" * 60)
+    for variante in ("sin_carga", "herramientas_sincronas", "herramientas_async"):
+        print(f"\n{variante}:")
+        for clave, valor in resultados[variante].items():
+            print(f"  {clave:<28} {valor}")
+    print(f"\nllamadas al LLM simulado: {resultados['llamadas_llm']}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latencia del webhook con muchas ejecuciones del agente en curso.")
+    parser.add_argument("--ejecuciones", type=int, default=50)
+    parser.add_argument("--latencia-llm", type=float, default=0.3, help="segundos simulados por llamada a OpenAI")
+    parser.add_argument("--latencia-embedding", type=float, default=0.05, help="segundos simulados por embedding")
+    parser.add_argument("--chunks", type=int, default=500, help="chunks por política en la base temporal")
+    parser.add_argument("--hilos", type=int, default=8, help="hilos del pool de búsqueda")
+    parser.add_argument("--salida", help="guarda el resultado en JSON en esta ruta")
+    args = parser.parse_args()
+
+    resultados = correr_benchmark(args)
+    imprimir_informe(resultados)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+        print(f"Resultado guardado en '{args.salida}'.")
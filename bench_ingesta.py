@@ -0,0 +1,174 @@
+"""
+Benchmark de la ingesta de políticas, sin red.
+Genera PDFs sintéticos con PyMuPDF, corre cada etapa de ingest_policies contra una
+base Chroma local y temporal, y usa embeddings locales deterministas en lugar de la
+API de OpenAI. Sirve para comparar el rendimiento entre versiones.
+
+Uso:
+    python bench_ingesta.py --documentos 50 --paginas 20
+    python bench_ingesta.py --salida bench_output.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import fitz  # PyMuPDF
+import chromadb
+
+import ingest_policies
+from proveedores_embeddings import EmbeddingsLocales
+
+# Vocabulario para armar texto con aspecto de política de RRHH
+PALABRAS = (
+    "trabajador empresa beneficio beca estudio contrato terminación mutuo acuerdo finiquito "
+    "remuneración sueldo bono vacaciones feriado legal permiso licencia médica jornada horario "
+    "artículo reglamento interno requisitos postulación plazo monto anual mensual cargas familiares "
+    "centro recreación socio cuota inscripción gerencia recursos humanos aprobación solicitud "
+    "documentos certificado antigüedad indemnización años servicio aviso previo firma notario"
+).split()
+
+
+# ==============================================================================
+# GENERACIÓN DE PDFs SINTÉTICOS
+# ==============================================================================
+def generar_pdfs(carpeta, n_documentos, paginas_por_documento, palabras_por_pagina, semilla=0):
+    rng = np.random.default_rng(semilla)
+    rutas = []
+    for d in range(n_documentos):
+        ruta = os.path.join(carpeta, f"politica_sintetica_{d:04d}.pdf")
+        doc = fitz.open()
+        for p in range(paginas_por_documento):
+            page = doc.new_page()
+            parrafos = [f"ARTÍCULO {p + 1}", f"{p + 1}.1 Requisitos del beneficio"]
+            restantes = palabras_por_pagina
+            while restantes > 0:
+                n = int(min(restantes, rng.integers(30, 80)))
+                parrafos.append(" ".join(rng.choice(PALABRAS, size=n)).capitalize() + ".")
+                restantes -= n
+            page.insert_textbox(fitz.Rect(50, 50, 545, 792), "\n".join(parrafos), fontsize=8)
+        doc.save(ruta)
+        doc.close()
+        rutas.append(ruta)
+    return rutas
+
+
+# ==============================================================================
+# MEDICIONES
+# ==============================================================================
+def memoria_pico_mb():
+    """RSS máximo del proceso en MB (no incluye los procesos hijos del pool)."""
+    try:
+        import resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux informa KB, macOS informa bytes
+        return round(pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024, 1)
+    except ImportError:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+
+def medir(nombre, funcion, resultados):
+    inicio = time.perf_counter()
+    valor = funcion()
+    resultados[nombre] = time.perf_counter() - inicio
+    return valor
+
+def correr_benchmark(args):
+    carpeta = tempfile.mkdtemp(prefix="bench_ingesta_")
+    resultados = {"config": vars(args).copy()}
+    tiempos = {}
+    try:
+        carpeta_pdfs = os.path.join(carpeta, "files")
+        os.makedirs(carpeta_pdfs)
+        rutas = medir("generacion_pdfs", lambda: generar_pdfs(
+            carpeta_pdfs, args.documentos, args.paginas, args.palabras_por_pagina), tiempos)
+        embeddings_model = EmbeddingsLocales()
+        cliente_chroma = chromadb.PersistentClient(path=os.path.join(carpeta, "db"))
+
+        # --- Etapas por separado ---
+        # La extracción se mide sola; la división pasa por iterar_chunks_pdf, el mismo
+        # código (y el mismo MODO_CHUNKING) que usa el pipeline completo
+        def extraer():
+            paginas = []
+            for ruta in rutas:
+                with fitz.open(ruta) as doc_pdf:
+                    paginas.extend(page.get_text() for page in doc_pdf)
+            return paginas
+        paginas = medir("extraccion", extraer, tiempos)
+
+        chunks = medir("extraccion_y_division", lambda: [
+            chunk for ruta in rutas
+            for chunk in ingest_policies.iterar_chunks_pdf(ruta, ingest_policies.MODO_CHUNKING)
+        ], tiempos)
+
+        lotes = [chunks[i:i + ingest_policies.MAX_CHUNKS_LOTE] for i in range(0, len(chunks), ingest_policies.MAX_CHUNKS_LOTE)]
+        vectores = medir("embeddings", lambda: [
+            embeddings_model.embed_documents([chunk.page_content for chunk in lote]) for lote in lotes
+        ], tiempos)
+
+        coleccion_etapas = cliente_chroma.get_or_create_collection(name="bench_etapas")
+        def escribir():
+            for n, (lote, vectores_lote) in enumerate(zip(lotes, vectores)):
+                coleccion_etapas.add(
+                    ids=[f"bench_{n}_{i}" for i in range(len(lote))],
+                    documents=[chunk.page_content for chunk in lote], embeddings=vectores_lote,
+                    metadatas=[chunk.metadata for chunk in lote],
+                )
+        medir("escritura_chroma", escribir, tiempos)
+        del paginas, chunks, vectores, lotes
+
+        # --- Pipeline completo (ingest_policies.ingestar) ---
+        coleccion = cliente_chroma.get_or_create_collection(name="bench_pipeline")
+        ruta_manifest = os.path.join(carpeta, "db", "manifest_ingesta.json")
+        ruta_centroides = os.path.join(carpeta, "db", "centroides_politicas.npz")
+        ingestar = lambda: ingest_policies.ingestar(rutas, embeddings_model, coleccion, ruta_manifest, ruta_centroides)
+        medir("pipeline_completo", ingestar, tiempos)
+        medir("pipeline_sin_cambios", ingestar, tiempos)
+
+        n_paginas = args.documentos * args.paginas
+        n_chunks = coleccion_etapas.count()
+        resultados["totales"] = {"documentos": len(rutas), "paginas": n_paginas, "chunks": n_chunks,
+                                 "chunks_pipeline": coleccion.count(), "modo_chunking": ingest_policies.MODO_CHUNKING}
+        resultados["throughput"] = {
+            "extraccion_paginas_s": round(n_paginas / tiempos["extraccion"], 1),
+            "extraccion_y_division_chunks_s": round(n_chunks / tiempos["extraccion_y_division"], 1),
+            "embeddings_chunks_s": round(n_chunks / tiempos["embeddings"], 1),
+            "escritura_chroma_chunks_s": round(n_chunks / tiempos["escritura_chroma"], 1),
+            "pipeline_chunks_s": round(coleccion.count() / tiempos["pipeline_completo"], 1),
+        }
+        resultados["tiempos_s"] = {k: round(v, 3) for k, v in tiempos.items()}
+        resultados["memoria_pico_mb"] = memoria_pico_mb()
+        return resultados
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+def imprimir_informe(resultados):
+    print("\n" + "=" * 60)
+    print("BENCHMARK DE INGESTA")
+    print("=" * 60)
+    for seccion in ("totales", "throughput", "tiempos_s"):
+        print(f"\n{seccion}:")
+        for clave, valor in resultados[seccion].items():
+            print(f"  {clave:<32} {valor}")
+    print(f"\nmemoria_pico_mb:                   {resultados['memoria_pico_mb']}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark offline de la ingesta de políticas.")
+    parser.add_argument("--documentos", type=int, default=20, help="cantidad de PDFs sintéticos")
+    parser.add_argument("--paginas", type=int, default=10, help="páginas por PDF")
+    parser.add_argument("--palabras-por-pagina", type=int, default=350)
+    parser.add_argument("--salida", help="guarda el resultado en JSON en esta ruta")
+    args = parser.parse_args()
+
+    resultados = correr_benchmark(args)
+    imprimir_informe(resultados)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+        print(f"Resultado guardado en '{args.salida}'.")
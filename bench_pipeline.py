@@ -0,0 +1,117 @@
+"""
+Comparación de latencia entre el orquestador (varias vueltas al LLM) y el pipeline de
+una pasada (enrutamiento y búsqueda en código + una llamada con salida estructurada),
+sobre el mismo conjunto de preguntas. Usa la base, el índice y la cuenta de OpenAI
+reales, así que necesita el mismo entorno que main_ahora_si.py; las variables de
+WhatsApp no se usan y se completan con un valor de relleno si faltan.
+
+Las llamadas al LLM se cuentan de verdad: el cliente AsyncOpenAI del servidor se
+envuelve con un contador de chat.completions.create (lo usan el clasificador LLM del
+enrutador y la respuesta del pipeline), y al agente se le suman sus propias vueltas
+al modelo (raw_responses).
+
+Uso:
+    python bench_pipeline.py --preguntas preguntas.txt --repeticiones 3
+"""
+
+import os
+import time
+import asyncio
+import argparse
+from types import SimpleNamespace
+import numpy as np
+
+for variable in ("WHATSAPP_ACCESS_TOKEN", "VERIFY_TOKEN", "PHONE_NUMBER_ID"):
+    os.environ.setdefault(variable, "bench")
+
+import main_ahora_si as servidor
+from agents import Runner
+from lote_preguntas import leer_preguntas
+from pipeline_rag import PipelineRAG
+
+PREGUNTAS = [
+    "Hola",
+    "¿Qué requisitos necesito para postular a la beca de estudio?",
+    "¿Cuánto cubre la beca de estudio?",
+    "¿Cómo me hago socio del centro de recreación?",
+    "¿Qué pasa con mis vacaciones si termino el contrato por mutuo acuerdo?",
+    "¿Cuál es el horario del casino?",
+]
+
+
+class ContadorLlamadas:
+    """Envuelve el cliente AsyncOpenAI real y cuenta las llamadas a chat.completions.create."""
+
+    def __init__(self, cliente):
+        self.cliente = cliente
+        self.llamadas = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._crear))
+
+    async def _crear(self, **kwargs):
+        self.llamadas += 1
+        return await self.cliente.chat.completions.create(**kwargs)
+
+    def __getattr__(self, nombre):
+        return getattr(self.cliente, nombre)
+
+async def medir_agente(contador, pregunta):
+    llamadas_previas = contador.llamadas
+    inicio = time.perf_counter()
+    resultado = await Runner.run(servidor.orquestador_agente, pregunta)
+    ms = (time.perf_counter() - inicio) * 1000
+    # Vueltas del orquestador al modelo + clasificador LLM llamado desde sus herramientas
+    return ms, len(getattr(resultado, "raw_responses", [])) + contador.llamadas - llamadas_previas
+
+async def medir_pipeline(contador, pipeline, pregunta):
+    llamadas_previas = contador.llamadas
+    vueltas_agente = 0
+    inicio = time.perf_counter()
+    try:
+        await pipeline.responder(pregunta, servidor.NOMBRES_POLITICAS)
+    except Exception:
+        # Igual que el servidor: si el pipeline falla responde el agente, y su costo cuenta
+        resultado = await Runner.run(servidor.orquestador_agente, pregunta)
+        vueltas_agente = len(getattr(resultado, "raw_responses", []))
+    return (time.perf_counter() - inicio) * 1000, vueltas_agente + contador.llamadas - llamadas_previas
+
+def resumen(muestras):
+    ms = np.array([m for m, _ in muestras])
+    return {"p50_ms": round(float(np.percentile(ms, 50)), 1),
+            "p90_ms": round(float(np.percentile(ms, 90)), 1),
+            "promedio_ms": round(float(ms.mean()), 1),
+            "llamadas_llm_promedio": round(float(np.mean([n for _, n in muestras])), 2)}
+
+async def main(preguntas, repeticiones):
+    contador = ContadorLlamadas(servidor.cliente_openai_async)
+    # clasificar_politica_con_llm lee la variable global del módulo en cada llamada
+    servidor.cliente_openai_async = contador
+    pipeline = servidor.pipeline_rag or PipelineRAG(
+        servidor.embeddings_model, servidor.motor_busqueda, contador,
+        servidor.clasificar_politica_con_llm, servidor.enrutador
+    )
+    pipeline.cliente_openai_async = contador
+    muestras = {"agente": [], "pipeline": []}
+    for repeticion in range(repeticiones):
+        for i, pregunta in enumerate(preguntas):
+            # Se alterna el orden para no favorecer a ninguno con cachés calientes
+            orden = ["agente", "pipeline"] if (i + repeticion) % 2 == 0 else ["pipeline", "agente"]
+            for modo in orden:
+                if modo == "agente":
+                    muestras[modo].append(await medir_agente(contador, pregunta))
+                else:
+                    muestras[modo].append(await medir_pipeline(contador, pipeline, pregunta))
+    return {modo: resumen(valores) for modo, valores in muestras.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--preguntas", help=".txt o .csv con las preguntas (por defecto un conjunto de ejemplo)")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    preguntas = leer_preguntas(args.preguntas) if args.preguntas else PREGUNTAS
+    resultados = asyncio.run(main(preguntas, args.repeticiones))
+    print(f"{len(preguntas)} preguntas x {args.repeticiones} repeticiones")
+    for modo, valores in resultados.items():
+        print(f"  {modo:<9} {valores}")
+    print(f"  aceleración p50: {resultados['agente']['p50_ms'] / resultados['pipeline']['p50_ms']:.2f}x")
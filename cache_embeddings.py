@@ -0,0 +1,213 @@
+"""
+Caché persistente de embeddings.
+Guarda cada vector en un archivo SQLite local, indexado por modelo + hash del texto,
+para que un mismo texto nunca pague dos veces el viaje a la API de embeddings.
+La comparten la ingesta (ingest_policies.py) y los servidores del webhook.
+"""
+
+import os
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+import numpy as np
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+RUTA_CACHE_EMBEDDINGS = os.getenv(
+    "RUTA_CACHE_EMBEDDINGS", os.path.join("db_politicas", "cache_embeddings.sqlite")
+)
+CACHE_EMBEDDINGS_MAX_MB = float(os.getenv("CACHE_EMBEDDINGS_MAX_MB", 512))
+
+
+def clave_embedding(nombre_modelo, texto):
+    """Clave de la caché: el mismo texto con otro modelo es otra entrada."""
+    return hashlib.sha256(f"{nombre_modelo}\n{texto}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingsConCache:
+    """
+    Envuelve un modelo de embeddings (cualquier objeto con embed_documents/embed_query,
+    p. ej. OpenAIEmbeddings) con una caché en disco.
+    Cuando el archivo supera `max_mb` se eliminan las entradas usadas hace más tiempo.
+    Es seguro usarla desde varios hilos.
+    """
+
+    def __init__(self, modelo, nombre_modelo, ruta=RUTA_CACHE_EMBEDDINGS, max_mb=CACHE_EMBEDDINGS_MAX_MB):
+        self.modelo = modelo
+        self.nombre_modelo = nombre_modelo
+        self.ruta = ruta
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(ruta, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                clave TEXT PRIMARY KEY,
+                modelo TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                ultimo_uso REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_uso ON embeddings (ultimo_uso)")
+        self._conn.commit()
+
+    # --------------------------------------------------------------------------
+    # Acceso a SQLite
+    # --------------------------------------------------------------------------
+    def _bytes_ocupados(self):
+        """
+        Tamaño en uso del archivo, leído de SQLite y no de un contador en memoria:
+        la ingesta y los dos servidores escriben en el mismo archivo.
+        """
+        paginas = self._conn.execute("PRAGMA page_count").fetchone()[0]
+        libres = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+        tamano_pagina = self._conn.execute("PRAGMA page_size").fetchone()[0]
+        return (paginas - libres) * tamano_pagina
+
+    def _buscar(self, claves):
+        """Devuelve {clave: vector} para las claves presentes y actualiza su último uso."""
+        encontrados = {}
+        with self._lock:
+            # SQLite limita la cantidad de parámetros por consulta
+            for i in range(0, len(claves), 500):
+                bloque = claves[i:i + 500]
+                marcadores = ",".join("?" * len(bloque))
+                filas = self._conn.execute(
+                    f"SELECT clave, vector FROM embeddings WHERE clave IN ({marcadores})", bloque
+                ).fetchall()
+                for clave, vector in filas:
+                    encontrados[clave] = np.frombuffer(vector, dtype=np.float32).tolist()
+            if encontrados:
+                ahora = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET ultimo_uso = ? WHERE clave = ?",
+                    [(ahora, clave) for clave in encontrados]
+                )
+                self._conn.commit()
+        return encontrados
+
+    def _guardar(self, pares):
+        """Guarda [(clave, vector)] y aplica la política de tamaño máximo."""
+        if not pares:
+            return
+        ahora = time.time()
+        filas = [
+            (clave, self.nombre_modelo, np.asarray(vector, dtype=np.float32).tobytes(), ahora)
+            for clave, vector in pares
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (clave, modelo, vector, ultimo_uso) VALUES (?, ?, ?, ?)",
+                filas
+            )
+            self._conn.commit()
+            if self._bytes_ocupados() > self.max_bytes:
+                self._desalojar()
+
+    def _desalojar(self):
+        """
+        Elimina las entradas menos usadas hasta bajar al 90% del tamaño máximo.
+        BEGIN IMMEDIATE toma el bloqueo de escritura del archivo, así el tamaño se
+        recalcula sin que otro proceso escriba entre la medición y el borrado.
+        """
+        objetivo = int(self.max_bytes * 0.9)
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            bytes_ocupados = self._bytes_ocupados()
+            filas = self._conn.execute(
+                "SELECT clave, LENGTH(vector) FROM embeddings ORDER BY ultimo_uso ASC"
+            ).fetchall()
+            a_eliminar = []
+            for clave, tamano in filas:
+                if bytes_ocupados <= objetivo:
+                    break
+                a_eliminar.append((clave,))
+                bytes_ocupados -= tamano
+            self._conn.executemany("DELETE FROM embeddings WHERE clave = ?", a_eliminar)
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+        if not a_eliminar:
+            return
+        print(f"Caché de embeddings: {len(a_eliminar)} entradas desalojadas por tamaño.")
+
+    # --------------------------------------------------------------------------
+    # Interfaz compatible con los modelos de embeddings de LangChain
+    # --------------------------------------------------------------------------
+    def embed_documents(self, textos):
+        claves = [clave_embedding(self.nombre_modelo, texto) for texto in textos]
+        encontrados = self._buscar(list(set(claves)))
+
+        # Textos repetidos dentro de la misma llamada se piden una sola vez
+        faltantes = {}
+        for clave, texto in zip(claves, textos):
+            if clave not in encontrados:
+                faltantes.setdefault(clave, texto)
+
+        with self._lock:
+            self.misses += len(faltantes)
+            self.hits += len(textos) - len(faltantes)
+
+        if faltantes:
+            vectores = self.modelo.embed_documents(list(faltantes.values()))
+            nuevos = list(zip(faltantes.keys(), vectores))
+            self._guardar(nuevos)
+            encontrados.update(nuevos)
+
+        return [list(encontrados[clave]) for clave in claves]
+
+    def embed_query(self, texto):
+        clave = clave_embedding(self.nombre_modelo, texto)
+        encontrado = self._buscar([clave]).get(clave)
+        if encontrado is not None:
+            with self._lock:
+                self.hits += 1
+            return encontrado
+
+        with self._lock:
+            self.misses += 1
+        vector = self.modelo.embed_query(texto)
+        self._guardar([(clave, vector)])
+        return vector
+
+    async def aembed_query(self, texto):
+        """
+        Versión async: SQLite se consulta en un hilo y el modelo se llama con su
+        `aembed_query` si lo tiene (OpenAIEmbeddings usa el cliente AsyncOpenAI).
+        """
+        clave = clave_embedding(self.nombre_modelo, texto)
+        encontrado = (await asyncio.to_thread(self._buscar, [clave])).get(clave)
+        if encontrado is not None:
+            with self._lock:
+                self.hits += 1
+            return encontrado
+
+        with self._lock:
+            self.misses += 1
+        if hasattr(self.modelo, "aembed_query"):
+            vector = await self.modelo.aembed_query(texto)
+        else:
+            vector = await asyncio.to_thread(self.modelo.embed_query, texto)
+        await asyncio.to_thread(self._guardar, [(clave, vector)])
+        return vector
+
+    def estadisticas(self):
+        with self._lock:
+            entradas = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            consultas = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "tasa_aciertos": round(self.hits / consultas, 3) if consultas else 0.0,
+                "entradas": entradas,
+                "tamano_mb": round(self._bytes_ocupados() / (1024 * 1024), 2),
+            }
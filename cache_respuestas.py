@@ -0,0 +1,201 @@
+"""
+Caché semántica de respuestas del orquestador.
+Las preguntas frecuentes ("¿cómo postulo a la beca?") se responden con el JSON ya
+generado si coinciden exactamente tras normalizar o si su embedding es casi igual al
+de una pregunta guardada. Cada entrada recuerda la versión de ingesta (hash del PDF
+en el manifest) de su política y se descarta en cuanto el PDF se reingesta.
+"""
+
+import os
+import json
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+CACHE_RESPUESTAS = os.getenv("CACHE_RESPUESTAS", "1") == "1"
+CACHE_RESPUESTAS_MAX_ENTRADAS = int(os.getenv("CACHE_RESPUESTAS_MAX_ENTRADAS", 1000))
+CACHE_RESPUESTAS_TTL_S = float(os.getenv("CACHE_RESPUESTAS_TTL_S", 24 * 3600))
+# Coseno mínimo entre preguntas para reutilizar una respuesta
+UMBRAL_CACHE_RESPUESTAS = float(os.getenv("UMBRAL_CACHE_RESPUESTAS", 0.95))
+RUTA_MANIFEST = os.getenv("RUTA_MANIFEST", os.path.join("db_politicas", "manifest_ingesta.json"))
+# Solo se guardan respuestas que no dependen de la conversación ni disparan escalamientos
+ACCIONES_CACHEABLES = {"responder_con_contexto", "responder_sin_contexto"}
+
+
+def normalizar_pregunta(pregunta):
+    """Minúsculas, sin tildes, espacios colapsados y sin signos en los extremos."""
+    texto = unicodedata.normalize("NFKD", pregunta.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.split()).strip(" ¿?¡!.,;:")
+
+
+class VersionesIngesta:
+    """Lee del manifest de la ingesta la versión de cada política; relee solo si cambió."""
+
+    def __init__(self, ruta=RUTA_MANIFEST):
+        self.ruta = ruta
+        self._mtime = None
+        self._versiones = {}
+
+    def version(self, nombre_politica):
+        try:
+            mtime = os.stat(self.ruta).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime != self._mtime:
+            try:
+                with open(self.ruta, "r", encoding="utf-8") as f:
+                    archivos = json.load(f).get("archivos", {})
+            except (OSError, json.JSONDecodeError):
+                return None
+            self._versiones = {
+                nombre: f"{info.get('hash')}:{info.get('modo_chunking', '')}" for nombre, info in archivos.items()
+            }
+            self._mtime = mtime
+        return self._versiones.get(nombre_politica)
+
+
+class CacheRespuestas:
+    """
+    Caché LRU con TTL de respuestas JSON indexada por pregunta normalizada y por
+    embedding. Los embeddings viven en una matriz preasignada de `max_entradas` filas
+    que se mantiene al guardar y al desalojar, así la búsqueda semántica es un solo
+    producto matriz-vector. Los métodos son seguros entre hilos.
+    """
+
+    def __init__(self, embeddings_model, max_entradas=CACHE_RESPUESTAS_MAX_ENTRADAS,
+                 ttl_s=CACHE_RESPUESTAS_TTL_S, umbral=UMBRAL_CACHE_RESPUESTAS, ruta_manifest=RUTA_MANIFEST):
+        self.embeddings_model = embeddings_model
+        self.max_entradas = max_entradas
+        self.ttl_s = ttl_s
+        self.umbral = umbral
+        self.versiones = VersionesIngesta(ruta_manifest)
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        # Se asigna con el primer embedding (recién ahí se conoce la dimensión)
+        self._matriz = None
+        self._ocupadas = np.zeros(max_entradas, dtype=bool)
+        self._clave_de_fila = [None] * max_entradas
+        self._filas_libres = []
+        self._filas_usadas = 0
+        self.hits_exactos = 0
+        self.hits_semanticos = 0
+        self.misses = 0
+        self.invalidadas = 0
+
+    def _embedding(self, pregunta):
+        vector = np.asarray(self.embeddings_model.embed_query(pregunta), dtype=np.float32)
+        norma = np.linalg.norm(vector)
+        return vector / norma if norma else vector
+
+    def _vigente(self, entrada, ahora):
+        if ahora - entrada["creada"] > self.ttl_s:
+            return False
+        politica = entrada["politica"]
+        return politica is None or self.versiones.version(politica) == entrada["version"]
+
+    def _eliminar(self, clave):
+        """Quita la entrada y libera su fila de la matriz. Requiere el lock."""
+        fila = self._entradas.pop(clave)["fila"]
+        self._ocupadas[fila] = False
+        self._clave_de_fila[fila] = None
+        self._filas_libres.append(fila)
+
+    def _asignar_fila(self, clave, embedding):
+        """Escribe `embedding` en una fila libre de la matriz y la devuelve. Requiere el lock."""
+        if self._matriz is None:
+            self._matriz = np.zeros((self.max_entradas, len(embedding)), dtype=np.float32)
+        if self._filas_libres:
+            fila = self._filas_libres.pop()
+        else:
+            fila = self._filas_usadas
+            self._filas_usadas += 1
+        self._matriz[fila] = embedding
+        self._ocupadas[fila] = True
+        self._clave_de_fila[fila] = clave
+        return fila
+
+    def _candidatas_semanticas(self, embedding):
+        """Claves de las entradas sobre el umbral, de la más parecida a la menos. Requiere el lock."""
+        if self._matriz is None or not self._entradas:
+            return []
+        puntajes = self._matriz[:self._filas_usadas] @ embedding
+        puntajes[~self._ocupadas[:self._filas_usadas]] = -np.inf
+        filas = np.flatnonzero(puntajes >= self.umbral)
+        filas = filas[np.argsort(-puntajes[filas])]
+        return [self._clave_de_fila[fila] for fila in filas]
+
+    def buscar(self, pregunta):
+        """
+        Devuelve el JSON (str) guardado para la pregunta, o None. Si la coincidencia
+        exacta o la semántica más parecida está vencida se descarta y se prueba la siguiente.
+        """
+        clave = normalizar_pregunta(pregunta)
+        ahora = time.time()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                if self._vigente(entrada, ahora):
+                    self._entradas.move_to_end(clave)
+                    self.hits_exactos += 1
+                    return entrada["respuesta"]
+                self._eliminar(clave)
+                self.invalidadas += 1
+
+        embedding = self._embedding(pregunta)
+        with self._lock:
+            for candidata in self._candidatas_semanticas(embedding):
+                entrada = self._entradas[candidata]
+                if self._vigente(entrada, ahora):
+                    self._entradas.move_to_end(candidata)
+                    self.hits_semanticos += 1
+                    return entrada["respuesta"]
+                self._eliminar(candidata)
+                self.invalidadas += 1
+            self.misses += 1
+            return None
+
+    def guardar(self, pregunta, respuesta_json):
+        """Guarda la respuesta si su acción es cacheable; devuelve True si se guardó."""
+        try:
+            datos = json.loads(respuesta_json)
+        except json.JSONDecodeError:
+            return False
+        if datos.get("accion") not in ACCIONES_CACHEABLES:
+            return False
+
+        politica = datos.get("politica_identificada") or None
+        clave = normalizar_pregunta(pregunta)
+        embedding = self._embedding(pregunta)
+        with self._lock:
+            # La versión se lee con el lock tomado, igual que al validar en `buscar`
+            version = self.versiones.version(politica) if politica else None
+            if politica and version is None:
+                # Política desconocida para la ingesta: no hay cómo invalidarla después
+                return False
+            if clave in self._entradas:
+                self._eliminar(clave)
+            while len(self._entradas) >= self.max_entradas:
+                self._eliminar(next(iter(self._entradas)))
+            self._entradas[clave] = {
+                "respuesta": respuesta_json, "politica": politica, "version": version,
+                "fila": self._asignar_fila(clave, embedding), "creada": time.time(),
+            }
+        return True
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.hits_exactos + self.hits_semanticos + self.misses
+            return {
+                "entradas": len(self._entradas),
+                "hits_exactos": self.hits_exactos,
+                "hits_semanticos": self.hits_semanticos,
+                "misses": self.misses,
+                "invalidadas": self.invalidadas,
+                "tasa_aciertos": round((self.hits_exactos + self.hits_semanticos) / consultas, 3) if consultas else 0.0,
+            }
@@ -0,0 +1,98 @@
+"""
+Eliminación de chunks casi duplicados durante la ingesta.
+Los PDFs de RRHH repiten encabezados, pies de página y cláusulas legales en cada
+página; esos chunks casi idénticos gastan embeddings y ocupan los primeros lugares
+de la búsqueda. Se detectan con MinHash sobre shingles de caracteres y LSH por
+bandas, y se descartan antes de embeber.
+"""
+
+import os
+import zlib
+import numpy as np
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+# "no": sin deduplicación; "archivo": solo dentro de cada PDF; "global": entre todos los PDFs
+DEDUP_CHUNKS = os.getenv("DEDUP_CHUNKS", "archivo")
+# Similitud de Jaccard estimada a partir de la cual dos chunks se consideran duplicados
+DEDUP_UMBRAL = float(os.getenv("DEDUP_UMBRAL", 0.85))
+TAMANO_SHINGLE = 5
+NUM_PERMUTACIONES = 64
+NUM_BANDAS = 16
+
+
+def shingles(texto, tamano=TAMANO_SHINGLE):
+    """Hashes (crc32) de los n-gramas de caracteres del texto normalizado."""
+    texto = " ".join(texto.lower().split())
+    if len(texto) <= tamano:
+        piezas = [texto]
+    else:
+        piezas = {texto[i:i + tamano] for i in range(len(texto) - tamano + 1)}
+    return np.fromiter((zlib.crc32(p.encode("utf-8")) for p in piezas), dtype=np.uint64)
+
+
+class DeduplicadorChunks:
+    """
+    Índice MinHash/LSH en memoria. `es_duplicado` compara un chunk con los ya
+    registrados y, si no es duplicado, lo registra como representante.
+    Con alcance "archivo" solo se comparan chunks de la misma fuente.
+    """
+
+    def __init__(self, alcance=DEDUP_CHUNKS, umbral=DEDUP_UMBRAL,
+                 num_permutaciones=NUM_PERMUTACIONES, num_bandas=NUM_BANDAS, semilla=1):
+        self.alcance = alcance
+        self.umbral = umbral
+        self.filas_por_banda = num_permutaciones // num_bandas
+        self.num_bandas = num_bandas
+        rng = np.random.default_rng(semilla)
+        # Hash universal (a * h + b) con aritmética módulo 2^64; se conservan los 32 bits altos
+        self._a = rng.integers(1, 2 ** 63, size=num_permutaciones, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, size=num_permutaciones, dtype=np.uint64)
+        self._cubetas = {}
+        self.registrados = 0
+        self.descartados = 0
+        self.descartados_entre_archivos = 0
+
+    def firma(self, texto):
+        hashes = shingles(texto)
+        with np.errstate(over="ignore"):
+            permutados = hashes[:, None] * self._a + self._b
+        return (permutados.min(axis=0) >> np.uint64(32)).astype(np.uint32)
+
+    def _claves_bandas(self, firma, fuente):
+        prefijo = fuente if self.alcance == "archivo" else ""
+        for banda in range(self.num_bandas):
+            inicio = banda * self.filas_por_banda
+            yield (prefijo, banda, firma[inicio:inicio + self.filas_por_banda].tobytes())
+
+    def buscar_similar(self, texto, fuente):
+        """Devuelve la fuente del chunk registrado más parecido sobre el umbral, o None."""
+        firma = self.firma(texto)
+        for clave in self._claves_bandas(firma, fuente):
+            for firma_registrada, fuente_registrada in self._cubetas.get(clave, ()):
+                if np.mean(firma == firma_registrada) >= self.umbral:
+                    return fuente_registrada, firma
+        return None, firma
+
+    def registrar(self, texto, fuente, firma=None):
+        firma = self.firma(texto) if firma is None else firma
+        for clave in self._claves_bandas(firma, fuente):
+            self._cubetas.setdefault(clave, []).append((firma, fuente))
+        self.registrados += 1
+
+    def es_duplicado(self, texto, fuente):
+        """
+        True si `texto` es casi igual a un chunk ya registrado; si no, lo registra.
+        Los descartes contra chunks de otra fuente se cuentan aparte.
+        """
+        if self.alcance == "no":
+            return False
+        fuente_original, firma = self.buscar_similar(texto, fuente)
+        if fuente_original is None:
+            self.registrar(texto, fuente, firma)
+            return False
+        self.descartados += 1
+        if fuente_original != fuente:
+            self.descartados_entre_archivos += 1
+        return True
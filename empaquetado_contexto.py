@@ -0,0 +1,159 @@
+"""
+Armado del contexto RAG a partir de los chunks recuperados.
+Une los chunks de la misma página que se solapan (los del modo de chunking "pagina"
+traen offsets), quita el texto repetido por el chunk_overlap entre chunks contiguos
+de la misma fuente, cita la página de origen de cada fragmento y recorta el
+resultado a un presupuesto de tokens, priorizando los fragmentos mejor rankeados.
+"""
+
+import os
+from tokenizador import CODIFICACION_CHAT, obtener_codificador, contar_tokens
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+# Tokens máximos del contexto que se entrega al orquestador (0 = sin límite)
+PRESUPUESTO_TOKENS_CONTEXTO = int(os.getenv("PRESUPUESTO_TOKENS_CONTEXTO", 1500))
+# Tokenizador de gpt-4o / gpt-4o-mini
+CODIFICACION_CONTEXTO = os.getenv("CODIFICACION_CONTEXTO", CODIFICACION_CHAT)
+# Caracteres en común (mín. y máx.) para considerar que dos chunks sin offsets se solapan;
+# el splitter repite a lo más CHUNK_OVERLAP (50) caracteres
+MIN_SOLAPAMIENTO = 20
+MAX_SOLAPAMIENTO = 100
+# Un fragmento solo se recorta para llenar el presupuesto si le caben al menos estos tokens
+TOKENS_MINIMOS_RECORTE = 40
+SEPARADOR = "\n\n---\n\n"
+
+
+def recortar_a_tokens(texto, max_tokens):
+    """Primeros `max_tokens` tokens del texto, cortando en el último espacio."""
+    codificador = obtener_codificador(CODIFICACION_CONTEXTO)
+    if codificador is False:
+        recorte = texto[:max_tokens * 3]
+    else:
+        recorte = codificador.decode(codificador.encode(texto, disallowed_special=())[:max_tokens])
+    if len(recorte) < len(texto) and " " in recorte:
+        recorte = recorte[:recorte.rfind(" ")]
+    return recorte.rstrip() + " […]"
+
+
+# ==============================================================================
+# FUSIÓN DE CHUNKS
+# ==============================================================================
+def _solapamiento(anterior, siguiente, minimo=MIN_SOLAPAMIENTO, maximo=MAX_SOLAPAMIENTO):
+    """Largo del sufijo más largo de `anterior` que es prefijo de `siguiente` (0 si es menor a `minimo`)."""
+    for largo in range(min(len(anterior), len(siguiente), maximo), minimo - 1, -1):
+        if anterior.endswith(siguiente[:largo]):
+            return largo
+    return 0
+
+def _unir_por_texto(grupos):
+    """
+    Une grupos de la misma fuente cuyo texto se solapa por el chunk_overlap (chunks sin
+    offsets) y descarta los que ya están contenidos en otro. Mantiene el mejor rango.
+    """
+    resultado = []
+    for grupo in grupos:
+        fuente = grupo["meta"].get("source")
+        unido = False
+        for previo in resultado:
+            if previo["meta"].get("source") != fuente or "pagina" in previo["meta"] or "pagina" in grupo["meta"]:
+                continue
+            if grupo["texto"] in previo["texto"]:
+                unido = True
+            elif (largo := _solapamiento(previo["texto"], grupo["texto"])):
+                previo["texto"] += grupo["texto"][largo:]
+                unido = True
+            elif (largo := _solapamiento(grupo["texto"], previo["texto"])):
+                previo["texto"] = grupo["texto"] + previo["texto"][largo:]
+                unido = True
+            if unido:
+                previo["rango"] = min(previo["rango"], grupo["rango"])
+                break
+        if not unido:
+            resultado.append(grupo)
+    return resultado
+
+def fusionar_chunks_solapados(documentos, metadatos):
+    """
+    Une los chunks de la misma fuente y página cuyos rangos [inicio, fin) se solapan
+    o se tocan, sin repetir el texto común. Los chunks sin offsets se unen si el final
+    de uno coincide con el comienzo de otro de la misma fuente.
+    Devuelve [(texto, metadato)] en el orden de relevancia del mejor chunk de cada grupo.
+    """
+    metadatos = [meta or {} for meta in metadatos] if metadatos else [{} for _ in documentos]
+    grupos = []
+    con_offsets = []
+    for rango, (texto, meta) in enumerate(zip(documentos, metadatos)):
+        if "inicio" in meta and "pagina" in meta:
+            con_offsets.append((rango, texto, meta))
+        else:
+            grupos.append({"rango": rango, "texto": texto, "meta": meta})
+
+    con_offsets.sort(key=lambda c: (c[2].get("source", ""), c[2]["pagina"], c[2]["inicio"]))
+    actual = None
+    for rango, texto, meta in con_offsets:
+        if (actual is not None
+                and actual["meta"].get("source") == meta.get("source")
+                and actual["meta"]["pagina"] == meta["pagina"]
+                and meta["inicio"] <= actual["fin"]):
+            # Solo se agrega la parte del chunk que no estaba ya en el grupo
+            if meta["fin"] > actual["fin"]:
+                actual["texto"] += texto[actual["fin"] - meta["inicio"]:]
+                actual["fin"] = meta["fin"]
+            actual["rango"] = min(actual["rango"], rango)
+            continue
+        actual = {"rango": rango, "texto": texto, "meta": dict(meta), "fin": meta["fin"]}
+        grupos.append(actual)
+
+    grupos.sort(key=lambda g: g["rango"])
+    grupos = _unir_por_texto(grupos)
+    return [(g["texto"], g["meta"]) for g in grupos]
+
+
+# ==============================================================================
+# FORMATO Y PRESUPUESTO
+# ==============================================================================
+def _formatear_fragmento(texto, meta):
+    if "pagina" in meta:
+        seccion = f" — {meta['seccion']}" if meta.get("seccion") else ""
+        return f"[{meta.get('source', '')}, pág. {meta['pagina']}{seccion}]\n{texto}"
+    return str(texto)
+
+def formatear_contexto(documentos, metadatos=None, separador=SEPARADOR):
+    """Une los fragmentos con `separador`, anteponiendo la cita de página cuando existe."""
+    return separador.join(_formatear_fragmento(texto, meta) for texto, meta in fusionar_chunks_solapados(documentos, metadatos))
+
+def empaquetar_contexto(documentos, metadatos=None, presupuesto_tokens=PRESUPUESTO_TOKENS_CONTEXTO, separador=SEPARADOR):
+    """
+    Como `formatear_contexto`, pero agrega los fragmentos en orden de relevancia hasta
+    llenar `presupuesto_tokens`; el primero que no cabe se recorta si le queda espacio
+    suficiente. Devuelve (contexto, estadísticas de tokens frente a unir los chunks tal cual).
+    """
+    tokens_originales = contar_tokens(separador.join(str(d) for d in documentos), CODIFICACION_CONTEXTO) if documentos else 0
+    tokens_separador = contar_tokens(separador, CODIFICACION_CONTEXTO)
+    partes = []
+    usados = 0
+    for texto, meta in fusionar_chunks_solapados(documentos, metadatos):
+        fragmento = _formatear_fragmento(texto, meta)
+        separacion = tokens_separador if partes else 0
+        tokens = contar_tokens(fragmento, CODIFICACION_CONTEXTO) + separacion
+        if presupuesto_tokens and usados + tokens > presupuesto_tokens:
+            disponibles = presupuesto_tokens - usados - separacion
+            if disponibles >= TOKENS_MINIMOS_RECORTE:
+                # Margen de 2 tokens para la marca de recorte
+                partes.append(recortar_a_tokens(fragmento, disponibles - 2))
+            # Los fragmentos siguientes tienen peor ranking; no se usan para rellenar
+            break
+        partes.append(fragmento)
+        usados += tokens
+
+    contexto = separador.join(partes)
+    tokens_finales = contar_tokens(contexto, CODIFICACION_CONTEXTO) if contexto else 0
+    return contexto, {
+        "chunks": len(documentos),
+        "fragmentos": len(partes),
+        "tokens_originales": tokens_originales,
+        "tokens_contexto": tokens_finales,
+        "tokens_ahorrados": max(tokens_originales - tokens_finales, 0),
+    }
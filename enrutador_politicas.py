@@ -0,0 +1,279 @@
+"""
+Enrutador de políticas por embeddings.
+En lugar de pedirle a gpt-4o-mini que elija el PDF en cada pregunta, compara el
+embedding de la pregunta con el centroide de los chunks de cada política y con el
+embedding de su descripción (ambos calculados en la ingesta, así el servidor no llama
+a la API de embeddings al iniciar ni al recargar). Solo cuando los dos mejores
+puntajes quedan muy cerca, o el mejor es bajo, se delega en el clasificador LLM.
+Una muestra de las decisiones locales también se contrasta con el LLM para medir
+cuánto coinciden.
+"""
+
+import os
+import random
+import asyncio
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+# "embeddings": enrutador local con respaldo LLM; "llm": clasificador LLM en cada pregunta
+ENRUTADOR_POLITICAS = os.getenv("ENRUTADOR_POLITICAS", "embeddings")
+RUTA_CENTROIDES = os.getenv("RUTA_CENTROIDES", os.path.join("db_politicas", "centroides_politicas.npz"))
+# Peso del centroide frente a la descripción en el puntaje combinado
+PESO_CENTROIDE = float(os.getenv("PESO_CENTROIDE", 0.6))
+# Diferencia mínima entre el primer y el segundo puntaje para decidir sin LLM
+MARGEN_ENRUTADOR = float(os.getenv("MARGEN_ENRUTADOR", 0.05))
+# Puntaje mínimo del mejor candidato; por debajo la pregunta puede no tener política
+PUNTAJE_MINIMO_ENRUTADOR = float(os.getenv("PUNTAJE_MINIMO_ENRUTADOR", 0.25))
+# Fracción de decisiones locales que también se consultan al LLM para medir concordancia
+MUESTREO_CONCORDANCIA = float(os.getenv("MUESTREO_CONCORDANCIA", 0.05))
+TAMANO_CACHE_ENRUTADOR = int(os.getenv("TAMANO_CACHE_ENRUTADOR", 2048))
+
+SIN_COINCIDENCIAS = "sin_coincidencias"
+
+# Descripciones escritas a mano; tienen prioridad sobre la que la ingesta guarda en el
+# manifest (asunto o título del PDF, o el comienzo de su texto)
+DESCRIPCIONES_MANUALES = {
+    "beca_estudio.pdf": "Información sobre beneficios y becas para estudios.",
+    "centro_recreacion.pdf": "Reglas para pertenecer al centro de recreación.",
+    "mutuo_acuerdo.pdf": "Procedimientos para terminación de contrato laboral."
+}
+
+
+def _normalizar(vectores):
+    normas = np.linalg.norm(vectores, axis=-1, keepdims=True)
+    return vectores / np.where(normas == 0, 1, normas)
+
+def normalizar_pregunta(pregunta):
+    return " ".join(pregunta.lower().split())
+
+def descripcion_politica(nombre_politica, descripcion_ingesta=None):
+    """Descripción que usan el clasificador LLM y el enrutador para `nombre_politica`."""
+    return (DESCRIPCIONES_MANUALES.get(nombre_politica) or descripcion_ingesta
+            or os.path.splitext(nombre_politica)[0].replace("_", " "))
+
+def texto_descripcion(nombre_politica, descripcion):
+    """Texto que se embebe para comparar preguntas con la descripción de una política."""
+    return f"{os.path.splitext(nombre_politica)[0].replace('_', ' ')}: {descripcion}"
+
+
+# ==============================================================================
+# CENTROIDES Y DESCRIPCIONES (los calcula la ingesta)
+# ==============================================================================
+def cargar_centroides(ruta=RUTA_CENTROIDES):
+    if not os.path.exists(ruta):
+        return {}
+    with np.load(ruta) as datos:
+        return {str(nombre): vector for nombre, vector in zip(datos["nombres"], datos["centroides"])}
+
+def cargar_descripciones(ruta=RUTA_CENTROIDES):
+    """{política: (texto embebido, vector normalizado)} guardados junto a los centroides."""
+    if not os.path.exists(ruta):
+        return {}
+    with np.load(ruta) as datos:
+        if "vectores_descripcion" not in datos.files:
+            return {}
+        return {
+            str(nombre): (str(texto), vector)
+            for nombre, texto, vector in zip(datos["nombres_descripcion"], datos["textos_descripcion"],
+                                             datos["vectores_descripcion"])
+        }
+
+def actualizar_centroides(coleccion, nombres_presentes, nombres_modificados, nombres_eliminados,
+                          ruta=RUTA_CENTROIDES, embeddings_model=None, descripciones=None):
+    """
+    Recalcula el centroide (promedio normalizado de los embeddings de sus chunks) de
+    las políticas modificadas o que aún no lo tienen, y quita los de las eliminadas.
+    Con `embeddings_model` también embebe las `descripciones` ({política: descripción})
+    nuevas o que cambiaron, para que el enrutador no tenga que hacerlo al cargar.
+    """
+    centroides = cargar_centroides(ruta)
+    vectores_descripcion = cargar_descripciones(ruta)
+    cambios = False
+    for nombre_politica in nombres_eliminados:
+        cambios |= centroides.pop(nombre_politica, None) is not None
+        cambios |= vectores_descripcion.pop(nombre_politica, None) is not None
+
+    for nombre_politica in sorted(nombres_presentes):
+        if nombre_politica in centroides and nombre_politica not in nombres_modificados:
+            continue
+        datos = coleccion.get(where={"source": nombre_politica}, include=["embeddings"])
+        if len(datos["ids"]) == 0:
+            cambios |= centroides.pop(nombre_politica, None) is not None
+            continue
+        centroides[nombre_politica] = _normalizar(np.asarray(datos["embeddings"], dtype=np.float32).mean(axis=0))
+        cambios = True
+
+    if embeddings_model is not None and descripciones is not None:
+        textos = {n: texto_descripcion(n, d) for n, d in descripciones.items() if n != SIN_COINCIDENCIAS}
+        for nombre_politica in set(vectores_descripcion) - set(textos):
+            del vectores_descripcion[nombre_politica]
+            cambios = True
+        pendientes = sorted(n for n, texto in textos.items()
+                            if vectores_descripcion.get(n, (None,))[0] != texto)
+        if pendientes:
+            vectores = _normalizar(np.asarray(embeddings_model.embed_documents([textos[n] for n in pendientes]),
+                                              dtype=np.float32))
+            vectores_descripcion.update((n, (textos[n], v)) for n, v in zip(pendientes, vectores))
+            cambios = True
+
+    if not cambios:
+        return
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    nombres = sorted(centroides)
+    nombres_descripcion = sorted(vectores_descripcion)
+    ruta_tmp = ruta + ".tmp.npz"
+    np.savez(ruta_tmp, nombres=np.asarray(nombres),
+             centroides=np.asarray([centroides[n] for n in nombres], dtype=np.float32),
+             nombres_descripcion=np.asarray(nombres_descripcion),
+             textos_descripcion=np.asarray([vectores_descripcion[n][0] for n in nombres_descripcion]),
+             vectores_descripcion=np.asarray([vectores_descripcion[n][1] for n in nombres_descripcion],
+                                             dtype=np.float32))
+    os.replace(ruta_tmp, ruta)
+    print(f"   Centroides del enrutador actualizados ({len(nombres)} políticas, {len(nombres_descripcion)} descripciones).")
+
+
+# ==============================================================================
+# ENRUTADOR (lo usan los servidores)
+# ==============================================================================
+class EnrutadorPoliticas:
+    """
+    Elige la política de una pregunta con embeddings y guarda las decisiones en una
+    caché LRU por pregunta normalizada. `clasificador_llm_async(pregunta)` es el respaldo.
+    """
+
+    def __init__(self, embeddings_model, descripciones, ruta=RUTA_CENTROIDES):
+        self.embeddings_model = embeddings_model
+        # Al recargar las políticas el servidor pasa el dict nuevo a cargar()
+        self.descripciones = descripciones
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.consultas = 0
+        self.aciertos_cache = 0
+        self.decisiones_locales = 0
+        self.derivadas_llm = 0
+        self.comparaciones = 0
+        self.coincidencias = 0
+        self.cargar()
+
+    def cargar(self, descripciones=None):
+        """
+        Lee los centroides y los embeddings de las descripciones que guardó la ingesta.
+        Solo embebe las descripciones que no están o cambiaron desde la última ingesta.
+        Invalida la caché de decisiones. `descripciones` reemplaza al dict del constructor.
+        """
+        if descripciones is not None:
+            self.descripciones = descripciones
+        centroides = cargar_centroides(self.ruta)
+        guardadas = cargar_descripciones(self.ruta)
+        textos = {n: texto_descripcion(n, d) for n, d in self.descripciones.items() if n != SIN_COINCIDENCIAS}
+        vectores = {n: guardadas[n][1] for n, texto in textos.items() if guardadas.get(n, (None,))[0] == texto}
+        faltantes = [n for n in textos if n not in vectores]
+        if faltantes:
+            nuevos = _normalizar(np.asarray(self.embeddings_model.embed_documents([textos[n] for n in faltantes]),
+                                            dtype=np.float32))
+            vectores.update(zip(faltantes, nuevos))
+        with self._lock:
+            self.centroides = centroides
+            self.vectores_descripcion = vectores
+            self._cache.clear()
+        print(f"Enrutador de políticas cargado: {len(centroides)} centroides, {len(vectores)} descripciones "
+              f"({len(faltantes)} embebidas al cargar).")
+
+    def puntajes(self, embedding_pregunta, nombres_validos):
+        """{política: puntaje} combinando coseno con el centroide y con la descripción."""
+        consulta = _normalizar(np.asarray(embedding_pregunta, dtype=np.float32))
+        resultado = {}
+        for nombre in nombres_validos:
+            centroide = self.centroides.get(nombre)
+            descripcion = self.vectores_descripcion.get(nombre)
+            if centroide is not None and descripcion is not None:
+                resultado[nombre] = PESO_CENTROIDE * float(centroide @ consulta) + (1 - PESO_CENTROIDE) * float(descripcion @ consulta)
+            elif centroide is not None:
+                resultado[nombre] = float(centroide @ consulta)
+            elif descripcion is not None:
+                resultado[nombre] = float(descripcion @ consulta)
+        return resultado
+
+    def decidir(self, embedding_pregunta, nombres_validos):
+        """
+        Decisión local a partir de un embedding ya calculado (sin caché ni LLM).
+        Devuelve (política, segura): `segura` es False si conviene consultar al LLM.
+        """
+        puntajes = self.puntajes(embedding_pregunta, nombres_validos)
+        if not puntajes:
+            return None, False
+        orden = sorted(puntajes.values(), reverse=True)
+        mejor = max(puntajes, key=puntajes.get)
+        segundo = orden[1] if len(orden) > 1 else -1.0
+        segura = orden[0] >= PUNTAJE_MINIMO_ENRUTADOR and orden[0] - segundo >= MARGEN_ENRUTADOR
+        return mejor, segura
+
+    def _desde_cache(self, clave):
+        with self._lock:
+            self.consultas += 1
+            if clave in self._cache:
+                self._cache.move_to_end(clave)
+                self.aciertos_cache += 1
+                return True, self._cache[clave]
+        return False, None
+
+    def _guardar_decision(self, clave, decision, local_segura):
+        with self._lock:
+            if local_segura:
+                self.decisiones_locales += 1
+            else:
+                self.derivadas_llm += 1
+            self._cache[clave] = decision
+            if len(self._cache) > TAMANO_CACHE_ENRUTADOR:
+                self._cache.popitem(last=False)
+
+    async def aseleccionar(self, pregunta, clasificador_llm_async, nombres_validos, embedding_pregunta=None):
+        """
+        Política de la pregunta: primero la caché, luego la decisión local por embeddings
+        y, si no es segura, `clasificador_llm_async(pregunta)`.
+        """
+        clave = normalizar_pregunta(pregunta)
+        encontrada, decision = self._desde_cache(clave)
+        if encontrada:
+            return decision
+
+        if embedding_pregunta is None:
+            embedding_pregunta = await self.embeddings_model.aembed_query(pregunta)
+        local, segura = self.decidir(embedding_pregunta, nombres_validos)
+        if segura:
+            decision = local
+            if random.random() < MUESTREO_CONCORDANCIA:
+                # La comparación no debe sumar latencia a la respuesta
+                asyncio.ensure_future(self._comparar_async(pregunta, local, clasificador_llm_async))
+        else:
+            decision = await clasificador_llm_async(pregunta)
+            if local is not None:
+                self._registrar_comparacion(local, decision)
+        self._guardar_decision(clave, decision, segura)
+        return decision
+
+    async def _comparar_async(self, pregunta, local, clasificador_llm_async):
+        self._registrar_comparacion(local, await clasificador_llm_async(pregunta))
+
+    def _registrar_comparacion(self, local, llm):
+        with self._lock:
+            self.comparaciones += 1
+            self.coincidencias += local == llm
+
+    def estadisticas(self):
+        with self._lock:
+            decisiones = self.decisiones_locales + self.derivadas_llm
+            return {
+                "consultas": self.consultas,
+                "aciertos_cache": self.aciertos_cache,
+                "decisiones_locales": self.decisiones_locales,
+                "derivadas_llm": self.derivadas_llm,
+                "tasa_local": round(self.decisiones_locales / decisiones, 3) if decisiones else 0.0,
+                "comparaciones_llm": self.comparaciones,
+                "concordancia_llm": round(self.coincidencias / self.comparaciones, 3) if self.comparaciones else None,
+            }
@@ -0,0 +1,163 @@
+"""
+Ejecución especulativa del enrutamiento y la búsqueda (modo opcional, ESPECULACION=1).
+El embedding de la pregunta no depende de qué política elija el enrutador, así que
+se calcula apenas llega el mensaje, mientras el orquestador hace su primera llamada
+al LLM. Con el enrutador por embeddings, además se buscan de antemano los chunks de
+las políticas más probables. Cuando las herramientas se llaman con la misma pregunta
+reutilizan ese trabajo; lo que no se usa se cancela al terminar la ejecución.
+"""
+
+import os
+import time
+import asyncio
+import threading
+
+from enrutador_politicas import normalizar_pregunta
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+ESPECULACION = os.getenv("ESPECULACION", "0") == "1"
+# Cuántas de las políticas mejor puntuadas por el enrutador se buscan de antemano
+ESPECULACION_POLITICAS = int(os.getenv("ESPECULACION_POLITICAS", 2))
+ESPECULACION_N_RESULTADOS = int(os.getenv("ESPECULACION_N_RESULTADOS", 5))
+
+
+class Especulador:
+    """
+    Tareas especulativas por pregunta normalizada. `iniciar` y `descartar` enmarcan
+    una ejecución del agente; `embedding` y `buscar` las usan las herramientas.
+    """
+
+    def __init__(self, embeddings_model, motor_busqueda, enrutador=None,
+                 n_politicas=ESPECULACION_POLITICAS, n_resultados=ESPECULACION_N_RESULTADOS):
+        self.embeddings_model = embeddings_model
+        self.motor_busqueda = motor_busqueda
+        self.enrutador = enrutador
+        self.n_politicas = n_politicas
+        self.n_resultados = n_resultados
+        self._entradas = {}
+        self._lock = threading.Lock()
+        self.ejecuciones = 0
+        self.embeddings_reutilizados = 0
+        self.busquedas_reutilizadas = 0
+        self.busquedas_descartadas = 0
+        self.ms_ahorrados = 0.0
+
+    # --------------------------------------------------------------------------
+    # Tareas especulativas
+    # --------------------------------------------------------------------------
+    async def _medir(self, tiempos, etapa, corrutina):
+        inicio = time.perf_counter()
+        try:
+            return await corrutina
+        finally:
+            tiempos[etapa] = (time.perf_counter() - inicio) * 1000
+
+    async def _prebuscar(self, entrada, pregunta, nombres_validos):
+        embedding = await entrada["embedding"]
+        if self.enrutador is None:
+            return
+        puntajes = self.enrutador.puntajes(embedding, nombres_validos)
+        for nombre_politica in sorted(puntajes, key=puntajes.get, reverse=True)[:self.n_politicas]:
+            entrada["busquedas"][nombre_politica] = asyncio.ensure_future(self._medir(
+                entrada["tiempos"], f"busqueda:{nombre_politica}",
+                self.motor_busqueda.abuscar(pregunta, embedding, nombre_politica, self.n_resultados)
+            ))
+
+    def iniciar(self, pregunta, nombres_validos):
+        """Lanza el embedding (y las búsquedas probables) sin esperar el resultado."""
+        clave = normalizar_pregunta(pregunta)
+        with self._lock:
+            self.ejecuciones += 1
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                entrada["referencias"] += 1
+                return
+            entrada = {"referencias": 1, "busquedas": {}, "tiempos": {}, "esperas": {}}
+            self._entradas[clave] = entrada
+        entrada["embedding"] = asyncio.ensure_future(
+            self._medir(entrada["tiempos"], "embedding", self.embeddings_model.aembed_query(pregunta))
+        )
+        entrada["prebusqueda"] = asyncio.ensure_future(self._prebuscar(entrada, pregunta, list(nombres_validos)))
+
+    def descartar(self, pregunta):
+        """Cierra la ejecución: cancela lo no usado y devuelve los tiempos por etapa."""
+        clave = normalizar_pregunta(pregunta)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            entrada["referencias"] -= 1
+            if entrada["referencias"] > 0:
+                return None
+            del self._entradas[clave]
+
+        for tarea in [entrada.get("embedding"), entrada.get("prebusqueda"), *entrada["busquedas"].values()]:
+            if tarea is not None and not tarea.done():
+                tarea.cancel()
+        usadas = {etapa.split(":", 1)[1] for etapa in entrada["esperas"] if etapa.startswith("busqueda:")}
+        # Ahorro en la ruta crítica: lo que tomó cada etapa menos lo que la herramienta tuvo que esperarla
+        ahorro = sum(max(entrada["tiempos"].get(etapa, 0.0) - espera, 0.0) for etapa, espera in entrada["esperas"].items())
+        with self._lock:
+            self.busquedas_descartadas += len(set(entrada["busquedas"]) - usadas)
+            self.ms_ahorrados += ahorro
+        return {
+            "etapas_ms": {etapa: round(ms, 1) for etapa, ms in entrada["tiempos"].items()},
+            "esperas_ms": {etapa: round(ms, 1) for etapa, ms in entrada["esperas"].items()},
+            "ahorro_ms": round(ahorro, 1),
+        }
+
+    # --------------------------------------------------------------------------
+    # Uso desde las herramientas
+    # --------------------------------------------------------------------------
+    async def _esperar(self, entrada, etapa, tarea):
+        inicio = time.perf_counter()
+        resultado = await asyncio.shield(tarea)
+        entrada["esperas"][etapa] = (time.perf_counter() - inicio) * 1000
+        return resultado
+
+    async def embedding(self, pregunta):
+        entrada = self._entradas.get(normalizar_pregunta(pregunta))
+        if entrada is not None and not entrada["embedding"].cancelled():
+            try:
+                embedding = await self._esperar(entrada, "embedding", entrada["embedding"])
+                with self._lock:
+                    self.embeddings_reutilizados += 1
+                return embedding
+            except Exception as e:
+                print(f"Embedding especulativo falló, se calcula de nuevo: {e}")
+        return await self.embeddings_model.aembed_query(pregunta)
+
+    async def buscar(self, pregunta, embedding_pregunta, nombre_politica, n_resultados=5):
+        """Usa la búsqueda anticipada si existe para esa política y alcanza `n_resultados`."""
+        entrada = self._entradas.get(normalizar_pregunta(pregunta))
+        if entrada is not None and n_resultados <= self.n_resultados:
+            try:
+                # La prebúsqueda crea las tareas apenas hay embedding; se espera a que termine de lanzarlas
+                await asyncio.shield(entrada["prebusqueda"])
+                tarea = entrada["busquedas"].get(nombre_politica)
+                if tarea is not None and not tarea.cancelled():
+                    documentos, metadatos = await self._esperar(entrada, f"busqueda:{nombre_politica}", tarea)
+                    with self._lock:
+                        self.busquedas_reutilizadas += 1
+                    return documentos[:n_resultados], metadatos[:n_resultados]
+            except Exception as e:
+                print(f"Búsqueda especulativa falló, se repite: {e}")
+        return await self.motor_busqueda.abuscar(pregunta, embedding_pregunta, nombre_politica, n_resultados)
+
+    def registrar_tiempo(self, pregunta, etapa, ms):
+        """Agrega una etapa no especulativa (p. ej. el enrutamiento) al informe de la ejecución."""
+        entrada = self._entradas.get(normalizar_pregunta(pregunta))
+        if entrada is not None:
+            entrada["tiempos"][etapa] = ms
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "ejecuciones": self.ejecuciones,
+                "embeddings_reutilizados": self.embeddings_reutilizados,
+                "busquedas_reutilizadas": self.busquedas_reutilizadas,
+                "busquedas_descartadas": self.busquedas_descartadas,
+                "ms_ahorrados_ruta_critica": round(self.ms_ahorrados, 1),
+            }
@@ -0,0 +1,172 @@
+"""
+Índice léxico BM25 por política y búsqueda híbrida (modo opcional, BUSQUEDA_HIBRIDA=1).
+Las preguntas de RRHH traen términos exactos (números de artículo, "finiquito", "RUT",
+nombres de beneficios) que la búsqueda por embeddings a veces no prioriza. La ingesta
+guarda un índice invertido de los chunks junto a db_politicas y el servidor combina
+el ranking léxico con el vectorial mediante reciprocal rank fusion (RRF).
+"""
+
+import os
+import re
+import sys
+import json
+import unicodedata
+from collections import Counter
+import numpy as np
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+BUSQUEDA_HIBRIDA = os.getenv("BUSQUEDA_HIBRIDA", "0") == "1"
+RUTA_INDICE_BM25 = os.getenv("RUTA_INDICE_BM25", os.path.join("db_politicas", "indice_bm25"))
+BM25_K1 = float(os.getenv("BM25_K1", 1.5))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+# Constante de RRF: 1 / (RRF_K + posición)
+RRF_K = int(os.getenv("RRF_K", 60))
+# Candidatos que aporta cada ranking = n_resultados * FACTOR_CANDIDATOS_HIBRIDA
+FACTOR_CANDIDATOS_HIBRIDA = int(os.getenv("FACTOR_CANDIDATOS_HIBRIDA", 4))
+
+PATRON_TERMINO = re.compile(r"\w+(?:[.\-/]\w+)*")
+PALABRAS_VACIAS = set(
+    "a al algo ante como con cual cuando de del desde donde el ella en entre era es esa ese eso esta este "
+    "esto fue ha hay la las le les lo los mas me mi muy no nos o para pero por que quien se sea segun "
+    "si sin sobre son su sus tambien te tiene tu un una uno unos y ya yo".split()
+)
+
+
+def tokenizar(texto):
+    """Términos en minúsculas y sin tildes; conserva números como '12.1' o '2024-01'."""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return [t for t in PATRON_TERMINO.findall(texto) if t not in PALABRAS_VACIAS]
+
+def _ruta_politica(nombre_politica, ruta_indice=RUTA_INDICE_BM25):
+    return os.path.join(ruta_indice, f"{nombre_politica}.json")
+
+
+# ==============================================================================
+# EXPORTACIÓN (la llama la ingesta)
+# ==============================================================================
+def exportar_politica(coleccion, nombre_politica, ruta_indice=RUTA_INDICE_BM25):
+    """Construye y guarda el índice invertido de los chunks de una política."""
+    datos = coleccion.get(where={"source": nombre_politica}, include=["documents", "metadatas"])
+    ruta = _ruta_politica(nombre_politica, ruta_indice)
+    if not datos["ids"]:
+        if os.path.exists(ruta):
+            os.remove(ruta)
+        return 0
+
+    postings = {}
+    longitudes = []
+    for fila, texto in enumerate(datos["documents"]):
+        frecuencias = Counter(tokenizar(texto or ""))
+        longitudes.append(sum(frecuencias.values()))
+        for termino, tf in frecuencias.items():
+            postings.setdefault(termino, []).append([fila, tf])
+
+    os.makedirs(ruta_indice, exist_ok=True)
+    ruta_tmp = ruta + ".tmp"
+    with open(ruta_tmp, "w", encoding="utf-8") as f:
+        json.dump({"ids": list(datos["ids"]), "documentos": datos["documents"], "metadatos": datos["metadatas"],
+                   "longitudes": longitudes, "postings": postings}, f, ensure_ascii=False)
+    os.replace(ruta_tmp, ruta)
+    return len(datos["ids"])
+
+def actualizar_indice_bm25(coleccion, nombres_presentes, nombres_modificados, nombres_eliminados,
+                           ruta_indice=RUTA_INDICE_BM25):
+    """Reexporta las políticas modificadas o sin índice y borra las eliminadas."""
+    for nombre_politica in nombres_eliminados:
+        ruta = _ruta_politica(nombre_politica, ruta_indice)
+        if os.path.exists(ruta):
+            os.remove(ruta)
+
+    for nombre_politica in sorted(nombres_presentes):
+        if nombre_politica in nombres_modificados or not os.path.exists(_ruta_politica(nombre_politica, ruta_indice)):
+            n = exportar_politica(coleccion, nombre_politica, ruta_indice)
+            print(f"   Índice BM25 de '{nombre_politica}' actualizado ({n} chunks).")
+
+
+# ==============================================================================
+# BÚSQUEDA (la usan los servidores)
+# ==============================================================================
+class IndiceBM25:
+    """Índices invertidos de todas las políticas exportadas en `ruta_indice`."""
+
+    def __init__(self, ruta_indice=RUTA_INDICE_BM25):
+        self.ruta_indice = ruta_indice
+        self.politicas = {}
+        self.cargar()
+
+    def cargar(self):
+        politicas = {}
+        if os.path.isdir(self.ruta_indice):
+            for archivo in sorted(os.listdir(self.ruta_indice)):
+                if not archivo.endswith(".json"):
+                    continue
+                with open(os.path.join(self.ruta_indice, archivo), "r", encoding="utf-8") as f:
+                    datos = json.load(f)
+                longitudes = np.asarray(datos["longitudes"], dtype=np.float32)
+                n = len(longitudes)
+                terminos = {}
+                for termino, lista in datos["postings"].items():
+                    filas_tf = np.asarray(lista, dtype=np.int32)
+                    df = len(filas_tf)
+                    terminos[termino] = (filas_tf[:, 0], filas_tf[:, 1].astype(np.float32),
+                                         float(np.log(1 + (n - df + 0.5) / (df + 0.5))))
+                politicas[archivo[:-len(".json")]] = {
+                    "documentos": datos["documentos"],
+                    "metadatos": datos["metadatos"],
+                    "terminos": terminos,
+                    # Parte de la normalización por largo que no depende del término
+                    "norma": BM25_K1 * (1 - BM25_B + BM25_B * longitudes / max(float(longitudes.mean()), 1.0)),
+                }
+        self.politicas = politicas
+        print(f"Índice BM25 cargado: {len(politicas)} políticas.")
+
+    def buscar(self, pregunta, nombre_politica, n_resultados=5):
+        """Devuelve (documentos, metadatos) de los `n_resultados` chunks con mayor puntaje BM25."""
+        politica = self.politicas.get(nombre_politica)
+        if politica is None:
+            return [], []
+        puntajes = np.zeros(len(politica["norma"]), dtype=np.float32)
+        for termino in set(tokenizar(pregunta)):
+            if termino not in politica["terminos"]:
+                continue
+            filas, tf, idf = politica["terminos"][termino]
+            puntajes[filas] += idf * tf * (BM25_K1 + 1) / (tf + politica["norma"][filas])
+
+        encontrados = np.flatnonzero(puntajes)
+        if len(encontrados) == 0:
+            return [], []
+        k = min(n_resultados, len(encontrados))
+        mejores = encontrados[np.argpartition(-puntajes[encontrados], k - 1)[:k]]
+        mejores = mejores[np.argsort(-puntajes[mejores])]
+        return [politica["documentos"][i] for i in mejores], [politica["metadatos"][i] for i in mejores]
+
+
+def fusionar_rrf(rankings, n_resultados, k=RRF_K):
+    """
+    Reciprocal rank fusion de varios rankings [(documentos, metadatos)]. Los chunks se
+    identifican por su texto: el mismo fragmento puede venir de ambos rankings.
+    """
+    puntajes = {}
+    datos = {}
+    for documentos, metadatos in rankings:
+        for posicion, (texto, meta) in enumerate(zip(documentos, metadatos)):
+            puntajes[texto] = puntajes.get(texto, 0.0) + 1.0 / (k + posicion + 1)
+            datos.setdefault(texto, meta)
+    orden = sorted(puntajes, key=puntajes.get, reverse=True)[:n_resultados]
+    return orden, [datos[texto] for texto in orden]
+
+
+if __name__ == "__main__":
+    # Uso: python indice_bm25.py "pregunta" nombre_politica.pdf  -> exporta el índice y muestra el top 5
+    import chromadb
+    cliente_chroma = chromadb.PersistentClient(path="db_politicas")
+    coleccion = cliente_chroma.get_collection(name="politicas_empresariales")
+    fuentes = {meta["source"] for meta in coleccion.get(include=["metadatas"])["metadatas"]}
+    actualizar_indice_bm25(coleccion, fuentes, fuentes, [])
+    if len(sys.argv) == 3:
+        documentos, _ = IndiceBM25().buscar(sys.argv[1], sys.argv[2])
+        for posicion, texto in enumerate(documentos, 1):
+            print(f"\n[{posicion}] {texto[:300]}")
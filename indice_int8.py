@@ -0,0 +1,343 @@
+"""
+Índice cuantizado a int8 (modo opcional, INDICE_CUANTIZADO=1).
+La ingesta guarda, por cada política, los vectores cuantizados a int8 junto con el
+mínimo y máximo de cada vector, más una copia float32 en disco. La búsqueda hace una
+primera pasada aproximada sobre los int8 (en RAM) y reordena un conjunto pequeño de
+candidatos leyendo solo esas filas de la matriz float32, abierta con memmap. Así el
+servidor nunca pide los embeddings a Chroma y no carga su índice HNSW en memoria;
+de Chroma solo se leen los textos y metadatos de los resultados finales.
+
+Igual que en indice_numpy, la matriz float32 se escribe con un nombre nuevo en cada
+exportación porque en Windows no se puede sobrescribir un archivo abierto con memmap.
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+INDICE_CUANTIZADO = os.getenv("INDICE_CUANTIZADO", "0") == "1"
+RUTA_INDICE_INT8 = os.getenv("RUTA_INDICE_INT8", os.path.join("db_politicas", "indice_int8"))
+# Candidatos de la primera pasada = n_resultados * FACTOR_CANDIDATOS
+FACTOR_CANDIDATOS = int(os.getenv("FACTOR_CANDIDATOS_INT8", 4))
+# Filas por bloque al convertir int8 -> float32, para acotar la memoria temporal
+FILAS_POR_BLOQUE = 16384
+
+
+# ==============================================================================
+# CUANTIZACIÓN
+# ==============================================================================
+def quantize_vectors_to_int8(vectors_np):
+    min_val = vectors_np.min(axis=1, keepdims=True)
+    max_val = vectors_np.max(axis=1, keepdims=True)
+    scale = 254.0 / (max_val - min_val + 1e-9)
+    offset = min_val
+    quantized_vectors = np.round((vectors_np - offset) * scale - 127.0)
+    return quantized_vectors.astype(np.int8), min_val.flatten(), max_val.flatten()
+
+def dequantize_int8(quantized, min_val, max_val):
+    """Inversa aproximada de quantize_vectors_to_int8 (solo para diagnóstico)."""
+    paso = ((max_val - min_val + 1e-9) / 254.0)[:, None]
+    return (quantized.astype(np.float32) + 127.0) * paso + min_val[:, None]
+
+def _ruta_politica(nombre_politica, ruta_indice=RUTA_INDICE_INT8):
+    return os.path.join(ruta_indice, f"{nombre_politica}.npz")
+
+def _matrices_de(nombre_politica, ruta_indice):
+    """Matrices float32 (.npy, de cualquier generación) de una política."""
+    if not os.path.isdir(ruta_indice):
+        return []
+    prefijo = f"{nombre_politica}."
+    return [
+        archivo for archivo in os.listdir(ruta_indice)
+        if archivo.startswith(prefijo) and archivo.endswith(".npy")
+        and archivo[len(prefijo):-len(".npy")].isdigit()
+    ]
+
+def _borrar_exportacion(nombre_politica, ruta_indice, vigente=None):
+    """Borra las matrices float32 que no son la `vigente` (todo, junto al .npz, si no hay vigente)."""
+    ruta = _ruta_politica(nombre_politica, ruta_indice)
+    if vigente is None and os.path.exists(ruta):
+        os.remove(ruta)
+    for archivo in _matrices_de(nombre_politica, ruta_indice):
+        if archivo == vigente:
+            continue
+        try:
+            os.remove(os.path.join(ruta_indice, archivo))
+        except OSError:
+            # Un servidor aún la tiene abierta con memmap; se borra en la próxima exportación
+            pass
+
+def _exportacion_completa(nombre_politica, ruta_indice):
+    """True si la política tiene su .npz y la matriz float32 a la que apunta."""
+    ruta = _ruta_politica(nombre_politica, ruta_indice)
+    if not os.path.exists(ruta):
+        return False
+    with np.load(ruta) as datos:
+        if "matriz_float" not in datos.files:
+            return False
+        return os.path.exists(os.path.join(ruta_indice, str(datos["matriz_float"])))
+
+def memoria_residente_mb():
+    """RSS actual del proceso en MB, o None si la plataforma no permite medirlo."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            paginas = int(f.read().split()[1])
+        return round(paginas * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().rss / (1024 * 1024), 1)
+    except ImportError:
+        return None
+
+
+# ==============================================================================
+# EXPORTACIÓN (la llama la ingesta)
+# ==============================================================================
+def exportar_politica(coleccion, nombre_politica, ruta_indice=RUTA_INDICE_INT8):
+    """
+    Cuantiza todos los vectores de una política y guarda en `ruta_indice` el .npz int8
+    y la matriz float32 para el reordenamiento (mismo orden de filas que `ids`).
+    """
+    datos = coleccion.get(where={"source": nombre_politica}, include=["embeddings"])
+    ruta = _ruta_politica(nombre_politica, ruta_indice)
+    if not datos["ids"]:
+        _borrar_exportacion(nombre_politica, ruta_indice)
+        return 0
+
+    vectores = np.ascontiguousarray(np.asarray(datos["embeddings"], dtype=np.float32))
+    cuantizados, min_val, max_val = quantize_vectors_to_int8(vectores)
+    os.makedirs(ruta_indice, exist_ok=True)
+    archivo_matriz = f"{nombre_politica}.{time.time_ns()}.npy"
+    np.save(os.path.join(ruta_indice, archivo_matriz), vectores)
+
+    ruta_tmp = ruta + ".tmp.npz"
+    np.savez(ruta_tmp, ids=np.asarray(datos["ids"]), vectores=cuantizados,
+             min_val=min_val.astype(np.float32), max_val=max_val.astype(np.float32),
+             matriz_float=np.asarray(archivo_matriz))
+    os.replace(ruta_tmp, ruta)
+    _borrar_exportacion(nombre_politica, ruta_indice, vigente=archivo_matriz)
+    return len(datos["ids"])
+
+def actualizar_indice_int8(coleccion, nombres_presentes, nombres_modificados, nombres_eliminados,
+                           ruta_indice=RUTA_INDICE_INT8):
+    """
+    Mantiene el índice int8 al día tras una ingesta: reexporta las políticas modificadas
+    o sin exportación completa (p. ej. la primera vez que se activa el modo, o un .npz
+    anterior sin matriz float32) y borra las eliminadas.
+    """
+    for nombre_politica in nombres_eliminados:
+        _borrar_exportacion(nombre_politica, ruta_indice)
+
+    for nombre_politica in sorted(nombres_presentes):
+        if nombre_politica in nombres_modificados or not _exportacion_completa(nombre_politica, ruta_indice):
+            n = exportar_politica(coleccion, nombre_politica, ruta_indice)
+            print(f"   Índice int8 de '{nombre_politica}' actualizado ({n} vectores).")
+
+
+# ==============================================================================
+# BÚSQUEDA (la usan los servidores)
+# ==============================================================================
+class IndiceInt8:
+    """Índice int8 en memoria (y float32 en memmap) para las políticas exportadas en `ruta_indice`."""
+
+    def __init__(self, coleccion, ruta_indice=RUTA_INDICE_INT8):
+        self.coleccion = coleccion
+        self.ruta_indice = ruta_indice
+        self.politicas = {}
+        self.cargar()
+
+    def cargar(self):
+        politicas = {}
+        if os.path.isdir(self.ruta_indice):
+            for archivo in sorted(os.listdir(self.ruta_indice)):
+                if not archivo.endswith(".npz") or archivo.endswith(".tmp.npz"):
+                    continue
+                with np.load(os.path.join(self.ruta_indice, archivo)) as datos:
+                    min_val = datos["min_val"]
+                    max_val = datos["max_val"]
+                    matriz_float = None
+                    if "matriz_float" in datos.files:
+                        ruta_matriz = os.path.join(self.ruta_indice, str(datos["matriz_float"]))
+                        if os.path.exists(ruta_matriz):
+                            matriz_float = np.load(ruta_matriz, mmap_mode="r")
+                    if matriz_float is None or len(matriz_float) != len(datos["ids"]):
+                        print(f"Advertencia: '{archivo}' no tiene matriz float32 válida; "
+                              "reejecuta la ingesta. Se reordenará con Chroma.")
+                        matriz_float = None
+                    politicas[archivo[:-len(".npz")]] = {
+                        "ids": datos["ids"],
+                        "vectores": datos["vectores"],
+                        # x ≈ paso * (q + 127) + min, por vector
+                        "paso": ((max_val - min_val + 1e-9) / 254.0).astype(np.float32),
+                        "min_val": min_val,
+                        "matriz_float": matriz_float,
+                    }
+        self.politicas = politicas
+        print(f"Índice int8 cargado: {len(politicas)} políticas, {sum(len(p['ids']) for p in politicas.values())} vectores.")
+
+    def _puntajes_aproximados(self, politica, consulta):
+        """Producto punto aproximado entre la consulta y todos los vectores int8."""
+        vectores = politica["vectores"]
+        suma_consulta = float(consulta.sum())
+        productos = np.empty(len(vectores), dtype=np.float32)
+        for inicio in range(0, len(vectores), FILAS_POR_BLOQUE):
+            bloque = vectores[inicio:inicio + FILAS_POR_BLOQUE]
+            productos[inicio:inicio + len(bloque)] = bloque.astype(np.float32) @ consulta
+        return politica["paso"] * (productos + 127.0 * suma_consulta) + politica["min_val"] * suma_consulta
+
+    def _filas_candidatas(self, politica, consulta, n_candidatos):
+        """Filas de los `n_candidatos` mejores según la pasada int8, de mejor a peor."""
+        puntajes = self._puntajes_aproximados(politica, consulta)
+        n_candidatos = min(n_candidatos, len(puntajes))
+        mejores = np.argpartition(-puntajes, n_candidatos - 1)[:n_candidatos]
+        return mejores[np.argsort(-puntajes[mejores])]
+
+    def candidatos(self, embedding_consulta, nombre_politica, n_candidatos):
+        """IDs de los `n_candidatos` mejores según la pasada int8."""
+        politica = self.politicas.get(nombre_politica)
+        if politica is None or len(politica["ids"]) == 0:
+            return []
+        consulta = np.asarray(embedding_consulta, dtype=np.float32)
+        return [str(i) for i in politica["ids"][self._filas_candidatas(politica, consulta, n_candidatos)]]
+
+    def buscar(self, embedding_consulta, nombre_politica, n_resultados=5, factor_candidatos=FACTOR_CANDIDATOS):
+        """
+        Devuelve (documentos, metadatos) de los `n_resultados` chunks más cercanos.
+        Los candidatos de la pasada int8 se reordenan con sus filas de la matriz float32
+        en disco; a Chroma solo se le piden los textos y metadatos de los ganadores.
+        """
+        politica = self.politicas.get(nombre_politica)
+        if politica is None or len(politica["ids"]) == 0:
+            return [], []
+        consulta = np.asarray(embedding_consulta, dtype=np.float32)
+        filas = self._filas_candidatas(politica, consulta, n_resultados * factor_candidatos)
+
+        if politica["matriz_float"] is None:
+            # Exportación anterior sin matriz float32: se reordena con los vectores de Chroma
+            datos = self.coleccion.get(ids=[str(i) for i in politica["ids"][filas]],
+                                       include=["embeddings", "documents", "metadatas"])
+            orden = np.argsort(-(np.asarray(datos["embeddings"], dtype=np.float32) @ consulta))[:n_resultados]
+            return [datos["documents"][i] for i in orden], [datos["metadatas"][i] for i in orden]
+
+        # Filas en orden creciente: el memmap lee solo esas páginas del archivo
+        filas = np.sort(filas)
+        puntajes = np.asarray(politica["matriz_float"][filas]) @ consulta
+        ganadores = [str(i) for i in politica["ids"][filas[np.argsort(-puntajes)[:n_resultados]]]]
+        datos = self.coleccion.get(ids=ganadores, include=["documents", "metadatas"])
+        posicion = {chunk_id: i for i, chunk_id in enumerate(datos["ids"])}
+        orden = [posicion[chunk_id] for chunk_id in ganadores if chunk_id in posicion]
+        return [datos["documents"][i] for i in orden], [datos["metadatas"][i] for i in orden]
+
+    def estadisticas(self):
+        """
+        Bytes del índice int8 residentes en RAM, tamaño en disco de las matrices float32
+        (memmap: solo se leen las filas candidatas) y el RSS real del proceso.
+        """
+        n_vectores = sum(len(p["ids"]) for p in self.politicas.values())
+        bytes_int8 = sum(p["vectores"].nbytes + p["paso"].nbytes + p["min_val"].nbytes for p in self.politicas.values())
+        bytes_float32_disco = sum(p["matriz_float"].nbytes for p in self.politicas.values() if p["matriz_float"] is not None)
+        return {
+            "politicas": len(self.politicas),
+            "vectores": n_vectores,
+            "mb_int8": round(bytes_int8 / (1024 * 1024), 2),
+            "mb_float32_memmap": round(bytes_float32_disco / (1024 * 1024), 2),
+            "politicas_sin_memmap": sum(1 for p in self.politicas.values() if p["matriz_float"] is None),
+            "rss_proceso_mb": memoria_residente_mb(),
+        }
+
+
+# ==============================================================================
+# EVALUACIÓN DE RECALL FRENTE A LA BÚSQUEDA FLOAT
+# ==============================================================================
+def evaluar_recall(indice, n_consultas=200, n_resultados=5, semilla=0):
+    """
+    Usa chunks almacenados (con algo de ruido) como consultas y compara el top-k del
+    modo int8 (primera pasada + reordenamiento) con el top-k exacto en float32.
+    """
+    rng = np.random.default_rng(semilla)
+    aciertos_int8 = 0
+    aciertos_reordenado = 0
+    total = 0
+
+    for nombre_politica, politica in indice.politicas.items():
+        if politica["matriz_float"] is not None:
+            ids = np.asarray([str(i) for i in politica["ids"]])
+            vectores = np.asarray(politica["matriz_float"])
+        else:
+            datos = indice.coleccion.get(where={"source": nombre_politica}, include=["embeddings"])
+            ids = np.asarray(datos["ids"])
+            vectores = np.asarray(datos["embeddings"], dtype=np.float32)
+        if len(ids) == 0:
+            continue
+        fila_por_id = {chunk_id: fila for fila, chunk_id in enumerate(ids)}
+        k = min(n_resultados, len(ids))
+        n = max(1, n_consultas // len(indice.politicas))
+
+        for fila in rng.choice(len(vectores), size=min(n, len(vectores)), replace=False):
+            consulta = vectores[fila] + rng.normal(0, 0.01, vectores.shape[1]).astype(np.float32)
+            exactos = set(ids[np.argsort(-(vectores @ consulta))[:k]])
+
+            solo_int8 = set(indice.candidatos(consulta, nombre_politica, k))
+            candidatos = indice.candidatos(consulta, nombre_politica, k * FACTOR_CANDIDATOS)
+            filas_candidatas = np.asarray([fila_por_id[c] for c in candidatos])
+            reordenados = set(ids[filas_candidatas[np.argsort(-(vectores[filas_candidatas] @ consulta))[:k]]])
+
+            aciertos_int8 += len(solo_int8 & exactos)
+            aciertos_reordenado += len(reordenados & exactos)
+            total += len(exactos)
+
+    return {
+        "consultas_evaluadas": total // max(n_resultados, 1),
+        "recall_int8": round(aciertos_int8 / total, 4) if total else None,
+        "recall_int8_reordenado": round(aciertos_reordenado / total, 4) if total else None,
+    }
+
+
+def medir_memoria(indice, n_consultas=200, n_resultados=5, semilla=0):
+    """
+    RSS real del proceso antes y después de responder `n_consultas` con el índice int8,
+    y después de responder las mismas con la búsqueda float de Chroma (que carga su HNSW).
+    Conviene llamarla en un proceso recién iniciado: el RSS no baja al liberar memoria.
+    """
+    rng = np.random.default_rng(semilla)
+    consultas = []
+    for nombre_politica, politica in indice.politicas.items():
+        if politica["matriz_float"] is None or len(politica["ids"]) == 0:
+            continue
+        for fila in rng.choice(len(politica["ids"]), size=min(n_consultas, len(politica["ids"])), replace=False):
+            consultas.append((nombre_politica, np.array(politica["matriz_float"][fila])))
+
+    rss_inicial = memoria_residente_mb()
+    for nombre_politica, consulta in consultas:
+        indice.buscar(consulta, nombre_politica, n_resultados)
+    rss_int8 = memoria_residente_mb()
+    for nombre_politica, consulta in consultas:
+        indice.coleccion.query(query_embeddings=[consulta.tolist()], n_results=n_resultados,
+                               where={"source": nombre_politica}, include=["documents", "metadatas"])
+    rss_float = memoria_residente_mb()
+    return {
+        "consultas": len(consultas),
+        "rss_inicial_mb": rss_inicial,
+        "rss_tras_int8_mb": rss_int8,
+        "rss_tras_chroma_float_mb": rss_float,
+    }
+
+
+if __name__ == "__main__":
+    # Uso: python indice_int8.py  -> RSS real del modo int8 frente a Chroma, y recall frente a float32
+    import chromadb
+    cliente_chroma = chromadb.PersistentClient(path="db_politicas")
+    coleccion = cliente_chroma.get_collection(name="politicas_empresariales")
+    indice = IndiceInt8(coleccion)
+    if not indice.politicas:
+        print("No hay índice int8. Ejecuta la ingesta con INDICE_CUANTIZADO=1.")
+        sys.exit(1)
+    print(f"Índice: {indice.estadisticas()}")
+    print(f"Memoria: {medir_memoria(indice)}")
+    print(f"Recall@5: {evaluar_recall(indice)}")
@@ -0,0 +1,191 @@
+"""
+Índice vectorial en memoria con NumPy (modo opcional, INDICE_NUMPY=1).
+Todo el corpus cabe en RAM, así que la búsqueda no necesita pasar por Chroma: la
+ingesta exporta por política una matriz contigua de embeddings (.npy) y un archivo
+con sus IDs, textos y metadatos. El servidor abre las matrices con memmap y busca con
+un producto punto vectorizado más argpartition.
+
+Cada exportación escribe la matriz con un nombre nuevo y luego reemplaza el JSON que
+apunta a ella: en Windows no se puede sobrescribir un archivo abierto con memmap.
+"""
+
+import os
+import sys
+import json
+import time
+import numpy as np
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+INDICE_NUMPY = os.getenv("INDICE_NUMPY", "0") == "1"
+RUTA_INDICE_NUMPY = os.getenv("RUTA_INDICE_NUMPY", os.path.join("db_politicas", "indice_numpy"))
+# "float32" o "float16" (la mitad de memoria; se convierte a float32 por bloques al buscar)
+TIPO_INDICE_NUMPY = os.getenv("TIPO_INDICE_NUMPY", "float32")
+FILAS_POR_BLOQUE = 16384
+
+
+def _ruta_datos(nombre_politica, ruta_indice=RUTA_INDICE_NUMPY):
+    return os.path.join(ruta_indice, f"{nombre_politica}.json")
+
+def _matrices_de(nombre_politica, ruta_indice):
+    """Archivos .npy (de cualquier generación) de una política."""
+    if not os.path.isdir(ruta_indice):
+        return []
+    prefijo = f"{nombre_politica}."
+    return [
+        archivo for archivo in os.listdir(ruta_indice)
+        if archivo.startswith(prefijo) and archivo.endswith(".npy")
+        and archivo[len(prefijo):-len(".npy")].isdigit()
+    ]
+
+def _borrar_matrices_antiguas(nombre_politica, ruta_indice, vigente=None):
+    for archivo in _matrices_de(nombre_politica, ruta_indice):
+        if archivo == vigente:
+            continue
+        try:
+            os.remove(os.path.join(ruta_indice, archivo))
+        except OSError:
+            # Un servidor aún la tiene abierta con memmap; se borra en la próxima exportación
+            pass
+
+
+# ==============================================================================
+# EXPORTACIÓN (la llama la ingesta)
+# ==============================================================================
+def exportar_politica(coleccion, nombre_politica, ruta_indice=RUTA_INDICE_NUMPY, tipo=TIPO_INDICE_NUMPY):
+    """Guarda la matriz de embeddings y los datos de los chunks de una política."""
+    datos = coleccion.get(where={"source": nombre_politica}, include=["embeddings", "documents", "metadatas"])
+    ruta_datos = _ruta_datos(nombre_politica, ruta_indice)
+    if not datos["ids"]:
+        if os.path.exists(ruta_datos):
+            os.remove(ruta_datos)
+        _borrar_matrices_antiguas(nombre_politica, ruta_indice)
+        return 0
+
+    os.makedirs(ruta_indice, exist_ok=True)
+    archivo_matriz = f"{nombre_politica}.{time.time_ns()}.npy"
+    np.save(os.path.join(ruta_indice, archivo_matriz),
+            np.ascontiguousarray(np.asarray(datos["embeddings"], dtype=np.float32).astype(tipo)))
+
+    ruta_tmp = ruta_datos + ".tmp"
+    with open(ruta_tmp, "w", encoding="utf-8") as f:
+        json.dump({"matriz": archivo_matriz, "ids": list(datos["ids"]),
+                   "documentos": datos["documents"], "metadatos": datos["metadatas"]}, f, ensure_ascii=False)
+    os.replace(ruta_tmp, ruta_datos)
+    _borrar_matrices_antiguas(nombre_politica, ruta_indice, vigente=archivo_matriz)
+    return len(datos["ids"])
+
+def actualizar_indice_numpy(coleccion, nombres_presentes, nombres_modificados, nombres_eliminados,
+                            ruta_indice=RUTA_INDICE_NUMPY):
+    """Reexporta las políticas modificadas o sin exportar y borra las eliminadas."""
+    for nombre_politica in nombres_eliminados:
+        ruta_datos = _ruta_datos(nombre_politica, ruta_indice)
+        if os.path.exists(ruta_datos):
+            os.remove(ruta_datos)
+        _borrar_matrices_antiguas(nombre_politica, ruta_indice)
+
+    for nombre_politica in sorted(nombres_presentes):
+        if nombre_politica in nombres_modificados or not os.path.exists(_ruta_datos(nombre_politica, ruta_indice)):
+            n = exportar_politica(coleccion, nombre_politica, ruta_indice)
+            print(f"   Índice NumPy de '{nombre_politica}' actualizado ({n} vectores).")
+
+
+# ==============================================================================
+# BÚSQUEDA (la usan los servidores)
+# ==============================================================================
+class IndiceNumpy:
+    """Matrices de embeddings por política abiertas con memmap, más sus textos y metadatos."""
+
+    def __init__(self, ruta_indice=RUTA_INDICE_NUMPY):
+        self.ruta_indice = ruta_indice
+        self.politicas = {}
+        self.cargar()
+
+    def cargar(self):
+        """Relee el índice completo; es el gancho de recarga tras una ingesta."""
+        politicas = {}
+        if os.path.isdir(self.ruta_indice):
+            for archivo in sorted(os.listdir(self.ruta_indice)):
+                if not archivo.endswith(".json"):
+                    continue
+                # Una ingesta interrumpida puede dejar el .json sin su matriz o la matriz truncada
+                try:
+                    with open(os.path.join(self.ruta_indice, archivo), "r", encoding="utf-8") as f:
+                        datos = json.load(f)
+                    matriz = np.load(os.path.join(self.ruta_indice, datos["matriz"]), mmap_mode="r")
+                except (OSError, ValueError) as e:
+                    print(f"Advertencia: índice NumPy ilegible para '{archivo}' ({e}), se omite.")
+                    continue
+                if len(matriz) != len(datos["ids"]):
+                    print(f"Advertencia: índice NumPy inconsistente para '{archivo}', se omite.")
+                    continue
+                datos["matriz"] = matriz
+                politicas[archivo[:-len(".json")]] = datos
+        self.politicas = politicas
+        print(f"Índice NumPy cargado: {len(politicas)} políticas, {sum(len(p['ids']) for p in politicas.values())} vectores.")
+
+    def _puntajes(self, matriz, consulta):
+        if matriz.dtype == np.float32:
+            return np.asarray(matriz @ consulta)
+        puntajes = np.empty(len(matriz), dtype=np.float32)
+        for inicio in range(0, len(matriz), FILAS_POR_BLOQUE):
+            bloque = matriz[inicio:inicio + FILAS_POR_BLOQUE]
+            puntajes[inicio:inicio + len(bloque)] = bloque.astype(np.float32) @ consulta
+        return puntajes
+
+    def buscar(self, embedding_consulta, nombre_politica, n_resultados=5):
+        """Devuelve (documentos, metadatos) de los `n_resultados` chunks con mayor producto punto."""
+        politica = self.politicas.get(nombre_politica)
+        if politica is None or len(politica["ids"]) == 0:
+            return [], []
+        consulta = np.asarray(embedding_consulta, dtype=np.float32)
+        puntajes = self._puntajes(politica["matriz"], consulta)
+        k = min(n_resultados, len(puntajes))
+        mejores = np.argpartition(-puntajes, k - 1)[:k]
+        mejores = mejores[np.argsort(-puntajes[mejores])]
+        return [politica["documentos"][i] for i in mejores], [politica["metadatos"][i] for i in mejores]
+
+    def buscar_lote(self, embeddings_consultas, nombre_politica, n_resultados=5):
+        """`buscar` para varias consultas de la misma política con un solo producto de matrices."""
+        politica = self.politicas.get(nombre_politica)
+        if politica is None or len(politica["ids"]) == 0:
+            return [([], []) for _ in embeddings_consultas]
+        consultas = np.asarray(embeddings_consultas, dtype=np.float32)
+        matriz = politica["matriz"]
+        if matriz.dtype == np.float32:
+            puntajes = np.asarray(matriz @ consultas.T)
+        else:
+            puntajes = np.vstack([
+                matriz[inicio:inicio + FILAS_POR_BLOQUE].astype(np.float32) @ consultas.T
+                for inicio in range(0, len(matriz), FILAS_POR_BLOQUE)
+            ])
+        k = min(n_resultados, len(puntajes))
+        mejores = np.argpartition(-puntajes, k - 1, axis=0)[:k]
+        resultados = []
+        for columna in range(len(consultas)):
+            filas = mejores[:, columna]
+            filas = filas[np.argsort(-puntajes[filas, columna])]
+            resultados.append(([politica["documentos"][i] for i in filas], [politica["metadatos"][i] for i in filas]))
+        return resultados
+
+    def estadisticas(self):
+        return {
+            "politicas": len(self.politicas),
+            "vectores": sum(len(p["ids"]) for p in self.politicas.values()),
+            "mb_matrices": round(sum(p["matriz"].nbytes for p in self.politicas.values()) / (1024 * 1024), 2),
+            "tipo": TIPO_INDICE_NUMPY,
+        }
+
+
+if __name__ == "__main__":
+    # Uso: python indice_numpy.py  -> exporta el índice desde la base Chroma actual
+    import chromadb
+    cliente_chroma = chromadb.PersistentClient(path="db_politicas")
+    coleccion = cliente_chroma.get_collection(name="politicas_empresariales")
+    fuentes = {meta["source"] for meta in coleccion.get(include=["metadatas"])["metadatas"]}
+    if not fuentes:
+        print("La colección está vacía. Ejecuta primero la ingesta.")
+        sys.exit(1)
+    actualizar_indice_numpy(coleccion, fuentes, fuentes, [])
+    print(f"Memoria: {IndiceNumpy().estadisticas()}")
@@ -3,13 +3,28 @@
 # ==============================================================================
 
 import os
+import json
+import hashlib
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 import fitz  # PyMuPDF
 import chromadb
-import numpy as np
+import openai
 from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
+from proveedores_embeddings import crear_modelo_embeddings
+from tokenizador import CODIFICACION_EMBEDDINGS, contar_tokens
+from dedup_chunks import DEDUP_CHUNKS, DeduplicadorChunks
+from indice_int8 import INDICE_CUANTIZADO, quantize_vectors_to_int8, actualizar_indice_int8
+from indice_numpy import INDICE_NUMPY, actualizar_indice_numpy
+from indice_bm25 import BUSQUEDA_HIBRIDA, actualizar_indice_bm25
+from enrutador_politicas import RUTA_CENTROIDES, actualizar_centroides, descripcion_politica
 
 print("Iniciando el proceso de vectorización de políticas...")
 load_dotenv(override=True)
@@ -17,15 +32,39 @@ load_dotenv(override=True)
 CARPETA_FILES = "files"
 DB_PATH = "db_politicas"
 NOMBRE_COLECCION = "politicas_empresariales"
+# Manifest de la ingesta incremental: hash, mtime y chunks de cada PDF ya cargado
+MANIFEST_PATH = os.path.join(DB_PATH, "manifest_ingesta.json")
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+# "continuo": el texto de todas las páginas se divide como un solo flujo (modo original).
+# "pagina": cada página se divide por separado y los chunks guardan página, offsets y sección.
+MODO_CHUNKING = os.getenv("MODO_CHUNKING", "continuo")
+# Procesos usados para extraer y dividir los PDFs (1 = secuencial, como antes)
+NUM_WORKERS_INGESTA = int(os.getenv("NUM_WORKERS_INGESTA", 1))
+# Lotes de embeddings: presupuesto de tokens por request, máximo de chunks por request
+# y cuántos requests se envían a la vez
+MAX_TOKENS_LOTE = int(os.getenv("MAX_TOKENS_LOTE", 100_000))
+MAX_CHUNKS_LOTE = int(os.getenv("MAX_CHUNKS_LOTE", 512))
+LOTES_CONCURRENTES = int(os.getenv("LOTES_CONCURRENTES", 4))
+MAX_REINTENTOS_EMBEDDING = 6
+# Chunks en espera entre la extracción y los embeddings; acota la memoria del pipeline
+MAX_CHUNKS_EN_COLA = int(os.getenv("MAX_CHUNKS_EN_COLA", 2 * MAX_CHUNKS_LOTE))
+# Caracteres de la descripción automática de cada PDF que se guarda en el manifest
+LARGO_DESCRIPCION = 240
 
 #Cambios que lee rutas relativas terminadas en .pdf
+def listar_pdfs(carpeta=CARPETA_FILES):
+    """Rutas de los .pdf de `carpeta`, ordenadas para que los IDs no dependan del orden de os.listdir."""
+    if not os.path.isdir(carpeta):
+        return []
+    return sorted(
+        os.path.join(carpeta, f)
+        for f in os.listdir(carpeta)
+        if f.endswith(".pdf") and os.path.isfile(os.path.join(carpeta, f))
+    )
 
 if os.path.isdir(CARPETA_FILES):
-    RUTAS_POLITICAS = [
-        os.path.join(CARPETA_FILES, f) 
-        for f in os.listdir(CARPETA_FILES) 
-        if f.endswith(".pdf") and os.path.isfile(os.path.join(CARPETA_FILES, f))
-    ]
+    RUTAS_POLITICAS = listar_pdfs(CARPETA_FILES)
     if not RUTAS_POLITICAS:
         print(f"Advertencia: No se encontraron archivos .pdf en la carpeta '{CARPETA_FILES}'.")
 else:
@@ -33,90 +72,675 @@ else:
     RUTAS_POLITICAS = [] 
 
 # --- 2. FUNCIONES AUXILIARES ---
-def cargar_y_dividir_politicas(lista_rutas):
+# Líneas que parecen títulos: "CAPÍTULO II", "Artículo 5", "3.1 Requisitos", "BENEFICIOS"
+PATRON_TITULO = re.compile(
+    r"^((CAP[IÍ]TULO|Cap[ií]tulo|ART[IÍ]CULO|Art[ií]culo|T[IÍ]TULO|T[ií]tulo|SECCI[OÓ]N|Secci[oó]n)\b.{0,80}"
+    r"|\d+(\.\d+)*\.?\s+[A-ZÁÉÍÓÚÑ][^.]{0,60}"
+    r"|[A-ZÁÉÍÓÚÑ0-9 ,:;()\-]{4,80})$"
+)
+
+def detectar_titulos(texto):
+    """Devuelve [(offset, titulo)] de las líneas de `texto` que parecen títulos de sección."""
+    titulos = []
+    offset = 0
+    for linea in texto.splitlines(keepends=True):
+        limpia = linea.strip()
+        if limpia and any(c.isalpha() for c in limpia) and PATRON_TITULO.match(limpia):
+            titulos.append((offset + linea.index(limpia), limpia))
+        offset += len(linea)
+    return titulos
+
+def _iterar_chunks_continuo(doc_pdf, nombre_archivo):
+    """
+    Divide el PDF como un solo flujo de texto, leyendo página por página. El último
+    trozo de cada tramo se arrastra al siguiente porque puede continuar en la página
+    que viene, igual que al unir el texto de todas las páginas.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    pendiente = ""
+    for page in doc_pdf:
+        pendiente += page.get_text()
+        if len(pendiente) < 4 * CHUNK_SIZE:
+            continue
+        trozos = text_splitter.split_text(pendiente)
+        for trozo in trozos[:-1]:
+            yield Document(page_content=trozo, metadata={"source": nombre_archivo})
+        pendiente = trozos[-1] if trozos else ""
+    for trozo in text_splitter.split_text(pendiente):
+        yield Document(page_content=trozo, metadata={"source": nombre_archivo})
+
+def _iterar_chunks_por_pagina(doc_pdf, nombre_archivo, paginas_previas):
+    """
+    Divide cada página por separado. Cada chunk lleva página (desde 1), offsets de
+    caracteres dentro de la página y la última sección vista.
+    Las páginas cuyo hash coincide con `paginas_previas` (del manifest) no se vuelven
+    a dividir: se entregan sus IDs anteriores en chunks vacíos marcados "reutilizado".
+    """
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True
+    )
+    seccion = ""
+    for indice, page in enumerate(doc_pdf):
+        numero_pagina = indice + 1
+        texto = page.get_text()
+        # La sección que viene de páginas anteriores también forma parte de la página
+        hash_pagina = hash_texto(f"{numero_pagina}\n{seccion}\n{texto}")
+        titulos = detectar_titulos(texto)
+
+        previa = paginas_previas.get(str(numero_pagina))
+        if previa and previa["hash"] == hash_pagina:
+            for chunk_id in previa["chunks"]:
+                yield Document(page_content="", metadata={
+                    "source": nombre_archivo, "id": chunk_id, "pagina": numero_pagina,
+                    "hash_pagina": hash_pagina, "reutilizado": True,
+                })
+        else:
+            for split in text_splitter.create_documents([texto]):
+                inicio = split.metadata["start_index"]
+                seccion_chunk = seccion
+                for offset, titulo in titulos:
+                    if offset > inicio:
+                        break
+                    seccion_chunk = titulo
+                yield Document(page_content=split.page_content, metadata={
+                    "source": nombre_archivo, "pagina": numero_pagina, "inicio": inicio,
+                    "fin": inicio + len(split.page_content), "seccion": seccion_chunk,
+                    "hash_pagina": hash_pagina,
+                })
+
+        if titulos:
+            seccion = titulos[-1][1]
+
+def iterar_chunks_pdf(ruta, modo=MODO_CHUNKING, paginas_previas=None):
+    """Genera los chunks de un PDF página por página, sin armar el texto completo del documento."""
+    nombre_archivo = os.path.basename(ruta)
+    with fitz.open(ruta) as doc_pdf:
+        if modo == "pagina":
+            yield from _iterar_chunks_por_pagina(doc_pdf, nombre_archivo, paginas_previas or {})
+        else:
+            yield from _iterar_chunks_continuo(doc_pdf, nombre_archivo)
+
+def describir_documento(ruta, largo=LARGO_DESCRIPCION):
+    """
+    Descripción corta de un PDF para enrutar preguntas: el asunto o el título de sus
+    metadatos o, si no tiene, el comienzo de su texto. Se guarda en el manifest para que
+    los servidores enruten los PDFs nuevos sin una descripción escrita a mano.
+    """
+    with fitz.open(ruta) as doc_pdf:
+        metadatos = doc_pdf.metadata or {}
+        for campo in ("subject", "title"):
+            valor = " ".join((metadatos.get(campo) or "").split())
+            if valor:
+                return valor[:largo]
+        for pagina in doc_pdf:
+            texto = " ".join(pagina.get_text().split())
+            if texto:
+                return texto[:largo]
+    return ""
+
+def _procesar_pdf(ruta, paginas_previas=None):
+    """
+    Extrae el texto de un PDF y lo divide en chunks.
+    Se ejecuta dentro de un proceso del pool, por eso no imprime ni lanza excepciones:
+    devuelve (ruta, splits, error) para que el proceso principal informe el resultado.
+    """
+    try:
+        return ruta, list(iterar_chunks_pdf(ruta, MODO_CHUNKING, paginas_previas)), None
+    except Exception as e:
+        return ruta, [], str(e)
+
+def procesar_politicas(lista_rutas, num_workers=NUM_WORKERS_INGESTA, paginas_previas=None):
+    """
+    Generador que entrega (ruta, splits, error) por cada PDF de `lista_rutas`.
+    Con `num_workers` > 1 el trabajo se reparte en un pool de procesos; los resultados
+    se entregan en el mismo orden de `lista_rutas` para que los IDs de los chunks sean estables.
+    Como mucho hay 2 * `num_workers` documentos en proceso o esperando a ser consumidos.
+    `paginas_previas` es {nombre_archivo: páginas del manifest} para el modo "pagina".
+    """
+    if not lista_rutas:
+        return
+    paginas_previas = paginas_previas or {}
+
+    num_workers = max(1, min(num_workers, len(lista_rutas)))
+    if num_workers == 1:
+        for ruta in lista_rutas:
+            yield _procesar_pdf(ruta, paginas_previas.get(os.path.basename(ruta)))
+        return
+
+    print(f"Procesando {len(lista_rutas)} documentos con {num_workers} procesos...")
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        en_vuelo = deque()
+        for ruta in lista_rutas:
+            if len(en_vuelo) >= 2 * num_workers:
+                yield en_vuelo.popleft().result()
+            en_vuelo.append(pool.submit(_procesar_pdf, ruta, paginas_previas.get(os.path.basename(ruta))))
+        while en_vuelo:
+            yield en_vuelo.popleft().result()
+
+def iterar_documentos(lista_rutas, num_workers=NUM_WORKERS_INGESTA, paginas_previas=None):
+    """
+    Como procesar_politicas, pero en modo secuencial los chunks se entregan como un
+    generador que lee el PDF página por página; los errores aparecen al recorrerlo.
+    """
+    paginas_previas = paginas_previas or {}
+    if num_workers > 1 and len(lista_rutas) > 1:
+        yield from procesar_politicas(lista_rutas, num_workers, paginas_previas)
+    else:
+        for ruta in lista_rutas:
+            yield ruta, iterar_chunks_pdf(ruta, MODO_CHUNKING, paginas_previas.get(os.path.basename(ruta))), None
+
+def cargar_y_dividir_politicas(lista_rutas, num_workers=NUM_WORKERS_INGESTA):
     todos_los_splits = []
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
 
     if not lista_rutas:
         print("La lista de rutas a procesar está vacía.")
         return todos_los_splits
-    
+
+    for ruta, splits_del_documento, error in procesar_politicas(lista_rutas, num_workers):
+        if error is not None:
+            print(f"Error procesando '{ruta}': {error}")
+            continue
+        todos_los_splits.extend(splits_del_documento)
+        print(f"Documento '{os.path.basename(ruta)}' procesado.")
+    return todos_los_splits
+
+# --- MANIFEST DE INGESTA INCREMENTAL ---
+def hash_archivo(ruta, tamano_bloque=1024 * 1024):
+    """SHA-256 del contenido de un archivo, leído por bloques."""
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(tamano_bloque), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+def hash_texto(texto):
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+def cargar_manifest(ruta=MANIFEST_PATH):
+    if not os.path.exists(ruta):
+        return {"archivos": {}}
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Advertencia: No se pudo leer el manifest '{ruta}' ({e}). Se reconstruirá.")
+        return {"archivos": {}}
+
+def guardar_manifest(manifest, ruta=MANIFEST_PATH):
+    """Escribe el manifest de forma atómica (archivo temporal + os.replace)."""
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    ruta_tmp = ruta + ".tmp"
+    with open(ruta_tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(ruta_tmp, ruta)
+
+def asignar_id_chunk(nombre_archivo, texto, ids_asignados):
+    """
+    Devuelve (chunk_id, hash_chunk) para un chunk de `nombre_archivo`.
+    El ID depende del contenido del chunk y no de su posición global, así que editar
+    o agregar un PDF no desplaza los IDs del resto. Los chunks repetidos dentro del
+    mismo archivo (ya presentes en `ids_asignados`) se distinguen con un sufijo.
+    """
+    hash_chunk = hash_texto(texto)
+    chunk_id = f"politica_{nombre_archivo}_{hash_chunk[:16]}"
+    ocurrencia = 1
+    while chunk_id in ids_asignados:
+        chunk_id = f"politica_{nombre_archivo}_{hash_chunk[:16]}_{ocurrencia}"
+        ocurrencia += 1
+    return chunk_id, hash_chunk
+
+def asignar_ids_chunks(nombre_archivo, splits):
+    """Devuelve un dict {chunk_id: hash_chunk} en el orden de `splits`."""
+    ids = {}
+    for split in splits:
+        chunk_id, hash_chunk = asignar_id_chunk(nombre_archivo, split.page_content, ids)
+        ids[chunk_id] = hash_chunk
+    return ids
+
+def detectar_cambios(lista_rutas, manifest):
+    """
+    Compara los PDFs de `lista_rutas` con el manifest.
+    Devuelve (rutas_modificadas, nombres_eliminados, info_archivos), donde info_archivos
+    tiene hash, mtime y tamaño de cada PDF presente. Si mtime y tamaño no cambiaron
+    no se recalcula el hash, por eso una corrida sin cambios termina en segundos.
+    """
+    archivos_manifest = manifest.get("archivos", {})
+    rutas_modificadas = []
+    info_archivos = {}
+
     for ruta in lista_rutas:
+        nombre_archivo = os.path.basename(ruta)
+        estado = os.stat(ruta)
+        anterior = archivos_manifest.get(nombre_archivo)
+
+        # Cambiar de modo de chunking obliga a reprocesar el documento
+        if anterior and anterior.get("modo_chunking", "continuo") != MODO_CHUNKING:
+            anterior = None
+
+        if anterior and anterior.get("mtime_ns") == estado.st_mtime_ns and anterior.get("tamano") == estado.st_size:
+            info_archivos[nombre_archivo] = {"hash": anterior["hash"], "mtime_ns": estado.st_mtime_ns, "tamano": estado.st_size}
+            continue
+
+        hash_actual = hash_archivo(ruta)
+        info_archivos[nombre_archivo] = {"hash": hash_actual, "mtime_ns": estado.st_mtime_ns, "tamano": estado.st_size}
+        if not anterior or anterior.get("hash") != hash_actual:
+            rutas_modificadas.append(ruta)
+
+    nombres_presentes = {os.path.basename(ruta) for ruta in lista_rutas}
+    nombres_eliminados = sorted(set(archivos_manifest) - nombres_presentes)
+    return rutas_modificadas, nombres_eliminados, info_archivos
+
+# --- EMBEDDINGS POR LOTES ---
+def generar_lotes_por_tokens(chunks, max_tokens=MAX_TOKENS_LOTE, max_chunks=MAX_CHUNKS_LOTE):
+    """Agrupa los chunks en lotes que no superan `max_tokens` ni `max_chunks`."""
+    lote = []
+    tokens_lote = 0
+    for chunk in chunks:
+        tokens = contar_tokens(chunk.page_content, CODIFICACION_EMBEDDINGS)
+        if lote and (tokens_lote + tokens > max_tokens or len(lote) >= max_chunks):
+            yield lote
+            lote = []
+            tokens_lote = 0
+        lote.append(chunk)
+        tokens_lote += tokens
+    if lote:
+        yield lote
+
+def embeber_con_reintentos(embeddings_model, textos, max_reintentos=MAX_REINTENTOS_EMBEDDING):
+    """Llama a embed_documents reintentando con backoff exponencial ante límites de tasa."""
+    for intento in range(max_reintentos):
+        try:
+            return embeddings_model.embed_documents(textos)
+        except (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError) as e:
+            if intento == max_reintentos - 1:
+                raise
+            espera = min(60, 2 ** intento) + random.uniform(0, 1)
+            print(f"   Límite de la API ({type(e).__name__}), reintentando en {espera:.1f}s...")
+            time.sleep(espera)
+
+def guardar_lote_en_chroma(coleccion, lote, embeddings):
+    ids = []
+    metadatos = []
+    for split in lote:
+        meta = split.metadata.copy()
+        ids.append(meta.pop('id'))
+        metadatos.append(meta)
+    coleccion.add(
+        embeddings=embeddings,
+        documents=[split.page_content for split in lote],
+        metadatas=metadatos,
+        ids=ids
+    )
+
+def embeber_y_guardar_en_lotes(chunks, embeddings_model, coleccion, concurrencia=LOTES_CONCURRENTES,
+                               lock_chroma=None):
+    """
+    Genera los embeddings de `chunks` (lista o iterador) en lotes acotados por tokens,
+    con a lo más `concurrencia` requests en vuelo, y escribe cada lote en Chroma apenas
+    termina. Las escrituras se hacen desde el hilo que llama a esta función, tomando
+    `lock_chroma` si otro hilo también usa la colección.
+
+    Los elementos invocables de `chunks` son marcadores: se ejecutan en este mismo hilo
+    cuando todos los chunks anteriores a ellos ya están guardados. Si falla un lote, los
+    marcadores posteriores no se ejecutan.
+    """
+    lock_chroma = lock_chroma or threading.Lock()
+    procesados = 0
+    inicio = time.perf_counter()
+    marcadores = deque() # (chunks recibidos antes del marcador, marcador)
+    recibidos = 0
+    fines_lotes = [] # posición final de cada lote enviado, en orden de envío
+    lotes_guardados = set()
+    siguiente_lote = 0
+    guardados_en_orden = 0 # los primeros `guardados_en_orden` chunks ya están en Chroma
+
+    def separar_marcadores(elementos):
+        nonlocal recibidos
+        for elemento in elementos:
+            if callable(elemento):
+                marcadores.append((recibidos, elemento))
+            else:
+                recibidos += 1
+                yield elemento
+
+    def ejecutar_marcadores():
+        nonlocal siguiente_lote, guardados_en_orden
+        while siguiente_lote in lotes_guardados:
+            lotes_guardados.discard(siguiente_lote)
+            guardados_en_orden = fines_lotes[siguiente_lote]
+            siguiente_lote += 1
+        while marcadores and marcadores[0][0] <= guardados_en_orden:
+            marcadores.popleft()[1]()
+
+    def registrar_terminado(futuro, numero_lote, lote):
+        nonlocal procesados
+        embeddings = futuro.result()
+        with lock_chroma:
+            guardar_lote_en_chroma(coleccion, lote, embeddings)
+        procesados += len(lote)
+        lotes_guardados.add(numero_lote)
+        transcurrido = time.perf_counter() - inicio
+        print(f"   {procesados} chunks guardados ({procesados / max(transcurrido, 1e-9):.1f} chunks/s)")
+
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        pendientes = {}
+        for lote in generar_lotes_por_tokens(separar_marcadores(chunks)):
+            while len(pendientes) >= concurrencia:
+                terminados, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+                for futuro in terminados:
+                    registrar_terminado(futuro, *pendientes.pop(futuro))
+            ejecutar_marcadores()
+            futuro = pool.submit(embeber_con_reintentos, embeddings_model, [split.page_content for split in lote])
+            pendientes[futuro] = (len(fines_lotes), lote)
+            fines_lotes.append((fines_lotes[-1] if fines_lotes else 0) + len(lote))
+
+        for futuro in as_completed(list(pendientes)):
+            registrar_terminado(futuro, *pendientes.pop(futuro))
+        ejecutar_marcadores()
+
+    transcurrido = time.perf_counter() - inicio
+    print(f"   Embeddings completados: {procesados} chunks en {transcurrido:.1f}s ({procesados / max(transcurrido, 1e-9):.1f} chunks/s)")
+    return procesados
+
+# --- 3. PIPELINE EN STREAMING ---
+_FIN_DE_COLA = object()
+
+def poner_en_cola(cola, elemento, detener):
+    """`cola.put` que se rinde si se activa `detener` (la etapa de embeddings falló)."""
+    while not detener.is_set():
+        try:
+            cola.put(elemento, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def producir_chunks(rutas, coleccion, lock_chroma, cola, info_archivos, entradas_manifest, archivos_manifest,
+                    deduplicador, estadisticas_dedup, detener):
+    """
+    Etapa de extracción: recorre los PDFs, asigna IDs, descarta los chunks casi
+    duplicados y deja en `cola` solo los chunks que no están en la colección. Al final
+    de cada documento deja en la cola un marcador que, una vez guardados sus chunks
+    nuevos, elimina los obsoletos (incluidos los que ahora son duplicados) y deja lista
+    su entrada del manifest en `entradas_manifest`. Termina en cuanto se activa `detener`.
+    """
+    paginas_previas = {
+        nombre: entrada.get("paginas", {})
+        for nombre, entrada in archivos_manifest.items()
+        if entrada.get("modo_chunking") == "pagina"
+    } if MODO_CHUNKING == "pagina" else {}
+
+    for ruta, splits_del_documento, error in iterar_documentos(rutas, paginas_previas=paginas_previas):
+        if detener.is_set():
+            return
+        nombre_archivo = os.path.basename(ruta)
+        if error is not None:
+            # No se toca su entrada en el manifest: se reintentará en la próxima corrida
+            print(f"Error procesando '{ruta}': {error}")
+            continue
+
+        # Se consulta la colección (y no solo el manifest) para limpiar también IDs antiguos
+        with lock_chroma:
+            ids_en_coleccion = set(coleccion.get(where={"source": nombre_archivo}, include=[])["ids"])
+
+        hashes_previos = archivos_manifest.get(nombre_archivo, {}).get("chunks", {})
+        ids_chunks = {}
+        paginas = {}
+        nuevos = 0
+        reutilizados = 0
+        duplicados_otros_archivos = 0
         try:
-            nombre_archivo = os.path.basename(ruta)
-            doc_pdf = fitz.open(ruta)
-            texto_completo = "".join(page.get_text() for page in doc_pdf)
-            splits_del_documento = text_splitter.create_documents([texto_completo])
             for split in splits_del_documento:
-                split.metadata = {"source": nombre_archivo}
-            todos_los_splits.extend(splits_del_documento)
-            print(f"Documento '{nombre_archivo}' procesado.")
+                meta = split.metadata
+                hash_pagina = meta.pop("hash_pagina", None)
+                if hash_pagina is not None:
+                    pagina = paginas.setdefault(str(meta["pagina"]), {"hash": hash_pagina, "chunks": []})
+
+                if meta.pop("reutilizado", False):
+                    # Página sin cambios en modo "pagina": se conserva el ID anterior
+                    chunk_id = meta["id"]
+                    ids_chunks[chunk_id] = hashes_previos.get(chunk_id, "")
+                    pagina["chunks"].append(chunk_id)
+                    reutilizados += 1
+                    if chunk_id not in ids_en_coleccion:
+                        # La colección no tiene el chunk: se vuelve a dividir la página en la próxima corrida
+                        print(f"Advertencia: '{chunk_id}' no está en la colección; se reprocesará la página {meta['pagina']}.")
+                        pagina["hash"] = None
+                    continue
+
+                # En modo "pagina" el ID incluye la posición para que las citas no queden desfasadas
+                contenido_id = split.page_content
+                if hash_pagina is not None:
+                    contenido_id = f"{meta['pagina']}:{meta['inicio']}\n{split.page_content}"
+                chunk_id, hash_chunk = asignar_id_chunk(nombre_archivo, contenido_id, ids_chunks)
+
+                descartes_previos = deduplicador.descartados_entre_archivos
+                if deduplicador.es_duplicado(split.page_content, nombre_archivo):
+                    estadisticas_dedup["chunks"] += 1
+                    estadisticas_dedup["tokens"] += contar_tokens(split.page_content, CODIFICACION_EMBEDDINGS)
+                    duplicados_otros_archivos += deduplicador.descartados_entre_archivos - descartes_previos
+                    continue
+
+                ids_chunks[chunk_id] = hash_chunk
+                if hash_pagina is not None:
+                    pagina["chunks"].append(chunk_id)
+                if chunk_id not in ids_en_coleccion:
+                    meta["id"] = chunk_id # Guardamos el ID en los metadatos temporalmente
+                    # Se bloquea si la etapa de embeddings va atrasada
+                    if not poner_en_cola(cola, split, detener):
+                        return
+                    nuevos += 1
         except Exception as e:
+            # Los chunks que alcanzaron a encolarse se guardan igual; como no hay entrada
+            # en el manifest, la próxima corrida los reutiliza y limpia lo obsoleto
             print(f"Error procesando '{ruta}': {e}")
-    return todos_los_splits
+            continue
+
+        # Chunks obsoletos: los que están en la colección para esta fuente y ya no se generan
+        ids_obsoletos = ids_en_coleccion - set(ids_chunks)
+        entrada = {**info_archivos[nombre_archivo], "modo_chunking": MODO_CHUNKING, "chunks": ids_chunks}
+        try:
+            entrada["descripcion"] = describir_documento(ruta)
+        except Exception as e:
+            print(f"Advertencia: no se pudo describir '{nombre_archivo}': {e}")
+        if duplicados_otros_archivos:
+            # Depende de chunks de otros PDFs: se reprocesa si alguno de ellos cambia
+            entrada["duplicados_otros_archivos"] = duplicados_otros_archivos
+        if MODO_CHUNKING == "pagina":
+            entrada["paginas"] = paginas
+        detalle_reutilizados = f", {reutilizados} reutilizados de páginas sin cambios" if reutilizados else ""
+
+        def cerrar_documento(nombre_archivo=nombre_archivo, ids_obsoletos=ids_obsoletos, entrada=entrada,
+                             detalle=f"{nuevos} chunks nuevos, {len(ids_obsoletos)} obsoletos eliminados{detalle_reutilizados}"):
+            # Corre en la etapa de embeddings, cuando los chunks nuevos del documento ya están en Chroma
+            if ids_obsoletos:
+                with lock_chroma:
+                    coleccion.delete(ids=sorted(ids_obsoletos))
+            entradas_manifest[nombre_archivo] = entrada
+            print(f"Documento '{nombre_archivo}' procesado: {detalle}.")
+
+        if not poner_en_cola(cola, cerrar_documento, detener):
+            return
+
+def sembrar_deduplicador(deduplicador, coleccion, nombres_excluidos, tamano_pagina=5000):
+    """
+    En modo de deduplicación "global" registra los chunks ya guardados de los PDFs que
+    no se van a reprocesar, para detectar duplicados contra ellos.
+    """
+    if deduplicador.alcance != "global":
+        return
+    filtro = {"source": {"$nin": sorted(nombres_excluidos)}} if nombres_excluidos else None
+    offset = 0
+    while True:
+        lote = coleccion.get(where=filtro, include=["documents", "metadatas"], limit=tamano_pagina, offset=offset)
+        if not lote["ids"]:
+            break
+        for texto, meta in zip(lote["documents"], lote["metadatas"]):
+            deduplicador.registrar(texto, meta["source"])
+        offset += len(lote["ids"])
+    print(f"   Deduplicación global: {deduplicador.registrados} chunks existentes registrados.")
+
+def ejecutar_pipeline(rutas, embeddings_model, coleccion, info_archivos, archivos_manifest):
+    """
+    Extracción -> deduplicación -> embeddings -> Chroma, con colas acotadas entre
+    etapas: la memoria no depende del tamaño del corpus y los primeros chunks se
+    guardan mientras los PDFs siguientes todavía se están leyendo. Devuelve las
+    entradas del manifest de los documentos procesados sin errores.
+    """
+    cola = queue.Queue(maxsize=MAX_CHUNKS_EN_COLA)
+    lock_chroma = threading.Lock()
+    entradas_manifest = {}
+    errores = []
+    deduplicador = DeduplicadorChunks()
+    estadisticas_dedup = {"chunks": 0, "tokens": 0}
+    sembrar_deduplicador(deduplicador, coleccion, {os.path.basename(ruta) for ruta in rutas})
+
+    detener = threading.Event()
+
+    def productor():
+        try:
+            producir_chunks(rutas, coleccion, lock_chroma, cola, info_archivos, entradas_manifest,
+                            archivos_manifest, deduplicador, estadisticas_dedup, detener)
+        except Exception as e:
+            errores.append(e)
+        finally:
+            poner_en_cola(cola, _FIN_DE_COLA, detener)
 
-def quantize_vectors_to_int8(vectors_np):
-    min_val = vectors_np.min(axis=1, keepdims=True)
-    max_val = vectors_np.max(axis=1, keepdims=True)
-    scale = 254.0 / (max_val - min_val + 1e-9)
-    offset = min_val
-    quantized_vectors = (vectors_np - offset) * scale - 127.0
-    return quantized_vectors.astype(np.int8), min_val.flatten(), max_val.flatten()
+    def consumir_cola():
+        while True:
+            split = cola.get()
+            if split is _FIN_DE_COLA:
+                return
+            yield split
+
+    hilo_productor = threading.Thread(target=productor, name="extraccion_pdf", daemon=True)
+    hilo_productor.start()
+    try:
+        embeber_y_guardar_en_lotes(consumir_cola(), embeddings_model, coleccion, lock_chroma=lock_chroma)
+    finally:
+        # Si la etapa de embeddings falló, el productor no debe quedar bloqueado en la cola
+        detener.set()
+        while hilo_productor.is_alive():
+            try:
+                cola.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        hilo_productor.join()
+
+    if errores:
+        raise errores[0]
+    if deduplicador.alcance != "no":
+        print(f"   Deduplicación ({deduplicador.alcance}): {estadisticas_dedup['chunks']} chunks casi duplicados descartados, "
+              f"~{estadisticas_dedup['tokens']} tokens de embedding ahorrados.")
+    return entradas_manifest
+
+# --- 4. LÓGICA PRINCIPAL DE INGESTA ---
+def descripciones_ingestadas(archivos_manifest):
+    """{política: descripción} de los PDFs del manifest, la misma que arma el servidor."""
+    return {nombre: descripcion_politica(nombre, entrada.get("descripcion"))
+            for nombre, entrada in archivos_manifest.items()}
+
+def ingestar(rutas, embeddings_model, coleccion, ruta_manifest=MANIFEST_PATH, ruta_centroides=RUTA_CENTROIDES):
+    """
+    Ingesta incremental de `rutas` en `coleccion`. Devuelve un resumen con la cantidad
+    de documentos modificados y eliminados, y los nombres de los modificados que no se
+    pudieron guardar (`fallidos`): siguen distintos al manifest y la próxima corrida
+    los vuelve a procesar.
+    """
+    manifest = cargar_manifest(ruta_manifest)
+    archivos_manifest = manifest.setdefault("archivos", {})
+
+    # Detectar qué PDFs cambiaron desde la última ingesta
+    print("\n[Paso 1/3] Detectando cambios en los documentos PDF...")
+    rutas_modificadas, nombres_eliminados, info_archivos = detectar_cambios(rutas, manifest)
+    resumen = {"modificados": len(rutas_modificadas), "eliminados": len(nombres_eliminados), "fallidos": []}
+
+    # Los PDFs sin cambios solo actualizan su mtime en el manifest (y la descripción si
+    # el manifest es de una versión anterior que no la guardaba)
+    rutas_por_nombre = {os.path.basename(ruta): ruta for ruta in rutas}
+    for nombre_archivo, info in info_archivos.items():
+        if nombre_archivo in archivos_manifest:
+            archivos_manifest[nombre_archivo].update(mtime_ns=info["mtime_ns"], tamano=info["tamano"])
+            if "descripcion" not in archivos_manifest[nombre_archivo]:
+                try:
+                    archivos_manifest[nombre_archivo]["descripcion"] = describir_documento(rutas_por_nombre[nombre_archivo])
+                except Exception as e:
+                    print(f"Advertencia: no se pudo describir '{nombre_archivo}': {e}")
+
+    if not rutas_modificadas and not nombres_eliminados:
+        guardar_manifest(manifest, ruta_manifest)
+        if INDICE_CUANTIZADO:
+            actualizar_indice_int8(coleccion, info_archivos, set(), [])
+        if INDICE_NUMPY:
+            actualizar_indice_numpy(coleccion, info_archivos, set(), [])
+        if BUSQUEDA_HIBRIDA:
+            actualizar_indice_bm25(coleccion, info_archivos, set(), [])
+        actualizar_centroides(coleccion, info_archivos, set(), [], ruta_centroides,
+                              embeddings_model, descripciones_ingestadas(archivos_manifest))
+        print("\nNo hay políticas nuevas o modificadas. La base de datos está actualizada.")
+        return resumen
+
+    print(f"   {len(rutas_modificadas)} documentos nuevos o modificados, {len(nombres_eliminados)} eliminados.")
+
+    if DEDUP_CHUNKS == "global":
+        # Los PDFs con chunks descartados por duplicar a otro PDF se reprocesan cuando
+        # cambia algo, por si el original era justamente de un PDF modificado o eliminado
+        nombres_modificados = {os.path.basename(ruta) for ruta in rutas_modificadas}
+        for ruta in rutas:
+            nombre_archivo = os.path.basename(ruta)
+            if nombre_archivo not in nombres_modificados and archivos_manifest.get(nombre_archivo, {}).get("duplicados_otros_archivos"):
+                rutas_modificadas.append(ruta)
+        rutas_modificadas.sort()
+
+    # Quitar de la colección los chunks de los PDFs que ya no existen
+    print("\n[Paso 2/3] Eliminando chunks de documentos borrados...")
+    for nombre_archivo in nombres_eliminados:
+        coleccion.delete(where={"source": nombre_archivo})
+        del archivos_manifest[nombre_archivo]
+        print(f"   Eliminados los chunks de '{nombre_archivo}'.")
+
+    # Extraer, embeber y guardar en streaming solo los PDFs modificados
+    print(f"\n[Paso 3/3] Procesando documentos modificados (PDF -> chunks -> embeddings -> '{coleccion.name}')...")
+    entradas_manifest = {}
+    if rutas_modificadas:
+        entradas_manifest = ejecutar_pipeline(rutas_modificadas, embeddings_model, coleccion, info_archivos, archivos_manifest)
+
+    # El manifest se actualiza solo después de escribir en Chroma
+    archivos_manifest.update(entradas_manifest)
+    resumen["fallidos"] = sorted(os.path.basename(ruta) for ruta in rutas_modificadas
+                                 if os.path.basename(ruta) not in entradas_manifest)
+    guardar_manifest(manifest, ruta_manifest)
+
+    if INDICE_CUANTIZADO:
+        print("\nActualizando el índice int8...")
+        actualizar_indice_int8(coleccion, info_archivos, set(entradas_manifest), nombres_eliminados)
+
+    if INDICE_NUMPY:
+        print("\nActualizando el índice NumPy...")
+        actualizar_indice_numpy(coleccion, info_archivos, set(entradas_manifest), nombres_eliminados)
+
+    if BUSQUEDA_HIBRIDA:
+        print("\nActualizando el índice BM25...")
+        actualizar_indice_bm25(coleccion, info_archivos, set(entradas_manifest), nombres_eliminados)
+
+    # Centroides de cada política para el enrutador por embeddings
+    actualizar_centroides(coleccion, info_archivos, set(entradas_manifest), nombres_eliminados, ruta_centroides,
+                          embeddings_model, descripciones_ingestadas(archivos_manifest))
+
+    return resumen
 
-# --- 3. LÓGICA PRINCIPAL DE INGESTA ---
 def main():
-    embeddings_model = OpenAIEmbeddings(model="text-embedding-3-small")
+    embeddings_model = crear_modelo_embeddings()
     cliente_chroma = chromadb.PersistentClient(path=DB_PATH)
     coleccion = cliente_chroma.get_or_create_collection(name=NOMBRE_COLECCION)
 
-    # Cargar y procesar los PDFs
-    print("\n[Paso 1/4] Cargando y dividiendo documentos PDF...")
-    splits_con_metadatos = cargar_y_dividir_politicas(RUTAS_POLITICAS)
-    if not splits_con_metadatos:
-        print("No se encontraron documentos para procesar. Finalizando.")
+    resumen = ingestar(RUTAS_POLITICAS, embeddings_model, coleccion)
+    if not resumen["modificados"] and not resumen["eliminados"]:
         return
 
-    # Obtener IDs existentes para no duplicar
-    ids_existentes = set(coleccion.get(include=[])['ids'])
-    print(f"Encontrados {len(ids_existentes)} chunks ya existentes en la base de datos.")
-
-    # Filtrar chunks que ya han sido procesados
-    chunks_a_procesar = []
-    for i, split in enumerate(splits_con_metadatos):
-        chunk_id = f"politica_{split.metadata['source']}_chunk_{i}"
-        if chunk_id not in ids_existentes:
-            split.metadata['id'] = chunk_id # Guardamos el ID en los metadatos temporalmente
-            chunks_a_procesar.append(split)
-    
-    if not chunks_a_procesar:
-        print("\nNo hay políticas nuevas para añadir. La base de datos está actualizada.")
-        return
-
-    print(f"\n[Paso 2/4] Se procesarán {len(chunks_a_procesar)} nuevos chunks.")
-    
-    # Generar embeddings para los nuevos chunks
-    documentos_nuevos = [split.page_content for split in chunks_a_procesar]
-    
-    print("[Paso 3/4] Generando embeddings de alta precisión (float)...")
-    float_embeddings = embeddings_model.embed_documents(documentos_nuevos)
-    
-    metadatos_finales = []
-    ids_finales = []
-    for split in chunks_a_procesar:
-        meta = split.metadata.copy()
-        ids_finales.append(meta.pop('id'))
-        metadatos_finales.append(meta)
-
-    # Añadir los nuevos datos a Chroma DB
-    print(f"[Paso 4/4] Añadiendo {len(ids_finales)} nuevos chunks a la colección '{NOMBRE_COLECCION}'...")
-    coleccion.add(
-        embeddings=float_embeddings,
-        documents=documentos_nuevos,
-        metadatas=metadatos_finales,
-        ids=ids_finales
-    )
-    
+    if hasattr(embeddings_model, "estadisticas"):
+        print(f"Caché de embeddings: {embeddings_model.estadisticas()}")
     print(f"\n¡Proceso completado! La base de datos ahora tiene un total de {coleccion.count()} fragmentos.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
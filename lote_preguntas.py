@@ -0,0 +1,181 @@
+"""
+Procesamiento de preguntas por lote (planillas de FAQ, auditorías).
+En vez de pasar cada pregunta por el agente como un mensaje de WhatsApp:
+  1. se embeben todas en una sola llamada de embeddings,
+  2. se enrutan con el enrutador por embeddings (el LLM solo para las dudosas),
+  3. se recuperan los chunks agrupando por política (una consulta por política),
+  4. las respuestas se generan con concurrencia acotada y se entregan a medida que
+     terminan, una por línea (NDJSON).
+
+El servidor lo expone en POST /lote. Este archivo es también el cliente de línea de
+comandos:
+    python lote_preguntas.py preguntas.txt --salida respuestas.ndjson
+    python lote_preguntas.py faq.csv --columna pregunta --url http://localhost:8000/lote
+"""
+
+import os
+import sys
+import csv
+import time
+import asyncio
+import argparse
+
+from empaquetado_contexto import empaquetar_contexto
+from enrutador_politicas import SIN_COINCIDENCIAS
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+# Llamadas simultáneas al LLM (respuestas y enrutamientos dudosos)
+CONCURRENCIA_LOTE = int(os.getenv("CONCURRENCIA_LOTE", 8))
+MAX_PREGUNTAS_LOTE = int(os.getenv("MAX_PREGUNTAS_LOTE", 2000))
+N_RESULTADOS_LOTE = int(os.getenv("N_RESULTADOS_LOTE", 5))
+URL_LOTE = os.getenv("URL_LOTE", "http://localhost:8000/lote")
+TOKEN_LOTE = os.getenv("TOKEN_LOTE")
+
+INSTRUCCIONES_RESPUESTA = """
+Eres un asistente de Recursos Humanos experto de la empresa Cramer.
+Responde la pregunta del usuario basándote ÚNICAMENTE en el contexto entregado.
+Si el contexto no contiene la respuesta, responde exactamente: "No encontré esa información en la política."
+Sé breve y concreto.
+"""
+RESPUESTA_SIN_POLITICA = "No encontré un documento que hable sobre eso."
+
+
+class ProcesadorLote:
+    """Reúne los componentes del servidor para responder muchas preguntas a la vez."""
+
+    def __init__(self, embeddings_model, motor_busqueda, cliente_openai_async, clasificador_llm,
+                 enrutador=None, concurrencia=CONCURRENCIA_LOTE, modelo="gpt-4o-mini"):
+        self.embeddings_model = embeddings_model
+        self.motor_busqueda = motor_busqueda
+        self.cliente_openai_async = cliente_openai_async
+        self.clasificador_llm = clasificador_llm
+        self.enrutador = enrutador
+        self.concurrencia = concurrencia
+        self.modelo = modelo
+
+    async def _enrutar(self, preguntas, embeddings, nombres_validos, semaforo):
+        async def con_llm(pregunta):
+            async with semaforo:
+                return await self.clasificador_llm(pregunta)
+
+        politicas = [None] * len(preguntas)
+        dudosas = []
+        for i, embedding in enumerate(embeddings):
+            if self.enrutador is not None:
+                local, segura = self.enrutador.decidir(embedding, nombres_validos)
+                if segura:
+                    politicas[i] = local
+                    continue
+            dudosas.append(i)
+        for i, politica in zip(dudosas, await asyncio.gather(*(con_llm(preguntas[i]) for i in dudosas))):
+            politicas[i] = politica
+        return politicas, len(dudosas)
+
+    async def _responder(self, indice, pregunta, politica, documentos, metadatos, semaforo):
+        inicio = time.perf_counter()
+        resultado = {"indice": indice, "pregunta": pregunta, "politica": politica}
+        if not politica or politica == SIN_COINCIDENCIAS:
+            resultado.update(respuesta=RESPUESTA_SIN_POLITICA, tokens_contexto=0)
+        else:
+            contexto, tokens = empaquetar_contexto(documentos, metadatos)
+            try:
+                async with semaforo:
+                    respuesta = await self.cliente_openai_async.chat.completions.create(
+                        model=self.modelo,
+                        messages=[
+                            {"role": "system", "content": INSTRUCCIONES_RESPUESTA},
+                            {"role": "user", "content": f"Contexto de {politica}:\n\n{contexto}\n\nPregunta: {pregunta}"},
+                        ],
+                        temperature=0.0,
+                    )
+                resultado.update(respuesta=respuesta.choices[0].message.content.strip(),
+                                 tokens_contexto=tokens["tokens_contexto"])
+            except Exception as e:
+                resultado.update(respuesta=None, error=str(e))
+        resultado["ms_respuesta"] = round((time.perf_counter() - inicio) * 1000, 1)
+        return resultado
+
+    async def procesar(self, preguntas, nombres_validos, n_resultados=N_RESULTADOS_LOTE):
+        """Generador async de resultados (dict por pregunta) en el orden en que terminan."""
+        loop = asyncio.get_running_loop()
+        semaforo = asyncio.Semaphore(self.concurrencia)
+        inicio = time.perf_counter()
+
+        # 1. Un solo llamado de embeddings para todo el lote
+        embeddings = await loop.run_in_executor(self.motor_busqueda.executor, self.embeddings_model.embed_documents, preguntas)
+        # 2. Enrutamiento local; el LLM solo para las dudosas
+        politicas, derivadas_llm = await self._enrutar(preguntas, embeddings, list(nombres_validos), semaforo)
+        # 3. Recuperación agrupada por política
+        recuperados = await loop.run_in_executor(
+            self.motor_busqueda.executor, self.motor_busqueda.buscar_lote, preguntas, embeddings, politicas, n_resultados
+        )
+        preparacion_ms = round((time.perf_counter() - inicio) * 1000, 1)
+        print(f"Lote de {len(preguntas)} preguntas preparado en {preparacion_ms} ms ({derivadas_llm} enrutadas con LLM).")
+
+        # 4. Respuestas con concurrencia acotada, entregadas a medida que terminan
+        tareas = [
+            asyncio.ensure_future(self._responder(i, pregunta, politica, documentos, metadatos, semaforo))
+            for i, (pregunta, politica, (documentos, metadatos)) in enumerate(zip(preguntas, politicas, recuperados))
+        ]
+        try:
+            for tarea in asyncio.as_completed(tareas):
+                yield await tarea
+        finally:
+            for tarea in tareas:
+                tarea.cancel()
+        total_s = time.perf_counter() - inicio
+        print(f"Lote completado: {len(preguntas)} preguntas en {total_s:.1f} s ({len(preguntas) / total_s:.1f} preguntas/s).")
+
+
+# ==============================================================================
+# CLIENTE DE LÍNEA DE COMANDOS
+# ==============================================================================
+def leer_preguntas(ruta, columna=None):
+    """Una pregunta por línea (.txt) o una columna de un .csv (por defecto la primera)."""
+    with open(ruta, "r", encoding="utf-8-sig", newline="") as f:
+        if not ruta.lower().endswith(".csv"):
+            return [linea.strip() for linea in f if linea.strip()]
+        filas = list(csv.reader(f))
+    if not filas:
+        return []
+    indice = 0
+    if columna is not None:
+        indice = filas[0].index(columna)
+        filas = filas[1:]
+    return [fila[indice].strip() for fila in filas if len(fila) > indice and fila[indice].strip()]
+
+def enviar_lote(preguntas, url=URL_LOTE, token=TOKEN_LOTE, salida=None):
+    import requests
+    inicio = time.perf_counter()
+    destino = open(salida, "w", encoding="utf-8") if salida else sys.stdout
+    recibidas = 0
+    try:
+        with requests.post(url, json={"preguntas": preguntas}, headers={"X-Token-Lote": token or ""},
+                           stream=True, timeout=(10, None)) as respuesta:
+            respuesta.raise_for_status()
+            for linea in respuesta.iter_lines(decode_unicode=True):
+                if linea:
+                    destino.write(linea + "\n")
+                    recibidas += 1
+    finally:
+        if salida:
+            destino.close()
+    total_s = time.perf_counter() - inicio
+    print(f"{recibidas}/{len(preguntas)} respuestas en {total_s:.1f} s ({recibidas / total_s:.1f} preguntas/s).", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Envía un lote de preguntas a POST /lote y guarda las respuestas en NDJSON.")
+    parser.add_argument("archivo", help=".txt con una pregunta por línea, o .csv")
+    parser.add_argument("--columna", help="nombre de la columna de preguntas en el .csv (por defecto la primera, sin encabezado)")
+    parser.add_argument("--url", default=URL_LOTE)
+    parser.add_argument("--salida", help="archivo .ndjson de salida (por defecto stdout)")
+    args = parser.parse_args()
+
+    preguntas = leer_preguntas(args.archivo, args.columna)
+    if not preguntas:
+        print("No se encontraron preguntas en el archivo.", file=sys.stderr)
+        sys.exit(1)
+    enviar_lote(preguntas, args.url, TOKEN_LOTE, args.salida)
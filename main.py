@@ -6,10 +6,11 @@ from fastapi import FastAPI, Request, Response
 import chromadb
 from dotenv import load_dotenv
 from openai import OpenAI
-from langchain_openai import OpenAIEmbeddings
 import time
 from agents import Agent, Runner, trace, function_tool
 from openai.types.responses import ResponseTextDeltaEvent
+from proveedores_embeddings import crear_modelo_embeddings
+from sesiones import AlmacenSesiones
 
 from tools import (
     TOOLS_JSON,
@@ -58,9 +59,11 @@ POLITICAS_CON_DESCRIPCION = {
 try:
     # --- Clientes para el Agente RAG ---
     cliente_openai = OpenAI()
-    embeddings_model = OpenAIEmbeddings(model="text-embedding-3-small")
+    embeddings_model = crear_modelo_embeddings()
     cliente_chroma = chromadb.PersistentClient(path=DB_PATH)
     coleccion = cliente_chroma.get_collection(name=NOMBRE_COLECCION)
+    # Últimos turnos de cada número de WhatsApp, acotados en tokens, cantidad de sesiones y tiempo
+    sesiones = AlmacenSesiones()
     
     init_mysql_database()
     
@@ -222,11 +225,8 @@ def orquestador (message, history):
         contexto_concatenado = "\n\n---\n\n".join(contexto_relevante)
         
     
-    # 4. Formatear el historial de la conversación
-    history_openai_format = []
-    for user, assistant in history:
-        history_openai_format.append({"role": "user", "content": user})
-        history_openai_format.append({"role": "assistant", "content": assistant})
+    # 4. El historial ya viene en formato OpenAI (AlmacenSesiones.historial)
+    history_openai_format = list(history)
 
     # 5. Construir el mensaje inicial para el LLM
     messages = [
@@ -326,8 +326,10 @@ async def receive_message(request: Request):
                 user_message = message_info["text"]["body"]
 
                 print(f"Procesando mensaje de {user_phone_number}: '{user_message}'")
-                chatbot_response = orquestador(user_message, history=[])
+                historial = sesiones.historial(user_phone_number)
+                chatbot_response = orquestador(user_message, history=historial)
                 print(f"Respuesta generada para {user_phone_number}: '{chatbot_response}'")
+                sesiones.agregar_turno(user_phone_number, user_message, chatbot_response)
 
                 send_whatsapp_message(user_phone_number, chatbot_response)
             else:
@@ -4,8 +4,7 @@ from typing import Dict
 import os
 import certifi
 import chromadb
-from openai import OpenAI
-from langchain_openai import OpenAIEmbeddings
+from openai import OpenAI, AsyncOpenAI
 import mysql.connector
 import pythoncom
 from datetime import datetime
@@ -13,10 +12,28 @@ import win32com.client as win32
 from dotenv import load_dotenv
 import json
 from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
 import requests 
 import time
 import asyncio
+import hashlib
+import threading
 from concurrent.futures import ThreadPoolExecutor
+from proveedores_embeddings import crear_modelo_embeddings
+from indice_int8 import INDICE_CUANTIZADO, IndiceInt8
+from indice_numpy import INDICE_NUMPY, IndiceNumpy
+from indice_bm25 import BUSQUEDA_HIBRIDA, IndiceBM25
+from motor_busqueda import MotorBusqueda
+from empaquetado_contexto import empaquetar_contexto
+from enrutador_politicas import ENRUTADOR_POLITICAS, EnrutadorPoliticas, DESCRIPCIONES_MANUALES, descripcion_politica
+from cache_respuestas import CACHE_RESPUESTAS, CacheRespuestas
+from especulacion import ESPECULACION, Especulador
+from lote_preguntas import MAX_PREGUNTAS_LOTE, TOKEN_LOTE, ProcesadorLote
+from pipeline_rag import MODO_RESPUESTA, PipelineRAG
+from tareas_fondo import EjecutorTareas
+from bandeja_salida import BandejaSalida
+from sesiones import AlmacenSesiones
+from serializador_usuarios import SerializadorUsuarios
 
 os.environ['SSL_CERT_FILE'] = certifi.where()
 load_dotenv(override=True)
@@ -39,58 +56,123 @@ if not ACCESS_TOKEN or not VERIFY_TOKEN or not PHONE_NUMBER_ID:
 
 # Inicialización de clientes globales
 cliente_openai = OpenAI()
-embeddings_model = OpenAIEmbeddings(model="text-embedding-3-small")
+# Cliente async para las herramientas del agente: no bloquea el event loop del webhook
+cliente_openai_async = AsyncOpenAI()
+embeddings_model = crear_modelo_embeddings()
 cliente_chroma = chromadb.PersistentClient(path="db_politicas")
 coleccion = cliente_chroma.get_collection(name="politicas_empresariales")
+# Modo opcional: primera pasada int8 en memoria + reordenamiento con los vectores float
+indice_int8 = IndiceInt8(coleccion) if INDICE_CUANTIZADO else None
+# Modo opcional: matrices de embeddings por política en memoria (memmap), sin consultar Chroma
+indice_numpy = IndiceNumpy() if INDICE_NUMPY else None
+# Modo opcional: ranking léxico BM25 fusionado con el vectorial (RRF)
+indice_bm25 = IndiceBM25() if BUSQUEDA_HIBRIDA else None
+# Chroma y los índices en memoria se consultan en un pool de hilos propio
+motor_busqueda = MotorBusqueda(coleccion, indice_int8, indice_numpy, indice_bm25)
+# Respuestas ya generadas para preguntas iguales o casi iguales (se invalidan al reingestar)
+cache_respuestas = CacheRespuestas(embeddings_model) if CACHE_RESPUESTAS else None
+# Últimos turnos de cada número de WhatsApp, acotados en tokens, cantidad de sesiones y tiempo
+sesiones = AlmacenSesiones()
 
 # Executor para operaciones síncronas
 executor = ThreadPoolExecutor(max_workers=10)
 
 #Cambios de rutas relativas
 CARPETA_FILES = "files"
-POLITICAS_CON_DESCRIPCION = {
-    "sin_coincidencias": "no se encontró ninguna coincidencia",
-    "beca_estudio.pdf": "Información sobre beneficios y becas para estudios.",
-    "centro_recreacion.pdf": "Reglas para pertenecer al centro de recreación.",
-    "mutuo_acuerdo.pdf": "Procedimientos para terminación de contrato laboral."
-}
-
+# Manifest que escribe la ingesta: qué PDFs ya están en la colección y su descripción automática
+RUTA_MANIFEST = os.path.join("db_politicas", "manifest_ingesta.json")
+SIN_COINCIDENCIAS = {"sin_coincidencias": "no se encontró ninguna coincidencia"}
+# Las descripciones escritas a mano están en enrutador_politicas.DESCRIPCIONES_MANUALES:
+# la ingesta también las necesita para embeberlas junto a los centroides
+
+# Estas estructuras se construyen dinámicamente y se recalculan en recargar_politicas()
+POLITICAS_CON_DESCRIPCION = dict(SIN_COINCIDENCIAS)
 RUTAS_POLITICAS_DETECTADAS = []
-if os.path.isdir(CARPETA_FILES):
-    RUTAS_POLITICAS_DETECTADAS = [
-        os.path.join(CARPETA_FILES, f) 
-        for f in os.listdir(CARPETA_FILES) 
-        if f.endswith(".pdf") and os.path.isfile(os.path.join(CARPETA_FILES, f))
-    ]
-else:
-    print(f"Error: La carpeta '{CARPETA_FILES}' no existe.")
-
-# Estas listas ahora se construyen dinámicamente
 RUTAS_POLITICAS = []
 NOMBRES_POLITICAS = []
 
-print("Verificando archivos detectados contra descripciones conocidas...")
-for ruta_detectada in RUTAS_POLITICAS_DETECTADAS:
-    nombre_archivo = os.path.basename(ruta_detectada)
-    
-    # Comprobamos si el archivo encontrado tiene una descripción
-    if nombre_archivo in POLITICAS_CON_DESCRIPCION:
-        RUTAS_POLITICAS.append(ruta_detectada)
-        NOMBRES_POLITICAS.append(nombre_archivo)
+def leer_politicas_ingestadas(ruta=RUTA_MANIFEST):
+    """{nombre_archivo: entrada del manifest} de los PDFs que la ingesta ya guardó."""
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            return json.load(f).get("archivos", {})
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Advertencia: No se pudo leer el manifest de ingesta '{ruta}': {e}")
+        return {}
+
+def recargar_politicas(recargar_indices=True):
+    """
+    Vuelve a leer la carpeta de políticas y el manifest de la ingesta: se atienden los
+    PDFs ya ingestados (también los agregados en caliente por vigilar_politicas.py) y
+    los que tienen descripción manual. Corre en el threadpool mientras el event loop
+    atiende preguntas, así que las estructuras nuevas se arman aparte y se reemplazan
+    con una sola asignación; quien las lee toma antes una referencia local.
+    """
+    global RUTAS_POLITICAS_DETECTADAS, RUTAS_POLITICAS, NOMBRES_POLITICAS, POLITICAS_CON_DESCRIPCION
+    detectadas = []
+    if os.path.isdir(CARPETA_FILES):
+        detectadas = [
+            os.path.join(CARPETA_FILES, f) 
+            for f in os.listdir(CARPETA_FILES) 
+            if f.endswith(".pdf") and os.path.isfile(os.path.join(CARPETA_FILES, f))
+        ]
     else:
-        # Advertencia si encontramos un PDF "huérfano"
-        print(f"Advertencia: Se encontró '{nombre_archivo}' en la carpeta 'files',")
-        print(f"pero no tiene descripción en 'POLITICAS_CON_DESCRIPCION'.")
-        print(f"Será IGNORADO.")
+        print(f"Error: La carpeta '{CARPETA_FILES}' no existe.")
+
+    rutas = []
+    nombres = []
+    descripciones = {}
+    ingestadas = leer_politicas_ingestadas()
+    print("Verificando archivos detectados contra el manifest de ingesta...")
+    for ruta_detectada in sorted(detectadas):
+        nombre_archivo = os.path.basename(ruta_detectada)
+
+        # Comprobamos si el archivo encontrado ya fue ingestado o tiene una descripción
+        if nombre_archivo in ingestadas or nombre_archivo in DESCRIPCIONES_MANUALES:
+            rutas.append(ruta_detectada)
+            nombres.append(nombre_archivo)
+            descripciones[nombre_archivo] = descripcion_politica(
+                nombre_archivo, ingestadas.get(nombre_archivo, {}).get("descripcion")
+            )
+        else:
+            # Advertencia si encontramos un PDF que la ingesta todavía no procesa
+            print(f"Advertencia: Se encontró '{nombre_archivo}' en la carpeta 'files',")
+            print(f"pero aún no está ingestado. Será IGNORADO hasta la próxima recarga.")
+
+    RUTAS_POLITICAS_DETECTADAS = detectadas
+    RUTAS_POLITICAS = rutas
+    NOMBRES_POLITICAS = nombres
+    POLITICAS_CON_DESCRIPCION = {**SIN_COINCIDENCIAS, **descripciones}
+    # Los índices y los centroides se reescriben en cada ingesta; hay que volver a leerlos
+    if recargar_indices and indice_int8 is not None:
+        indice_int8.cargar()
+    if recargar_indices and indice_numpy is not None:
+        indice_numpy.cargar()
+    if recargar_indices and indice_bm25 is not None:
+        indice_bm25.cargar()
+    if recargar_indices and enrutador is not None:
+        enrutador.cargar(POLITICAS_CON_DESCRIPCION)
+    return NOMBRES_POLITICAS
+
+recargar_politicas(recargar_indices=False)
+
+# Enrutador local por embeddings (ENRUTADOR_POLITICAS=llm vuelve al clasificador LLM en cada pregunta)
+enrutador = EnrutadorPoliticas(embeddings_model, POLITICAS_CON_DESCRIPCION) if ENRUTADOR_POLITICAS == "embeddings" else None
+
+# Modo especulativo: embedding y búsquedas probables en paralelo con el enrutamiento
+especulador = Especulador(embeddings_model, motor_busqueda, enrutador) if ESPECULACION else None
 
 # ============================================================================
 # TOOLS ORQUESTADOR
 # ============================================================================
-@function_tool
-def seleccionar_politica_con_llm(pregunta_usuario: str):
+async def clasificar_politica_con_llm(pregunta_usuario: str):
     """Usa un LLM para determinar qué política es la más relevante."""
+    # Referencias locales: recargar_politicas() puede reemplazarlas durante el await
+    politicas, nombres_politicas = POLITICAS_CON_DESCRIPCION, NOMBRES_POLITICAS
     lista_politicas_formateada = "\n".join(
-        [f"- {nombre}: {desc}" for nombre, desc in POLITICAS_CON_DESCRIPCION.items()]
+        [f"- {nombre}: {desc}" for nombre, desc in politicas.items()]
     )
 
     prompt_enrutador = f"""
@@ -106,14 +188,14 @@ def seleccionar_politica_con_llm(pregunta_usuario: str):
     Si ninguno parece relevante, responde con "sin_coincidencias".
     """
     try:
-        response = cliente_openai.chat.completions.create(
+        response = await cliente_openai_async.chat.completions.create(
             model="gpt-4o-mini",
             messages=[{"role": "system", "content": prompt_enrutador}],
             temperature=0.0
         )
         respuesta_llm = response.choices[0].message.content.strip()
         
-        for nombre in NOMBRES_POLITICAS:
+        for nombre in nombres_politicas:
             if nombre in respuesta_llm:
                 return nombre
         
@@ -122,50 +204,124 @@ def seleccionar_politica_con_llm(pregunta_usuario: str):
     except Exception as e:
         print(f"Error en LLM enrutador: {e}")
         return "sin_coincidencias"
-    
-@function_tool
-def buscar_contexto_relevante(pregunta: str, nombre_politica: str, n_resultados: int = 5) -> str:
-    """Busca los chunks más relevantes para una pregunta y devuelve texto plano."""
-    embedding_pregunta = embeddings_model.embed_query(pregunta)
 
-    resultados = coleccion.query(
-        query_embeddings=[embedding_pregunta],
-        n_results=n_resultados,
-        where={"source": nombre_politica},
-        include=["documents"]
-    )
-
-    documentos_relevantes = resultados['documents'][0] if resultados['documents'] else []
+async def seleccionar_politica(pregunta_usuario):
+    """Elige la política de la pregunta (enrutador por embeddings, especulador o clasificador LLM)."""
+    if especulador is None:
+        if enrutador is None:
+            return await clasificar_politica_con_llm(pregunta_usuario)
+        # Embeddings contra centroides y descripciones; el LLM solo si hay empate
+        return await enrutador.aseleccionar(pregunta_usuario, clasificar_politica_con_llm, NOMBRES_POLITICAS)
+
+    # El embedding ya está en curso desde que llegó el mensaje
+    inicio = time.perf_counter()
+    if enrutador is None:
+        politica = await clasificar_politica_con_llm(pregunta_usuario)
+    else:
+        politica = await enrutador.aseleccionar(pregunta_usuario, clasificar_politica_con_llm, NOMBRES_POLITICAS,
+                                                embedding_pregunta=await especulador.embedding(pregunta_usuario))
+    especulador.registrar_tiempo(pregunta_usuario, "enrutamiento", (time.perf_counter() - inicio) * 1000)
+    return politica
+
+async def buscar_contexto(pregunta, nombre_politica, n_resultados=5):
+    """Busca y empaqueta los chunks más relevantes de `nombre_politica` para la pregunta."""
+    if especulador is not None:
+        # Reutiliza el embedding y, si se anticipó esta política, la búsqueda
+        embedding_pregunta = await especulador.embedding(pregunta)
+        documentos_relevantes, metadatos_relevantes = await especulador.buscar(
+            pregunta, embedding_pregunta, nombre_politica, n_resultados
+        )
+    else:
+        embedding_pregunta = await embeddings_model.aembed_query(pregunta)
+        documentos_relevantes, metadatos_relevantes = await motor_busqueda.abuscar(
+            pregunta, embedding_pregunta, nombre_politica, n_resultados
+        )
     print(f"Se encontraron {len(documentos_relevantes)} chunks relevantes.")
 
-    contexto_combinado = "\n\n---\n\n".join(map(str, documentos_relevantes))
+    # Une chunks solapados, cita la página cuando el chunk la trae y respeta el presupuesto de tokens
+    contexto_combinado, tokens = empaquetar_contexto(documentos_relevantes, metadatos_relevantes)
+    print(f"Contexto: {tokens['tokens_contexto']} tokens ({tokens['tokens_ahorrados']} ahorrados de {tokens['tokens_originales']}).")
 
     return f"Contexto relevante encontrado en {nombre_politica}:\n\n{contexto_combinado}"
 
+@function_tool
+async def seleccionar_politica_con_llm(pregunta_usuario: str):
+    """Determina qué política es la más relevante para la pregunta."""
+    return await seleccionar_politica(pregunta_usuario)
+
+@function_tool
+async def buscar_contexto_relevante(pregunta: str, nombre_politica: str, n_resultados: int = 5) -> str:
+    """Busca los chunks más relevantes para una pregunta y devuelve texto plano."""
+    return await buscar_contexto(pregunta, nombre_politica, n_resultados)
+
 
 # ============================================================================
 # AGENTE DE REGISTRO DE PREGUNTAS
 # ============================================================================
-@function_tool
-def registrar_pregunta_mysql(pregunta: str, politica: str = "No especificada", contexto_encontrado: bool = True, respuesta: str = "", notas: str = ""):
-    """Registra las preguntas en la base de datos MySQL."""
+# Por defecto el registro y el escalamiento se anotan en la bandeja de salida desde el
+# JSON de respuesta; REGISTRO_CON_AGENTES=1 vuelve a delegarlos en los agentes de registro
+REGISTRO_CON_AGENTES = os.getenv("REGISTRO_CON_AGENTES", "0") == "1"
+
+# La bandeja de salida puede entregar dos veces la misma intención (caída entre el INSERT
+# y la marca de entregada): la clave de idempotencia va en una columna UNIQUE y la fila
+# repetida se descarta con ON DUPLICATE KEY UPDATE
+TABLAS_CON_CLAVE_IDEMPOTENCIA = ("question_agent_ia", "unknown_question")
+_claves_idempotencia_listas = False
+_lock_claves_idempotencia = threading.Lock()
+
+def asegurar_claves_idempotencia(conn):
+    """Agrega la columna UNIQUE clave_idempotencia a las tablas de registro si todavía no la tienen."""
+    global _claves_idempotencia_listas
+    with _lock_claves_idempotencia:
+        if _claves_idempotencia_listas:
+            return
+        cursor = conn.cursor()
+        for tabla in TABLAS_CON_CLAVE_IDEMPOTENCIA:
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = 'clave_idempotencia'",
+                (tabla,)
+            )
+            if cursor.fetchone()[0] == 0:
+                print(f"🔧 Agregando clave_idempotencia a {tabla}")
+                cursor.execute(
+                    f"ALTER TABLE {tabla} ADD COLUMN clave_idempotencia VARCHAR(191) NULL, "
+                    "ADD UNIQUE KEY uq_clave_idempotencia (clave_idempotencia)"
+                )
+        cursor.close()
+        _claves_idempotencia_listas = True
+
+def insertar_preguntas(filas, claves=None):
+    """
+    Inserta interacciones (pregunta, política, contexto, respuesta, notas) en question_agent_ia
+    en una transacción. Las filas cuya clave de idempotencia ya está en la tabla se omiten.
+    """
+    conn = mysql.connector.connect(**MYSQL_CONFIG)
     try:
-        conn = mysql.connector.connect(**MYSQL_CONFIG)
+        asegurar_claves_idempotencia(conn)
         cursor = conn.cursor()
         
         query = """
             INSERT INTO question_agent_ia
-            (question, file_consulted, contexts, answer_ia, notes)
-            VALUES (%s, %s, %s, %s, %s)
+            (question, file_consulted, contexts, answer_ia, notes, clave_idempotencia)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE id = id
         """
-        valores = (pregunta, politica, contexto_encontrado, respuesta, notas)
         
-        cursor.execute(query, valores)
+        claves = claves or [None] * len(filas)
+        cursor.executemany(query, [(*fila, clave) for fila, clave in zip(filas, claves)])
         conn.commit()
         
         registro_id = cursor.lastrowid
         cursor.close()
+        return registro_id
+    finally:
         conn.close()
+
+def guardar_pregunta(pregunta, politica="No especificada", contexto_encontrado=True, respuesta="", notas=""):
+    """Inserta la interacción en question_agent_ia (sin pasar por un LLM)."""
+    try:
+        registro_id = insertar_preguntas([(pregunta, politica, contexto_encontrado, respuesta, notas)])
         
         return {
             "status": "ok", 
@@ -178,6 +334,11 @@ def registrar_pregunta_mysql(pregunta: str, politica: str = "No especificada", c
             "message": f"Error al registrar: {str(e)}"
         }
 
+@function_tool
+def registrar_pregunta_mysql(pregunta: str, politica: str = "No especificada", contexto_encontrado: bool = True, respuesta: str = "", notas: str = ""):
+    """Registra las preguntas en la base de datos MySQL."""
+    return guardar_pregunta(pregunta, politica, contexto_encontrado, respuesta, notas)
+
 instrucciones_registro = "Registra las preguntas de los usuarios en la base de datos MySQL"
 registro_pregunta = Agent(
     name="registrador_preguntas_usuarios",                       
@@ -190,41 +351,56 @@ registro_pregunta = Agent(
 # ============================================================================
 # AGENTE DE PREGUNTAS DESCONOCIDAS
 # ============================================================================
-@function_tool
-def enviar_email_rrhh(asunto: str, pregunta: str, rut_usuario: str = "", nombre_usuario: str = "", notas: str = ""):
-    """Registra y envía un correo electrónico al departamento de RRHH."""
+def insertar_preguntas_desconocidas(filas, claves=None):
+    """
+    Inserta consultas (pregunta, rut, nombre, notas) en unknown_question en una transacción.
+    Las filas cuya clave de idempotencia ya está en la tabla se omiten.
+    """
+    conn = mysql.connector.connect(**MYSQL_CONFIG)
     try:
-        # Registrar en MySQL
-        conn = mysql.connector.connect(**MYSQL_CONFIG)
+        asegurar_claves_idempotencia(conn)
         cursor = conn.cursor()
         
         query = """
             INSERT INTO unknown_question
-            (pregunta, rut, nombre_usuario, notas)
-            VALUES (%s, %s, %s, %s)
+            (pregunta, rut, nombre_usuario, notas, clave_idempotencia)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE id = id
         """
-        valores = (pregunta, rut_usuario, nombre_usuario, notas)
         
-        cursor.execute(query, valores)
+        claves = claves or [None] * len(filas)
+        cursor.executemany(query, [(*fila, clave) for fila, clave in zip(filas, claves)])
         conn.commit()
-        
-        registro_id = cursor.lastrowid
         cursor.close()
+    finally:
         conn.close()
 
-        # Enviar email
-        pythoncom.CoInitialize()
-        
-        try:
-            outlook = win32.Dispatch('outlook.application')
-            mail = outlook.CreateItem(0)
+# Propiedad MAPI del encabezado Message-ID (PR_INTERNET_MESSAGE_ID)
+PROPIEDAD_MESSAGE_ID = "http://schemas.microsoft.com/mapi/proptag/0x1035001F"
+DOMINIO_MESSAGE_ID = os.getenv("DOMINIO_MESSAGE_ID", "chatbot-rrhh.local")
 
-            emails = os.getenv("EMAIL_RRHH")
-            destinatarios = [e.strip() for e in emails.split(",") if e.strip()]
+def message_id_de(clave):
+    """Message-ID fijo para una clave de idempotencia: un reenvío llega como el mismo correo."""
+    return f"<{hashlib.sha256(clave.encode('utf-8')).hexdigest()[:40]}@{DOMINIO_MESSAGE_ID}>"
 
-            mail.To = "; ".join(destinatarios)
-            mail.Subject = asunto
-            cuerpo = f"""Consulta recogida desde el Chatbot de RRHH
+def enviar_correo_rrhh(asunto, pregunta, rut_usuario="", nombre_usuario="", clave=None):
+    """
+    Envía la consulta por Outlook a los correos de EMAIL_RRHH; lanza una excepción si falla.
+    Con `clave` el correo sale con un Message-ID derivado de ella y Exchange descarta
+    como duplicado el reenvío de la bandeja tras una caída.
+    """
+    pythoncom.CoInitialize()
+    
+    try:
+        outlook = win32.Dispatch('outlook.application')
+        mail = outlook.CreateItem(0)
+
+        emails = os.getenv("EMAIL_RRHH")
+        destinatarios = [e.strip() for e in emails.split(",") if e.strip()]
+
+        mail.To = "; ".join(destinatarios)
+        mail.Subject = asunto
+        cuerpo = f"""Consulta recogida desde el Chatbot de RRHH
 De: {nombre_usuario if nombre_usuario else 'Usuario anónimo'}
 Rut: {rut_usuario if rut_usuario else 'No proporcionado'}
 
@@ -235,21 +411,37 @@ Pregunta:
 Este mensaje fue enviado automáticamente.
 Fecha: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
 """
-            mail.Body = cuerpo
-            mail.Send()
-            
-            return {
-                "status": "ok",
-                "message": "Email enviado exitosamente a RRHH"
-            }
-        finally:
-            pythoncom.CoUninitialize()
+        mail.Body = cuerpo
+        if clave:
+            mail.PropertyAccessor.SetProperty(PROPIEDAD_MESSAGE_ID, message_id_de(clave))
+        mail.Send()
+    finally:
+        pythoncom.CoUninitialize()
+
+def escalar_a_rrhh(asunto, pregunta, rut_usuario="", nombre_usuario="", notas=""):
+    """Inserta la consulta en unknown_question y la envía por correo a RRHH."""
+    try:
+        # Registrar en MySQL
+        insertar_preguntas_desconocidas([(pregunta, rut_usuario, nombre_usuario, notas)])
+
+        # Enviar email
+        enviar_correo_rrhh(asunto, pregunta, rut_usuario, nombre_usuario)
+
+        return {
+            "status": "ok",
+            "message": "Email enviado exitosamente a RRHH"
+        }
             
     except Exception as e:
         return {
             "status": "error",
             "message": f"No se pudo enviar el email: {str(e)}"
         }
+
+@function_tool
+def enviar_email_rrhh(asunto: str, pregunta: str, rut_usuario: str = "", nombre_usuario: str = "", notas: str = ""):
+    """Registra y envía un correo electrónico al departamento de RRHH."""
+    return escalar_a_rrhh(asunto, pregunta, rut_usuario, nombre_usuario, notas)
     
 instrucciones_registro_desconocido = "Registra preguntas sin respuesta y envía correos informativos a RRHH"
 registro_pregunta_desconocida = Agent(
@@ -321,35 +513,61 @@ orquestador_agente = Agent(
     model="gpt-4o-mini",
 )
 
+# Enrutamiento y búsqueda en código + una sola llamada al LLM; el orquestador queda de respaldo
+pipeline_rag = PipelineRAG(embeddings_model, motor_busqueda, cliente_openai_async, clasificar_politica_con_llm,
+                           enrutador, especulador) if MODO_RESPUESTA == "pipeline" else None
+
 # ============================================================================
 # FUNCIÓN ASÍNCRONA PARA EJECUTAR EL AGENTE
 # ============================================================================
-async def ejecutar_agente_async(mensaje: str) -> str:
-    """Ejecuta el agente de forma asíncrona."""
+async def ejecutar_agente_async(mensaje: str, telefono: str = None) -> str:
+    """Ejecuta el agente de forma asíncrona, con el historial de la sesión del teléfono."""
     
+    loop = asyncio.get_event_loop()
+    historial = sesiones.historial(telefono) if telefono else []
+    # Un "sí" tras ofrecer escalamiento depende de la conversación: no se busca en la caché
+    escalamiento_ofrecido = bool(telefono and sesiones.pregunta_pendiente(telefono))
+    if cache_respuestas is not None and not escalamiento_ofrecido:
+        respuesta_cacheada = await loop.run_in_executor(executor, cache_respuestas.buscar, mensaje)
+        if respuesta_cacheada is not None:
+            print("⚡ Respuesta obtenida de la caché")
+            return respuesta_cacheada
+
+    if especulador is not None:
+        especulador.iniciar(mensaje, NOMBRES_POLITICAS)
+
     try:
-        # Usar el runner suele ser más consistente
-        runner = Runner()
-        result_obj = await runner.run(orquestador_agente, mensaje)
+        raw_response = None
+        if pipeline_rag is not None:
+            try:
+                raw_response = await pipeline_rag.responder(mensaje, NOMBRES_POLITICAS, historial)
+            except Exception as e:
+                print(f"Pipeline de una pasada falló, se usa el agente: {e}")
+
+        if raw_response is None:
+            # Usar el runner suele ser más consistente
+            runner = Runner()
+            entrada = historial + [{"role": "user", "content": mensaje}] if historial else mensaje
+            result_obj = await runner.run(orquestador_agente, entrada)
         
-        # Extraer la respuesta (que esperamos sea un JSON string)
-        raw_response = ""
-        if isinstance(result_obj, str):
-            raw_response = result_obj
-        elif hasattr(result_obj, 'final_output') and result_obj.final_output:
-            raw_response = result_obj.final_output
-        elif hasattr(result_obj, 'content') and result_obj.content:
-            raw_response = result_obj.content
-        elif hasattr(result_obj, 'messages') and result_obj.messages:
-            last_message = result_obj.messages[-1]
-            if isinstance(last_message, dict):
-                raw_response = last_message.get('content', str(last_message))
-            elif hasattr(last_message, 'content'):
-                    raw_response = last_message.content
+            # Extraer la respuesta (que esperamos sea un JSON string)
+            raw_response = ""
+            if isinstance(result_obj, str):
+                raw_response = result_obj
+            elif hasattr(result_obj, 'final_output') and result_obj.final_output:
+                raw_response = result_obj.final_output
+            elif hasattr(result_obj, 'content') and result_obj.content:
+                raw_response = result_obj.content
+            elif hasattr(result_obj, 'messages') and result_obj.messages:
+                last_message = result_obj.messages[-1]
+                if isinstance(last_message, dict):
+                    raw_response = last_message.get('content', str(last_message))
+                elif hasattr(last_message, 'content'):
+                        raw_response = last_message.content
+                else:
+                    raw_response = str(last_message)
             else:
-                raw_response = str(last_message)
-        else:
-            raw_response = str(result_obj)
+                raw_response = str(result_obj)
         
         # Limpiar la respuesta: los LLM a veces envuelven JSON en ```json ... ```
         if "```json" in raw_response:
@@ -360,6 +578,10 @@ async def ejecutar_agente_async(mensaje: str) -> str:
         # Validar si es un JSON antes de devolver
         try:
             json.loads(raw_response)
+            # guardar() solo acepta las acciones de ACCIONES_CACHEABLES (respuestas sobre una
+            # política), no las que dependen de la conversación como el escalamiento
+            if cache_respuestas is not None:
+                await loop.run_in_executor(executor, cache_respuestas.guardar, mensaje, raw_response)
             return raw_response # Retorna el STRING JSON
         except json.JSONDecodeError:
             print(f"Error: La respuesta del agente no fue un JSON válido: {raw_response}")
@@ -388,12 +610,48 @@ async def ejecutar_agente_async(mensaje: str) -> str:
             "necesita_registrar_pregunta": False
         }
         return json.dumps(error_json)
+    finally:
+        if especulador is not None:
+            # Cancela las búsquedas anticipadas que no se usaron e informa el ahorro
+            print(f"⏱️ Etapas especulativas: {especulador.descartar(mensaje)}")
         
 # ============================================================================
 # FASTAPI APPLICATION
 # ============================================================================
 app = FastAPI()
 
+# Envíos, registros y escalamientos: cada tipo con su cola, sus trabajadores y sus hilos
+tareas_fondo = EjecutorTareas()
+
+def entregar_correos_rrhh(lote, claves):
+    for datos, clave in zip(lote, claves):
+        enviar_correo_rrhh(**datos, clave=clave)
+
+# Registros y escalamientos: se anotan en SQLite al instante y los entregan hilos aparte,
+# con reintentos, así una caída de MySQL o de Outlook no pierde nada ni frena la respuesta
+bandeja_salida = BandejaSalida(
+    entregadores={
+        "registro": insertar_preguntas,
+        "pregunta_desconocida": insertar_preguntas_desconocidas,
+        "correo_rrhh": entregar_correos_rrhh,
+    },
+    tamanos_lote={"correo_rrhh": 1}
+)
+
+@app.on_event("startup")
+async def iniciar_tareas_fondo():
+    tareas_fondo.iniciar()
+    bandeja_salida.iniciar()
+
+@app.on_event("shutdown")
+async def detener_tareas_fondo():
+    # Primero las respuestas en curso (encolan envíos y registros), luego las colas
+    await serializador.detener()
+    # Termina los envíos y registros pendientes antes de salir
+    await tareas_fondo.detener()
+    # Lo que la bandeja no alcance a entregar queda en el archivo para el próximo inicio
+    await asyncio.get_running_loop().run_in_executor(None, bandeja_salida.detener)
+
 @app.get("/webhook")
 def verify_webhook(request: Request):
     """Verifica la URL del webhook con Meta."""
@@ -434,95 +692,11 @@ async def process_message_async(body: dict):
             if message_info.get("type") == "text":
                 user_phone_number = message_info["from"]
                 user_message = message_info["text"]["body"]
+                id_mensaje = message_info.get("id")
 
-                print(f"👤 Procesando mensaje de {user_phone_number}: '{user_message}'")
-                
-                # === INICIO DE CAMBIOS: LÓGICA DE CONTROL ===
-                
-                # 1. Ejecutar el agente para obtener el JSON string
-                json_string_response = await ejecutar_agente_async(user_message)
-                
-                print(f"🤖 JSON de respuesta generado: {json_string_response}")
-
-                # 2. Parsear el JSON
-                try:
-                    data = json.loads(json_string_response)
-                except Exception as e:
-                    print(f"Error fatal parseando JSON, enviando error: {e}")
-                    data = {
-                        "respuesta_al_usuario": "Lo siento, tuve un problema interno para entender la respuesta. Intenta de nuevo.",
-                        "necesita_registrar_pregunta": False,
-                        "necesita_escalar_a_rrhh": False,
-                        "accion": "error_parseo_json",
-                        "politica_identificada": None,
-                        "contexto_utilizado": None
-                    }
-
-                # === INICIO DE CAMBIOS: LOGGING DETALLADO ===
-                # Imprimimos un "informe" claro en la consola
-                print("="*60)
-                print("🤖 INFORME DE PROCESAMIENTO DEL AGENTE")
-                print(f"  > Acción Decidida:     {data.get('accion')}")
-                print(f"  > Política Identificada: {data.get('politica_identificada')}")
-                
-                # Esto responde directamente a tu pregunta:
-                contexto_encontrado = bool(data.get('contexto_utilizado'))
-                print(f"  > Contexto Encontrado: {'SÍ ✅' if contexto_encontrado else 'NO ❌'}")
-                
-                print(f"  > Respuesta P/ Usuario:  {data.get('respuesta_al_usuario')}")
-                print("="*60)
-                # === FIN DE CAMBIOS ===
-
-                # 3. Extraer la respuesta para el usuario
-                respuesta_para_enviar = data.get(
-                    "respuesta_al_usuario", 
-                    "No pude procesar tu solicitud."
-                )
-
-                # 4. Enviar respuesta a WhatsApp
-                await send_whatsapp_message_async(user_phone_number, respuesta_para_enviar)
-
-                # 5. === AQUÍ ESTÁ EL CONTROL ===
-                # Ejecutar acciones post-respuesta (handoffs) de forma asíncrona
-                
-                loop = asyncio.get_event_loop()
-
-                if data.get("necesita_registrar_pregunta", False):
-                    print("Ejecutando handoff: registrador_preguntas_usuarios")
-                    
-                    # Construir un prompt claro para el agente de registro
-                    prompt_registro = f"""
-                    Registra la siguiente interacción:
-                    - Pregunta Original: "{user_message}"
-                    - Política Consultada: "{data.get('politica_identificada')}"
-                    - Contexto Encontrado: {data.get('contexto_utilizado') is not None}
-                    - Respuesta dada al usuario: "{respuesta_para_enviar}"
-                    """
-                    
-                    # Ejecutamos el agente de registro en el pool de hilos
-                    await loop.run_in_executor(
-                        executor,
-                        lambda: asyncio.run(Runner().run(registro_pregunta, prompt_registro))
-                    )
-
-                if data.get("necesita_escalar_a_rrhh", False):
-                    print("Ejecutando handoff: registrador_preguntas_desconocidas")
-                    
-                    # Construir un prompt claro para el agente de escalamiento
-                    prompt_escalamiento = f"""
-                    El usuario necesita escalar la siguiente consulta a RRHH. 
-                    Asunto: "Consulta de Chatbot para RRHH"
-                    Pregunta: "{user_message}"
-                    Notas: El bot no pudo encontrar una respuesta.
-                    """
-                    
-                    # Ejecutamos el agente de escalamiento en el pool de hilos
-                    await loop.run_in_executor(
-                        executor,
-                        lambda: asyncio.run(Runner().run(registro_pregunta_desconocida, prompt_escalamiento))
-                    )
-                
-                # === FIN DE CAMBIOS ===
+                print(f"👤 Mensaje de {user_phone_number}: '{user_message}'")
+                # Un solo turno en curso por usuario; los mensajes seguidos se responden juntos
+                serializador.agregar(user_phone_number, user_message, id_mensaje)
             else:
                 print(f"ℹ️ Tipo de mensaje no-texto: {message_info.get('type')}")
         else:
@@ -533,6 +707,124 @@ async def process_message_async(body: dict):
         import traceback
         traceback.print_exc()
 
+async def responder_usuario(user_phone_number: str, user_message: str, ids_mensajes: list):
+    """Genera y envía la respuesta a uno o más mensajes seguidos del mismo usuario."""
+    # Meta reenvía el mismo mensaje si el webhook tarda; su id evita registros duplicados
+    id_mensaje = "+".join(ids_mensajes) or str(time.time_ns())
+    print(f"👤 Procesando mensaje de {user_phone_number}: '{user_message}'")
+    try:
+        # === INICIO DE CAMBIOS: LÓGICA DE CONTROL ===
+        
+        # 1. Ejecutar el agente para obtener el JSON string
+        json_string_response = await ejecutar_agente_async(user_message, user_phone_number)
+        
+        print(f"🤖 JSON de respuesta generado: {json_string_response}")
+
+        # 2. Parsear el JSON
+        try:
+            data = json.loads(json_string_response)
+        except Exception as e:
+            print(f"Error fatal parseando JSON, enviando error: {e}")
+            data = {
+                "respuesta_al_usuario": "Lo siento, tuve un problema interno para entender la respuesta. Intenta de nuevo.",
+                "necesita_registrar_pregunta": False,
+                "necesita_escalar_a_rrhh": False,
+                "accion": "error_parseo_json",
+                "politica_identificada": None,
+                "contexto_utilizado": None
+            }
+
+        # === INICIO DE CAMBIOS: LOGGING DETALLADO ===
+        # Imprimimos un "informe" claro en la consola
+        print("="*60)
+        print("🤖 INFORME DE PROCESAMIENTO DEL AGENTE")
+        print(f"  > Acción Decidida:     {data.get('accion')}")
+        print(f"  > Política Identificada: {data.get('politica_identificada')}")
+        
+        # Esto responde directamente a tu pregunta:
+        contexto_encontrado = bool(data.get('contexto_utilizado'))
+        print(f"  > Contexto Encontrado: {'SÍ ✅' if contexto_encontrado else 'NO ❌'}")
+        
+        print(f"  > Respuesta P/ Usuario:  {data.get('respuesta_al_usuario')}")
+        print("="*60)
+        # === FIN DE CAMBIOS ===
+
+        # 3. Extraer la respuesta para el usuario
+        respuesta_para_enviar = data.get(
+            "respuesta_al_usuario", 
+            "No pude procesar tu solicitud."
+        )
+
+        # Al aceptar el escalamiento ("sí"), lo que se envía a RRHH es la pregunta original
+        pregunta_escalada = user_message
+        if data.get("accion") == "confirmar_escalamiento":
+            pregunta_escalada = sesiones.pregunta_pendiente(user_phone_number) or user_message
+        sesiones.agregar_turno(user_phone_number, user_message, respuesta_para_enviar, data.get("accion"))
+
+        # 4. Enviar respuesta a WhatsApp
+        envio = await tareas_fondo.encolar("envio", send_whatsapp_message_async, user_phone_number, respuesta_para_enviar)
+
+        # 5. === AQUÍ ESTÁ EL CONTROL ===
+        # Encolar acciones post-respuesta (handoffs) en sus propias colas
+
+        if data.get("necesita_registrar_pregunta", False) and not REGISTRO_CON_AGENTES:
+            bandeja_salida.registrar("registro", [
+                user_message,
+                data.get("politica_identificada") or "No especificada",
+                data.get("contexto_utilizado") is not None,
+                respuesta_para_enviar,
+                ""
+            ], clave=f"registro:{id_mensaje}")
+
+        elif data.get("necesita_registrar_pregunta", False):
+            print("Ejecutando handoff: registrador_preguntas_usuarios")
+            
+            # Construir un prompt claro para el agente de registro
+            prompt_registro = f"""
+            Registra la siguiente interacción:
+            - Pregunta Original: "{user_message}"
+            - Política Consultada: "{data.get('politica_identificada')}"
+            - Contexto Encontrado: {data.get('contexto_utilizado') is not None}
+            - Respuesta dada al usuario: "{respuesta_para_enviar}"
+            """
+            
+            # El agente de registro corre en el mismo event loop, en la cola de registro
+            await tareas_fondo.encolar("registro", Runner().run, registro_pregunta, prompt_registro)
+
+        if data.get("necesita_escalar_a_rrhh", False) and not REGISTRO_CON_AGENTES:
+            # Registro y correo por separado: reintentar el correo no duplica la fila en MySQL
+            bandeja_salida.registrar("pregunta_desconocida", [
+                pregunta_escalada, "", "", "El bot no pudo encontrar una respuesta."
+            ], clave=f"pregunta_desconocida:{id_mensaje}")
+            bandeja_salida.registrar("correo_rrhh", {
+                "asunto": "Consulta de Chatbot para RRHH",
+                "pregunta": pregunta_escalada
+            }, clave=f"correo_rrhh:{id_mensaje}")
+
+        elif data.get("necesita_escalar_a_rrhh", False):
+            print("Ejecutando handoff: registrador_preguntas_desconocidas")
+            
+            # Construir un prompt claro para el agente de escalamiento
+            prompt_escalamiento = f"""
+            El usuario necesita escalar la siguiente consulta a RRHH. 
+            Asunto: "Consulta de Chatbot para RRHH"
+            Pregunta: "{pregunta_escalada}"
+            Notas: El bot no pudo encontrar una respuesta.
+            """
+            
+            # El agente de escalamiento corre en el mismo event loop, en la cola de escalamiento
+            await tareas_fondo.encolar("escalamiento", Runner().run, registro_pregunta_desconocida, prompt_escalamiento)
+
+        # El siguiente turno de este usuario espera a que su respuesta se haya enviado (orden garantizado)
+        await envio
+        
+        # === FIN DE CAMBIOS ===
+
+    except Exception as e:
+        print(f"❌ Error al procesar mensaje: {e}")
+        import traceback
+        traceback.print_exc()
+
 async def send_whatsapp_message_async(to_number: str, message: str, retries=3, delay=2):
     """Envía un mensaje de WhatsApp de forma asíncrona."""
     url = f"https://graph.facebook.com/v19.0/{PHONE_NUMBER_ID}/messages"
@@ -551,9 +843,9 @@ async def send_whatsapp_message_async(to_number: str, message: str, retries=3, d
     
     for attempt in range(retries):
         try:
-            # Ejecutar la petición HTTP en thread pool
+            # Ejecutar la petición HTTP en los hilos propios de los envíos
             response = await loop.run_in_executor(
-                executor,
+                tareas_fondo.hilos("envio"),
                 lambda: requests.post(url, headers=headers, json=payload)
             )
             response.raise_for_status()
@@ -565,6 +857,49 @@ async def send_whatsapp_message_async(to_number: str, message: str, retries=3, d
                 await asyncio.sleep(delay)
             else:
                 print("❌ Máximo de reintentos alcanzado")
+                # Para que la cola de envíos lo cuente como fallido
+                raise
+
+serializador = SerializadorUsuarios(responder_usuario)
+
+# ============================================================================
+# RECARGA DE POLÍTICAS (la llama vigilar_politicas.py tras cada ingesta)
+# ============================================================================
+TOKEN_RECARGA = os.getenv("TOKEN_RECARGA")
+
+@app.post("/admin/recargar")
+def recargar_politicas_endpoint(request: Request):
+    """Relee la carpeta de políticas, el manifest de ingesta y los índices sin reiniciar el servidor."""
+    if not TOKEN_RECARGA or request.headers.get("X-Token-Recarga") != TOKEN_RECARGA:
+        return Response(status_code=403)
+    nombres = recargar_politicas()
+    print(f"🔄 Políticas recargadas: {nombres}")
+    return {"status": "ok", "politicas": list(nombres)}
+
+# ============================================================================
+# PREGUNTAS POR LOTE (cliente: python lote_preguntas.py preguntas.txt)
+# ============================================================================
+procesador_lote = ProcesadorLote(embeddings_model, motor_busqueda, cliente_openai_async,
+                                 clasificar_politica_con_llm, enrutador)
+
+@app.post("/lote")
+async def lote_endpoint(request: Request):
+    """Responde {"preguntas": [...]} y entrega una línea JSON por pregunta a medida que terminan."""
+    if not TOKEN_LOTE or request.headers.get("X-Token-Lote") != TOKEN_LOTE:
+        return Response(status_code=403)
+    try:
+        preguntas = [str(p).strip() for p in (await request.json()).get("preguntas", [])]
+    except Exception:
+        return Response(status_code=400)
+    preguntas = [p for p in preguntas if p]
+    if not preguntas or len(preguntas) > MAX_PREGUNTAS_LOTE:
+        return Response(status_code=400)
+
+    async def lineas():
+        async for resultado in procesador_lote.procesar(preguntas, NOMBRES_POLITICAS):
+            yield json.dumps(resultado, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lineas(), media_type="application/x-ndjson")
 
 # ============================================================================
 # HEALTH CHECK ENDPOINT
@@ -572,7 +907,22 @@ async def send_whatsapp_message_async(to_number: str, message: str, retries=3, d
 @app.get("/health")
 def health_check():
     """Endpoint para verificar que el servidor está funcionando."""
-    return {"status": "ok", "message": "WhatsApp Bot is running"}
+    return {
+        "status": "ok",
+        "message": "WhatsApp Bot is running",
+        "cache_embeddings": embeddings_model.estadisticas() if hasattr(embeddings_model, "estadisticas") else None,
+        "indice_int8": indice_int8.estadisticas() if indice_int8 is not None else None,
+        "indice_numpy": indice_numpy.estadisticas() if indice_numpy is not None else None,
+        "busqueda_hibrida": BUSQUEDA_HIBRIDA,
+        "enrutador": enrutador.estadisticas() if enrutador is not None else None,
+        "cache_respuestas": cache_respuestas.estadisticas() if cache_respuestas is not None else None,
+        "especulacion": especulador.estadisticas() if especulador is not None else None,
+        "pipeline": pipeline_rag.estadisticas() if pipeline_rag is not None else None,
+        "tareas_fondo": tareas_fondo.estadisticas(),
+        "bandeja_salida": bandeja_salida.estadisticas(),
+        "sesiones": sesiones.estadisticas(),
+        "serializador": serializador.estadisticas()
+    }
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,97 @@
+"""
+Búsqueda de chunks sobre el motor configurado (Chroma, índice int8 o índice NumPy,
+con fusión BM25 opcional). Las llamadas bloqueantes a Chroma y NumPy corren en un
+pool de hilos propio, para que las herramientas async del agente no detengan el
+event loop que atiende el webhook.
+"""
+
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from indice_bm25 import FACTOR_CANDIDATOS_HIBRIDA, fusionar_rrf
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+HILOS_BUSQUEDA = int(os.getenv("HILOS_BUSQUEDA", 8))
+
+
+class MotorBusqueda:
+    """Elige el índice disponible en el mismo orden que antes: int8, NumPy y por último Chroma."""
+
+    def __init__(self, coleccion, indice_int8=None, indice_numpy=None, indice_bm25=None, hilos=HILOS_BUSQUEDA):
+        self.coleccion = coleccion
+        self.indice_int8 = indice_int8
+        self.indice_numpy = indice_numpy
+        self.indice_bm25 = indice_bm25
+        self.executor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="busqueda")
+
+    def buscar(self, pregunta, embedding_pregunta, nombre_politica, n_resultados=5):
+        """Devuelve (documentos, metadatos) de los chunks más relevantes de la política."""
+        # En modo híbrido cada ranking aporta más candidatos y RRF elige los n_resultados finales
+        n_candidatos = n_resultados * FACTOR_CANDIDATOS_HIBRIDA if self.indice_bm25 is not None else n_resultados
+
+        if self.indice_int8 is not None:
+            documentos, metadatos = self.indice_int8.buscar(embedding_pregunta, nombre_politica, n_candidatos)
+        elif self.indice_numpy is not None:
+            documentos, metadatos = self.indice_numpy.buscar(embedding_pregunta, nombre_politica, n_candidatos)
+        else:
+            resultados = self.coleccion.query(
+                query_embeddings=[embedding_pregunta],
+                n_results=n_candidatos,
+                where={"source": nombre_politica},
+                include=["documents", "metadatas"]
+            )
+            documentos = resultados['documents'][0] if resultados['documents'] else []
+            metadatos = resultados['metadatas'][0] if resultados['metadatas'] else []
+
+        if self.indice_bm25 is not None:
+            documentos, metadatos = fusionar_rrf(
+                [(documentos, metadatos), self.indice_bm25.buscar(pregunta, nombre_politica, n_candidatos)],
+                n_resultados
+            )
+        return documentos, metadatos
+
+    def buscar_lote(self, preguntas, embeddings_preguntas, nombres_politicas, n_resultados=5):
+        """
+        `buscar` para muchas preguntas a la vez: se agrupan por política y cada grupo se
+        resuelve con una sola consulta (un query multi-embedding en Chroma o un producto
+        de matrices en el índice NumPy). Devuelve [(documentos, metadatos)] en el orden de entrada.
+        """
+        n_candidatos = n_resultados * FACTOR_CANDIDATOS_HIBRIDA if self.indice_bm25 is not None else n_resultados
+        resultados = [([], []) for _ in preguntas]
+        por_politica = {}
+        for i, nombre_politica in enumerate(nombres_politicas):
+            if nombre_politica:
+                por_politica.setdefault(nombre_politica, []).append(i)
+
+        for nombre_politica, indices in por_politica.items():
+            embeddings = [embeddings_preguntas[i] for i in indices]
+            if self.indice_int8 is not None:
+                grupo = [self.indice_int8.buscar(e, nombre_politica, n_candidatos) for e in embeddings]
+            elif self.indice_numpy is not None:
+                grupo = self.indice_numpy.buscar_lote(embeddings, nombre_politica, n_candidatos)
+            else:
+                consulta = self.coleccion.query(
+                    query_embeddings=embeddings,
+                    n_results=n_candidatos,
+                    where={"source": nombre_politica},
+                    include=["documents", "metadatas"]
+                )
+                grupo = list(zip(consulta['documents'] or [[] for _ in indices], consulta['metadatas'] or [[] for _ in indices]))
+            for i, (documentos, metadatos) in zip(indices, grupo):
+                if self.indice_bm25 is not None:
+                    documentos, metadatos = fusionar_rrf(
+                        [(documentos, metadatos), self.indice_bm25.buscar(preguntas[i], nombre_politica, n_candidatos)],
+                        n_resultados
+                    )
+                resultados[i] = (documentos, metadatos)
+        return resultados
+
+    async def abuscar(self, pregunta, embedding_pregunta, nombre_politica, n_resultados=5):
+        """Versión async de `buscar`: corre en el pool de hilos de búsqueda."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self.buscar, pregunta, embedding_pregunta, nombre_politica, n_resultados
+        )
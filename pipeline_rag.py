@@ -0,0 +1,152 @@
+"""
+Respuesta en una sola pasada (MODO_RESPUESTA=pipeline).
+El orquestador llega a la respuesta en varias vueltas al LLM: decide llamar a
+`seleccionar_politica_con_llm`, luego a `buscar_contexto_relevante` y por último
+escribe el JSON. Aquí el enrutamiento y la búsqueda se hacen directamente en código
+y se hace una única llamada con salida estructurada (json_schema) que entrega la
+acción y el mensaje; la política y el contexto los completa el código. Si algo falla,
+main_ahora_si.py vuelve al agente.
+"""
+
+import os
+import json
+import time
+import threading
+
+from empaquetado_contexto import empaquetar_contexto
+from enrutador_politicas import SIN_COINCIDENCIAS
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+# "pipeline" (una llamada al LLM, con el agente como respaldo) o "agente"
+MODO_RESPUESTA = os.getenv("MODO_RESPUESTA", "pipeline")
+N_RESULTADOS_PIPELINE = int(os.getenv("N_RESULTADOS_PIPELINE", 5))
+
+ACCIONES = ["responder_con_contexto", "responder_sin_contexto", "ofrecer_escalamiento", "confirmar_escalamiento"]
+
+# Solo lo que el modelo tiene que decidir; el resto del JSON de salida lo arma el código
+ESQUEMA_RESPUESTA = {
+    "name": "respuesta_rrhh",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "accion": {"type": "string", "enum": ACCIONES},
+            "respuesta_al_usuario": {"type": "string"},
+        },
+        "required": ["accion", "respuesta_al_usuario"],
+        "additionalProperties": False,
+    },
+}
+
+INSTRUCCIONES_PIPELINE = """
+Eres un asistente de Recursos Humanos experto de la empresa Cramer.
+Recibes el mensaje del usuario, los mensajes anteriores de la conversación si los hay y, si se
+encontró, el contexto de la política de RRHH más relevante.
+Elige la acción y escribe el mensaje que el usuario final debe leer.
+
+**Tipos de 'accion':**
+- "responder_sin_contexto": Si es un saludo, despedida o chat general.
+  Para un saludo responde: "Hola, soy tu asistente de RRHH. ¿En qué puedo ayudarte hoy?".
+- "responder_con_contexto": Si el contexto contiene la respuesta. Responde basándote ÚNICAMENTE en el contexto.
+- "ofrecer_escalamiento": Si es una consulta de RRHH y no hay contexto o el contexto no la responde.
+  Responde: "No encontré un documento que hable sobre eso. ¿Quieres que envíe tu consulta a RRHH?".
+- "confirmar_escalamiento": Si el usuario *acepta* escalar (p.ej. dice "sí", o "sí, por favor").
+  Responde: "Perfecto, he enviado tu consulta a RRHH. Te contactarán pronto."
+"""
+
+
+class PipelineRAG:
+    """Enrutamiento + búsqueda + una llamada al LLM; devuelve el mismo JSON que el orquestador."""
+
+    def __init__(self, embeddings_model, motor_busqueda, cliente_openai_async, clasificador_llm,
+                 enrutador=None, especulador=None, modelo="gpt-4o-mini", n_resultados=N_RESULTADOS_PIPELINE):
+        self.embeddings_model = embeddings_model
+        self.motor_busqueda = motor_busqueda
+        self.cliente_openai_async = cliente_openai_async
+        self.clasificador_llm = clasificador_llm
+        self.enrutador = enrutador
+        self.especulador = especulador
+        self.modelo = modelo
+        self.n_resultados = n_resultados
+        self._lock = threading.Lock()
+        self.respuestas = 0
+        self.fallos = 0
+        self.ms_totales = 0.0
+
+    async def _embedding(self, pregunta):
+        if self.especulador is not None:
+            return await self.especulador.embedding(pregunta)
+        return await self.embeddings_model.aembed_query(pregunta)
+
+    async def _buscar(self, pregunta, embedding, nombre_politica):
+        if self.especulador is not None:
+            return await self.especulador.buscar(pregunta, embedding, nombre_politica, self.n_resultados)
+        return await self.motor_busqueda.abuscar(pregunta, embedding, nombre_politica, self.n_resultados)
+
+    async def _etapas(self, pregunta, nombres_validos, historial):
+        embedding = await self._embedding(pregunta)
+        if self.enrutador is not None:
+            politica = await self.enrutador.aseleccionar(pregunta, self.clasificador_llm, nombres_validos,
+                                                         embedding_pregunta=embedding)
+        else:
+            politica = await self.clasificador_llm(pregunta)
+
+        contexto = None
+        if politica and politica != SIN_COINCIDENCIAS:
+            documentos, metadatos = await self._buscar(pregunta, embedding, politica)
+            contexto, _ = empaquetar_contexto(documentos, metadatos)
+        else:
+            politica = None
+
+        mensaje = f"Mensaje del usuario: {pregunta}\n\n"
+        mensaje += f"Contexto de {politica}:\n\n{contexto}" if contexto else "No se encontró contexto."
+        respuesta = await self.cliente_openai_async.chat.completions.create(
+            model=self.modelo,
+            messages=[
+                {"role": "system", "content": INSTRUCCIONES_PIPELINE},
+                *historial,
+                {"role": "user", "content": mensaje},
+            ],
+            response_format={"type": "json_schema", "json_schema": ESQUEMA_RESPUESTA},
+            temperature=0.0,
+        )
+        decision = json.loads(respuesta.choices[0].message.content)
+        if decision["accion"] not in ACCIONES:
+            raise ValueError(f"Acción desconocida: {decision['accion']}")
+        if decision["accion"] == "responder_con_contexto" and not contexto:
+            # Sin contexto no hay nada en qué basar la respuesta
+            raise ValueError("El modelo respondió con contexto, pero no se recuperó ninguno.")
+
+        con_contexto = decision["accion"] == "responder_con_contexto"
+        return json.dumps({
+            "accion": decision["accion"],
+            "respuesta_al_usuario": decision["respuesta_al_usuario"],
+            "politica_identificada": politica if con_contexto else None,
+            "contexto_utilizado": contexto if con_contexto else None,
+            "necesita_escalar_a_rrhh": decision["accion"] == "confirmar_escalamiento",
+            "necesita_registrar_pregunta": con_contexto,
+        }, ensure_ascii=False)
+
+    async def responder(self, pregunta, nombres_validos, historial=None):
+        """String JSON con el esquema del orquestador. Propaga la excepción si algo falla."""
+        inicio = time.perf_counter()
+        try:
+            resultado = await self._etapas(pregunta, list(nombres_validos), historial or [])
+        except Exception:
+            with self._lock:
+                self.fallos += 1
+            raise
+        with self._lock:
+            self.respuestas += 1
+            self.ms_totales += (time.perf_counter() - inicio) * 1000
+        return resultado
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "respuestas": self.respuestas,
+                "fallos_con_respaldo_agente": self.fallos,
+                "ms_promedio": round(self.ms_totales / self.respuestas, 1) if self.respuestas else None,
+            }
@@ -0,0 +1,85 @@
+"""
+Proveedores de embeddings seleccionables por configuración.
+- "openai": OpenAIEmbeddings (por defecto, como hasta ahora).
+- "local": n-gramas con hashing proyectados a una dimensión fija, en NumPy. Es
+  determinista y no usa la red: sirve para pruebas de carga, benchmarks y ambientes
+  sin internet. Sus vectores no son compatibles con los de OpenAI, así que debe usar
+  su propia base Chroma (DB_PATH distinto).
+"""
+
+import os
+import zlib
+import numpy as np
+
+from cache_embeddings import EmbeddingsConCache
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+PROVEEDOR_EMBEDDINGS = os.getenv("PROVEEDOR_EMBEDDINGS", "openai")
+MODELO_EMBEDDINGS = os.getenv("MODELO_EMBEDDINGS", "text-embedding-3-small")
+DIMENSION_EMBEDDINGS_LOCAL = int(os.getenv("DIMENSION_EMBEDDINGS_LOCAL", 1536))
+
+
+class EmbeddingsLocales:
+    """
+    Embeddings deterministas sin red: trigramas de caracteres y palabras sueltas,
+    cada uno llevado por hashing a una posición y un signo de un vector de
+    `dimension` componentes (feature hashing). El vector se normaliza a largo 1, así
+    que el producto punto equivale al coseno, igual que con text-embedding-3.
+    """
+
+    def __init__(self, dimension=DIMENSION_EMBEDDINGS_LOCAL):
+        self.dimension = dimension
+
+    def _caracteristicas(self, texto):
+        texto = " ".join(texto.lower().split())
+        relleno = f" {texto} "
+        trigramas = [relleno[i:i + 3] for i in range(len(relleno) - 2)]
+        palabras = [f"#{palabra}" for palabra in texto.split()]
+        return trigramas + palabras
+
+    def _vector(self, texto):
+        hashes = np.fromiter(
+            (zlib.crc32(c.encode("utf-8")) for c in self._caracteristicas(texto)), dtype=np.uint64
+        )
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        if len(hashes):
+            posiciones = (hashes % self.dimension).astype(np.int64)
+            signos = np.where((hashes >> np.uint64(31)) & np.uint64(1), 1.0, -1.0).astype(np.float32)
+            np.add.at(vector, posiciones, signos)
+        norma = np.linalg.norm(vector)
+        return vector / norma if norma else vector
+
+    def embed_documents(self, textos):
+        return [self._vector(texto).tolist() for texto in textos]
+
+    def embed_query(self, texto):
+        return self._vector(texto).tolist()
+
+    async def aembed_query(self, texto):
+        # Calcularlo toma menos que pasarlo a un hilo
+        return self.embed_query(texto)
+
+
+def nombre_modelo_embeddings(proveedor=PROVEEDOR_EMBEDDINGS, modelo=MODELO_EMBEDDINGS):
+    """Nombre con el que se identifican los vectores (clave de la caché, benchmarks)."""
+    if proveedor == "local":
+        return f"local-ngramas-{DIMENSION_EMBEDDINGS_LOCAL}"
+    return modelo
+
+
+def crear_modelo_embeddings(proveedor=PROVEEDOR_EMBEDDINGS, modelo=MODELO_EMBEDDINGS, con_cache=True):
+    """
+    Crea el modelo de embeddings configurado. El proveedor "openai" se envuelve con la
+    caché en disco; el local no la necesita porque calcularlo es más barato que leerla.
+    """
+    if proveedor == "local":
+        return EmbeddingsLocales()
+    if proveedor == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        modelo_base = OpenAIEmbeddings(model=modelo)
+        if con_cache:
+            return EmbeddingsConCache(modelo_base, nombre_modelo_embeddings(proveedor, modelo))
+        return modelo_base
+    raise ValueError(f"Proveedor de embeddings desconocido: '{proveedor}'. Usa 'openai' o 'local'.")
@@ -0,0 +1,104 @@
+"""
+Orden y agrupación de mensajes por usuario.
+Cuando alguien escribe varios mensajes seguidos ("hola", "tengo una duda", "sobre la
+beca"), cada webhook iniciaba una ejecución completa del agente en paralelo y las
+respuestas podían llegar desordenadas. Aquí cada número de WhatsApp tiene a lo más una
+ejecución en curso: los mensajes que llegan dentro de una ventana corta se unen en uno
+solo, y los que llegan mientras se responde esperan a que termine la ejecución anterior.
+También descarta los mensajes que Meta reenvía con el mismo id.
+"""
+
+import os
+import time
+import asyncio
+from collections import OrderedDict
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+# Silencio (segundos) que se espera tras el último mensaje antes de responder
+VENTANA_AGRUPACION_S = float(os.getenv("VENTANA_AGRUPACION_S", 1.5))
+# Espera máxima desde el primer mensaje del grupo, aunque el usuario siga escribiendo
+MAX_ESPERA_AGRUPACION_S = float(os.getenv("MAX_ESPERA_AGRUPACION_S", 5.0))
+# Ids de mensajes recientes que se recuerdan para ignorar reenvíos del webhook
+MAX_IDS_RECIENTES = 10000
+
+
+class SerializadorUsuarios:
+    """
+    `agregar` se llama por cada mensaje de texto; `procesar(telefono, texto, ids)` es la
+    corrutina que responde y nunca corre dos veces a la vez para el mismo teléfono.
+    """
+
+    def __init__(self, procesar, ventana_s=VENTANA_AGRUPACION_S, max_espera_s=MAX_ESPERA_AGRUPACION_S):
+        self.procesar = procesar
+        self.ventana_s = ventana_s
+        self.max_espera_s = max_espera_s
+        self._pendientes = {}  # telefono -> [(texto, id_mensaje, llegada)]
+        self._trabajadores = {}  # telefono -> tarea
+        self._ids_recientes = OrderedDict()
+        self.mensajes = 0
+        self.ejecuciones = 0
+        self.duplicados = 0
+
+    def agregar(self, telefono, texto, id_mensaje=None):
+        """Encola el mensaje del usuario; devuelve False si es un reenvío ya recibido."""
+        if id_mensaje:
+            if id_mensaje in self._ids_recientes:
+                self.duplicados += 1
+                return False
+            self._ids_recientes[id_mensaje] = None
+            if len(self._ids_recientes) > MAX_IDS_RECIENTES:
+                self._ids_recientes.popitem(last=False)
+
+        self.mensajes += 1
+        self._pendientes.setdefault(telefono, []).append((texto, id_mensaje, time.monotonic()))
+        if telefono not in self._trabajadores:
+            self._trabajadores[telefono] = asyncio.ensure_future(self._atender(telefono))
+        return True
+
+    async def _esperar_silencio(self, telefono):
+        """Espera hasta `ventana_s` sin mensajes nuevos o hasta `max_espera_s` desde el primero."""
+        while True:
+            grupo = self._pendientes[telefono]
+            ahora = time.monotonic()
+            espera = min(grupo[-1][2] + self.ventana_s, grupo[0][2] + self.max_espera_s) - ahora
+            if espera <= 0:
+                return
+            await asyncio.sleep(espera)
+
+    async def _atender(self, telefono):
+        try:
+            while self._pendientes.get(telefono):
+                await self._esperar_silencio(telefono)
+                grupo = self._pendientes.pop(telefono)
+                texto = "\n".join(texto for texto, _, _ in grupo)
+                ids = [id_mensaje for _, id_mensaje, _ in grupo if id_mensaje]
+                if len(grupo) > 1:
+                    print(f"🧩 {len(grupo)} mensajes de {telefono} agrupados en una sola ejecución.")
+                self.ejecuciones += 1
+                try:
+                    await self.procesar(telefono, texto, ids)
+                except Exception as e:
+                    print(f"❌ Error al responder a {telefono}: {e}")
+        finally:
+            # Lo que llegó durante la última ejecución ya se atendió en el while
+            del self._trabajadores[telefono]
+
+    async def detener(self, espera=30.0):
+        """Espera a que terminen las ejecuciones en curso (al apagar el servidor)."""
+        tareas = list(self._trabajadores.values())
+        if not tareas:
+            return
+        _, pendientes = await asyncio.wait(tareas, timeout=espera)
+        for tarea in pendientes:
+            tarea.cancel()
+
+    def estadisticas(self):
+        return {
+            "usuarios_activos": len(self._trabajadores),
+            "mensajes": self.mensajes,
+            "ejecuciones": self.ejecuciones,
+            "mensajes_agrupados": self.mensajes - self.ejecuciones - sum(len(g) for g in self._pendientes.values()),
+            "reenvios_ignorados": self.duplicados,
+        }
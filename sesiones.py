@@ -0,0 +1,145 @@
+"""
+Historial de conversación por número de WhatsApp.
+Cada sesión guarda solo los últimos turnos (mensaje del usuario y texto enviado, no el
+JSON ni el contexto RAG) dentro de un presupuesto de tokens; los turnos que no caben
+se reducen a su pregunta y pasan a un resumen también acotado. Las sesiones se
+descartan por inactividad (TTL) o por LRU al superar MAX_SESIONES, así que la memoria
+queda acotada aunque haya decenas de miles de usuarios.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from tokenizador import contar_tokens
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+MAX_SESIONES = int(os.getenv("MAX_SESIONES", 20000))
+TTL_SESION_S = float(os.getenv("TTL_SESION_S", 30 * 60))
+# Tokens máximos del historial que se agrega al prompt (turnos + resumen)
+PRESUPUESTO_TOKENS_SESION = int(os.getenv("PRESUPUESTO_TOKENS_SESION", 600))
+# Parte del presupuesto reservada para el resumen de preguntas anteriores
+TOKENS_RESUMEN_SESION = PRESUPUESTO_TOKENS_SESION // 4
+# Cada mensaje guardado se corta a este largo (las respuestas de RRHH pueden ser largas)
+MAX_CARACTERES_TURNO = 600
+
+
+def _recortar(texto, maximo=MAX_CARACTERES_TURNO):
+    texto = " ".join(str(texto).split())
+    return texto if len(texto) <= maximo else texto[:maximo - 1].rstrip() + "…"
+
+
+class Sesion:
+    __slots__ = ("turnos", "tokens_turnos", "resumen", "tokens_resumen", "pendiente", "ultimo_uso")
+
+    def __init__(self):
+        self.turnos = []  # (usuario, asistente, tokens)
+        self.tokens_turnos = 0
+        self.resumen = []  # (pregunta, tokens)
+        self.tokens_resumen = 0
+        # Pregunta a la que se le ofreció escalamiento, para enviarla si el usuario acepta
+        self.pendiente = None
+        self.ultimo_uso = time.time()
+
+
+class AlmacenSesiones:
+    """Sesiones en memoria con LRU + TTL. Es seguro usarlo desde varios hilos."""
+
+    def __init__(self, max_sesiones=MAX_SESIONES, ttl_s=TTL_SESION_S,
+                 presupuesto_tokens=PRESUPUESTO_TOKENS_SESION, tokens_resumen=TOKENS_RESUMEN_SESION):
+        self.max_sesiones = max_sesiones
+        self.ttl_s = ttl_s
+        self.presupuesto_tokens = presupuesto_tokens
+        self.tokens_resumen = tokens_resumen
+        self._sesiones = OrderedDict()
+        self._lock = threading.Lock()
+        self.expiradas = 0
+        self.desalojadas = 0
+
+    def _obtener(self, telefono, crear=False):
+        """Sesión vigente del teléfono (la marca como usada), o None."""
+        sesion = self._sesiones.get(telefono)
+        if sesion is not None and time.time() - sesion.ultimo_uso > self.ttl_s:
+            del self._sesiones[telefono]
+            self.expiradas += 1
+            sesion = None
+        if sesion is None:
+            if not crear:
+                return None
+            sesion = Sesion()
+            self._sesiones[telefono] = sesion
+        sesion.ultimo_uso = time.time()
+        self._sesiones.move_to_end(telefono)
+        return sesion
+
+    def _purgar(self):
+        # El OrderedDict está ordenado por último uso: las vencidas y las LRU están al principio
+        limite = time.time() - self.ttl_s
+        while self._sesiones:
+            telefono, sesion = next(iter(self._sesiones.items()))
+            if sesion.ultimo_uso >= limite and len(self._sesiones) <= self.max_sesiones:
+                break
+            del self._sesiones[telefono]
+            if sesion.ultimo_uso < limite:
+                self.expiradas += 1
+            else:
+                self.desalojadas += 1
+
+    def historial(self, telefono):
+        """Mensajes previos en formato [{"role", "content"}], del más antiguo al más reciente."""
+        with self._lock:
+            sesion = self._obtener(telefono)
+            if sesion is None:
+                return []
+            mensajes = []
+            if sesion.resumen:
+                preguntas = "; ".join(pregunta for pregunta, _ in sesion.resumen)
+                mensajes.append({"role": "system", "content": f"Preguntas anteriores del usuario en esta conversación: {preguntas}"})
+            for usuario, asistente, _ in sesion.turnos:
+                mensajes.append({"role": "user", "content": usuario})
+                mensajes.append({"role": "assistant", "content": asistente})
+            return mensajes
+
+    def pregunta_pendiente(self, telefono):
+        with self._lock:
+            sesion = self._obtener(telefono)
+            return sesion.pendiente if sesion is not None else None
+
+    def agregar_turno(self, telefono, mensaje, respuesta, accion=None):
+        """Guarda el turno y recorta la sesión a su presupuesto de tokens."""
+        usuario, asistente = _recortar(mensaje), _recortar(respuesta)
+        tokens = contar_tokens(usuario) + contar_tokens(asistente)
+        with self._lock:
+            sesion = self._obtener(telefono, crear=True)
+            if accion == "ofrecer_escalamiento":
+                sesion.pendiente = usuario
+            elif accion is not None:
+                sesion.pendiente = None
+
+            sesion.turnos.append((usuario, asistente, tokens))
+            sesion.tokens_turnos += tokens
+            # Los turnos más antiguos que no caben quedan solo como pregunta en el resumen
+            while len(sesion.turnos) > 1 and sesion.tokens_turnos + sesion.tokens_resumen > self.presupuesto_tokens:
+                usuario_antiguo, _, tokens_antiguos = sesion.turnos.pop(0)
+                sesion.tokens_turnos -= tokens_antiguos
+                tokens_pregunta = contar_tokens(usuario_antiguo)
+                sesion.resumen.append((usuario_antiguo, tokens_pregunta))
+                sesion.tokens_resumen += tokens_pregunta
+                while sesion.resumen and sesion.tokens_resumen > self.tokens_resumen:
+                    sesion.tokens_resumen -= sesion.resumen.pop(0)[1]
+            self._purgar()
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "sesiones": len(self._sesiones),
+                "max_sesiones": self.max_sesiones,
+                "tokens_promedio": round(
+                    sum(s.tokens_turnos + s.tokens_resumen for s in self._sesiones.values()) / len(self._sesiones), 1
+                ) if self._sesiones else 0,
+                "expiradas": self.expiradas,
+                "desalojadas": self.desalojadas,
+            }
@@ -0,0 +1,128 @@
+"""
+Tareas posteriores a la respuesta (envío a WhatsApp, registro y escalamiento).
+Cada tipo de tarea tiene su propia cola, su propio número de trabajadores y su propio
+pool de hilos para el trabajo bloqueante (MySQL, Outlook, requests), así que el
+registro no le quita hilos al envío de mensajes. Las corrutinas (p. ej. Runner.run de
+los agentes de registro) se ejecutan directamente en el event loop del servidor, sin
+crear un loop nuevo por tarea. Al apagar el servidor se espera a que las colas se vacíen.
+"""
+
+import os
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+# Trabajadores simultáneos por tipo de tarea
+CONCURRENCIA_TAREAS = {
+    "envio": int(os.getenv("CONCURRENCIA_ENVIO", 8)),
+    "registro": int(os.getenv("CONCURRENCIA_REGISTRO", 4)),
+    "escalamiento": int(os.getenv("CONCURRENCIA_ESCALAMIENTO", 2)),
+}
+# Con la cola llena, `encolar` espera (contrapresión) en vez de crecer sin límite
+MAX_TAREAS_EN_COLA = int(os.getenv("MAX_TAREAS_EN_COLA", 1000))
+# Segundos que se espera al apagar para terminar las tareas pendientes
+ESPERA_CIERRE_TAREAS = float(os.getenv("ESPERA_CIERRE_TAREAS", 30))
+
+
+class EjecutorTareas:
+    """Colas por tipo de tarea con trabajadores async; `iniciar` y `detener` van en el ciclo de vida de FastAPI."""
+
+    def __init__(self, concurrencia=CONCURRENCIA_TAREAS, max_en_cola=MAX_TAREAS_EN_COLA):
+        self.concurrencia = dict(concurrencia)
+        self.colas = {tipo: asyncio.Queue(maxsize=max_en_cola) for tipo in self.concurrencia}
+        self.pools = {
+            tipo: ThreadPoolExecutor(max_workers=n, thread_name_prefix=f"tarea_{tipo}")
+            for tipo, n in self.concurrencia.items()
+        }
+        self.metricas = {
+            tipo: {"encoladas": 0, "en_curso": 0, "completadas": 0, "fallidas": 0,
+                   "max_en_cola": 0, "espera_ms_total": 0.0}
+            for tipo in self.concurrencia
+        }
+        self.trabajadores = []
+
+    def hilos(self, tipo):
+        """Pool de hilos del tipo de tarea, para el trabajo bloqueante de sus corrutinas."""
+        return self.pools[tipo]
+
+    def iniciar(self):
+        if self.trabajadores:
+            return
+        for tipo, n in self.concurrencia.items():
+            for _ in range(n):
+                self.trabajadores.append(asyncio.ensure_future(self._trabajador(tipo)))
+
+    async def encolar(self, tipo, funcion, *args, **kwargs):
+        """
+        Agrega una tarea; `funcion` puede ser una corrutina o una función bloqueante.
+        Devuelve un future que se resuelve en True/False cuando la tarea termina (esperarlo es opcional).
+        """
+        terminada = asyncio.get_running_loop().create_future()
+        await self.colas[tipo].put((time.perf_counter(), funcion, args, kwargs, terminada))
+        metricas = self.metricas[tipo]
+        metricas["encoladas"] += 1
+        metricas["max_en_cola"] = max(metricas["max_en_cola"], self.colas[tipo].qsize())
+        return terminada
+
+    async def _trabajador(self, tipo):
+        loop = asyncio.get_running_loop()
+        cola = self.colas[tipo]
+        metricas = self.metricas[tipo]
+        while True:
+            encolada, funcion, args, kwargs, terminada = await cola.get()
+            exito = False
+            metricas["en_curso"] += 1
+            metricas["espera_ms_total"] += (time.perf_counter() - encolada) * 1000
+            try:
+                if asyncio.iscoroutinefunction(funcion):
+                    resultado = await funcion(*args, **kwargs)
+                else:
+                    resultado = await loop.run_in_executor(self.pools[tipo], functools.partial(funcion, *args, **kwargs))
+                # Las funciones de registro informan el error en el resultado en vez de lanzarlo
+                if isinstance(resultado, dict) and resultado.get("status") == "error":
+                    raise RuntimeError(resultado.get("message"))
+                metricas["completadas"] += 1
+                exito = True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metricas["fallidas"] += 1
+                print(f"❌ Tarea '{tipo}' ({getattr(funcion, '__name__', funcion)}) falló: {e}")
+            finally:
+                metricas["en_curso"] -= 1
+                if not terminada.done():
+                    terminada.set_result(exito)
+                cola.task_done()
+
+    async def detener(self, espera=ESPERA_CIERRE_TAREAS):
+        """Espera a que se vacíen las colas (hasta `espera` segundos) y detiene los trabajadores."""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(cola.join() for cola in self.colas.values())), espera)
+        except asyncio.TimeoutError:
+            pendientes = {tipo: cola.qsize() for tipo, cola in self.colas.items() if cola.qsize()}
+            print(f"Advertencia: se apagó con tareas pendientes: {pendientes}")
+        for trabajador in self.trabajadores:
+            trabajador.cancel()
+        await asyncio.gather(*self.trabajadores, return_exceptions=True)
+        self.trabajadores = []
+        for pool in self.pools.values():
+            pool.shutdown(wait=False)
+
+    def estadisticas(self):
+        resultado = {}
+        for tipo, metricas in self.metricas.items():
+            iniciadas = metricas["completadas"] + metricas["fallidas"] + metricas["en_curso"]
+            resultado[tipo] = {
+                "en_cola": self.colas[tipo].qsize(),
+                "en_curso": metricas["en_curso"],
+                "encoladas": metricas["encoladas"],
+                "completadas": metricas["completadas"],
+                "fallidas": metricas["fallidas"],
+                "max_en_cola": metricas["max_en_cola"],
+                "espera_promedio_ms": round(metricas["espera_ms_total"] / iniciadas, 1) if iniciadas else None,
+            }
+        return resultado
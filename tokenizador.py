@@ -0,0 +1,36 @@
+"""
+Conteo de tokens compartido por la ingesta, el armado del contexto y las sesiones.
+tiktoken descarga el vocabulario la primera vez; sin red (benchmarks, staging
+aislado) se usa una estimación conservadora de 3 caracteres por token.
+"""
+
+import tiktoken
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+# Tokenizador de los modelos text-embedding-3
+CODIFICACION_EMBEDDINGS = "cl100k_base"
+# Tokenizador de gpt-4o / gpt-4o-mini
+CODIFICACION_CHAT = "o200k_base"
+
+_codificadores = {}
+
+
+def obtener_codificador(codificacion=CODIFICACION_CHAT):
+    """tiktoken para `codificacion`, o False si no se pudo cargar el vocabulario (p. ej. sin red)."""
+    codificador = _codificadores.get(codificacion)
+    if codificador is None:
+        try:
+            codificador = tiktoken.get_encoding(codificacion)
+        except Exception as e:
+            print(f"Advertencia: No se pudo cargar el tokenizador {codificacion} ({type(e).__name__}); se estimarán los tokens.")
+            codificador = False
+        _codificadores[codificacion] = codificador
+    return codificador
+
+def contar_tokens(texto, codificacion=CODIFICACION_CHAT):
+    codificador = obtener_codificador(codificacion)
+    if codificador is False:
+        return len(texto) // 3 + 1
+    return len(codificador.encode(texto, disallowed_special=()))
@@ -0,0 +1,177 @@
+"""
+Ingesta continua: vigila la carpeta de políticas y reingesta cuando cambia.
+Agrupa las ráfagas de eventos (copiar un PDF grande genera varios) y espera a que la
+carpeta quede quieta antes de llamar a la ingesta incremental, que solo procesa los
+PDFs agregados, modificados o eliminados. Al terminar avisa a los servidores en
+URLS_RECARGA para que relean la lista de políticas sin reiniciarse. Si la ingesta
+falla (la API de embeddings caída, un PDF ilegible) los PDFs quedan pendientes y se
+reintentan con backoff exponencial aunque la carpeta no vuelva a cambiar.
+
+Uso:
+    python vigilar_politicas.py
+    MODO_VIGILANCIA=inotify python vigilar_politicas.py   (requiere `watchfiles`)
+"""
+
+import os
+import time
+import chromadb
+import requests
+from dotenv import load_dotenv
+
+from ingest_policies import CARPETA_FILES, DB_PATH, NOMBRE_COLECCION, listar_pdfs, ingestar, cargar_manifest, detectar_cambios
+from proveedores_embeddings import crear_modelo_embeddings
+
+load_dotenv(override=True)
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+# "polling": compara mtime/tamaño cada INTERVALO_VIGILANCIA segundos; "inotify": eventos del SO vía watchfiles
+MODO_VIGILANCIA = os.getenv("MODO_VIGILANCIA", "polling")
+INTERVALO_VIGILANCIA = float(os.getenv("INTERVALO_VIGILANCIA", 2))
+# Segundos sin cambios en la carpeta antes de ingestar (debounce)
+ESPERA_ESTABLE = float(os.getenv("ESPERA_ESTABLE", 3))
+# Endpoints /admin/recargar de los servidores, separados por coma
+URLS_RECARGA = [u.strip() for u in os.getenv("URLS_RECARGA", "http://localhost:8000/admin/recargar").split(",") if u.strip()]
+TOKEN_RECARGA = os.getenv("TOKEN_RECARGA")
+# Espera antes de reintentar una ingesta fallida; se duplica en cada fallo seguido
+REINTENTO_BASE_S = float(os.getenv("REINTENTO_BASE_S", 30))
+REINTENTO_MAX_S = float(os.getenv("REINTENTO_MAX_S", 900))
+
+
+# ==============================================================================
+# DETECCIÓN DE CAMBIOS
+# ==============================================================================
+def instantanea(carpeta=CARPETA_FILES):
+    """{ruta: (mtime_ns, tamaño)} de los PDFs de la carpeta."""
+    estado = {}
+    for ruta in listar_pdfs(carpeta):
+        try:
+            info = os.stat(ruta)
+        except FileNotFoundError:
+            continue
+        estado[ruta] = (info.st_mtime_ns, info.st_size)
+    return estado
+
+def esperar_cambios_polling(carpeta, previa, limite=None):
+    """
+    Bloquea hasta que la carpeta cambie y luego se mantenga estable ESPERA_ESTABLE segundos.
+    Si pasa `limite` (time.monotonic) sin cambios, devuelve `previa`.
+    """
+    actual = previa
+    while actual == previa:
+        if limite is not None and time.monotonic() >= limite:
+            return previa
+        time.sleep(INTERVALO_VIGILANCIA)
+        actual = instantanea(carpeta)
+
+    # Debounce: cada cambio nuevo reinicia la espera
+    ultimo_cambio = time.monotonic()
+    while time.monotonic() - ultimo_cambio < ESPERA_ESTABLE:
+        time.sleep(min(INTERVALO_VIGILANCIA, ESPERA_ESTABLE))
+        nueva = instantanea(carpeta)
+        if nueva != actual:
+            actual = nueva
+            ultimo_cambio = time.monotonic()
+    return actual
+
+def eventos_inotify(carpeta):
+    """
+    Genera una señal por cada ráfaga de eventos sobre PDFs, ya agrupada por watchfiles,
+    y un conjunto vacío cada INTERVALO_VIGILANCIA segundos sin eventos (para los reintentos).
+    """
+    from watchfiles import watch
+    for cambios in watch(carpeta, debounce=int(ESPERA_ESTABLE * 1000), step=200,
+                         watch_filter=lambda _, ruta: ruta.endswith(".pdf"),
+                         rust_timeout=int(INTERVALO_VIGILANCIA * 1000), yield_on_timeout=True):
+        yield cambios
+
+
+# ==============================================================================
+# INGESTA Y AVISO A LOS SERVIDORES
+# ==============================================================================
+def notificar_servidores(urls=URLS_RECARGA, token=TOKEN_RECARGA):
+    for url in urls:
+        try:
+            respuesta = requests.post(url, headers={"X-Token-Recarga": token or ""}, timeout=10)
+            respuesta.raise_for_status()
+            print(f"   Servidor recargado: {url} -> {respuesta.json().get('politicas')}")
+        except requests.exceptions.RequestException as e:
+            print(f"   Advertencia: no se pudo avisar a '{url}': {e}")
+
+def reingestar(carpeta, embeddings_model, coleccion):
+    """
+    Corre la ingesta incremental y devuelve los PDFs que quedaron pendientes: los que
+    fallaron o, si falló la ingesta completa, los que siguen distintos al manifest.
+    """
+    rutas = listar_pdfs(carpeta)
+    try:
+        resumen = ingestar(rutas, embeddings_model, coleccion)
+    except Exception as e:
+        # Un PDF a medio copiar o un error de la API no debe detener la vigilancia
+        print(f"Error en la ingesta: {e}")
+        try:
+            rutas_modificadas, nombres_eliminados, _ = detectar_cambios(listar_pdfs(carpeta), cargar_manifest())
+        except OSError:
+            # Un PDF desapareció mientras se revisaba; el próximo intento lo verá
+            return [os.path.basename(ruta) for ruta in rutas]
+        return sorted({os.path.basename(ruta) for ruta in rutas_modificadas} | set(nombres_eliminados))
+    if resumen["modificados"] > len(resumen["fallidos"]) or resumen["eliminados"]:
+        notificar_servidores()
+    return resumen["fallidos"]
+
+def espera_reintento(fallos_seguidos):
+    return min(REINTENTO_MAX_S, REINTENTO_BASE_S * 2 ** (fallos_seguidos - 1))
+
+def vigilar(carpeta=CARPETA_FILES, modo=MODO_VIGILANCIA):
+    embeddings_model = crear_modelo_embeddings()
+    cliente_chroma = chromadb.PersistentClient(path=DB_PATH)
+    coleccion = cliente_chroma.get_or_create_collection(name=NOMBRE_COLECCION)
+    fallos_seguidos = 0
+    proximo_reintento = None
+
+    def ingestar_y_programar():
+        # Si quedan PDFs pendientes, programa el reintento aunque la carpeta no cambie
+        nonlocal fallos_seguidos, proximo_reintento
+        pendientes = reingestar(carpeta, embeddings_model, coleccion)
+        if not pendientes:
+            fallos_seguidos = 0
+            proximo_reintento = None
+            return
+        fallos_seguidos += 1
+        espera = espera_reintento(fallos_seguidos)
+        proximo_reintento = time.monotonic() + espera
+        print(f"   PDFs pendientes: {pendientes}. Reintento en {espera:.0f}s (fallo {fallos_seguidos}).")
+
+    # Primera pasada: recoge lo que cambió mientras el vigilante estaba detenido
+    ingestar_y_programar()
+    print(f"\nVigilando '{carpeta}' (modo {modo}). Ctrl+C para detener.")
+
+    if modo == "inotify":
+        for cambios in eventos_inotify(carpeta):
+            if cambios:
+                print(f"\nCambios detectados: {sorted(os.path.basename(ruta) for _, ruta in cambios)}")
+            elif proximo_reintento is None or time.monotonic() < proximo_reintento:
+                continue
+            else:
+                print("\nReintentando la ingesta de los PDFs pendientes...")
+            ingestar_y_programar()
+    elif modo == "polling":
+        estado = instantanea(carpeta)
+        while True:
+            nuevo_estado = esperar_cambios_polling(carpeta, estado, proximo_reintento)
+            if nuevo_estado != estado:
+                print(f"\nCambios detectados en '{carpeta}'.")
+            else:
+                print("\nReintentando la ingesta de los PDFs pendientes...")
+            estado = nuevo_estado
+            ingestar_y_programar()
+    else:
+        raise ValueError(f"Modo de vigilancia desconocido: '{modo}'. Usa 'polling' o 'inotify'.")
+
+
+if __name__ == "__main__":
+    try:
+        vigilar()
+    except KeyboardInterrupt:
+        print("\nVigilancia detenida.")